@@ -1,8 +1,62 @@
+import traceback
+import numpy as np
 import mpit.utils.preprocessing as preproc
-import mpit.utils.conversion as conversion
-import mpit.utils.filtering as filtering
+import mpit.utils.checkpoint as checkpoint_utils
 import mpit.core as core
-import mpit.skeleton as skeleton
+
+from mpit.clock import ClockEstimator
+from mpit.pipeline import CAMERAS, get_joint_layout, PipelineConfig, Pipeline
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def preprocess_bracelets(accelerations_dict, acceleration_smooth_window=35, acceleration_smooth_poly=1,
+                         dtype="float64", memory=None, raw=None, verbose=0):
+    """ Extract and smooth bracelets accelerations
+
+    :param accelerations_dict: acceleration data in the format of our dataset
+    :param acceleration_smooth_window: smoothing window for accelerations
+    :param acceleration_smooth_poly: smoothing poly for accelerations
+    :param dtype: floating point precision of the accelerations ("float32" or "float64")
+    :param memory: optional dict filled with the bytes used by the output, under the key 'bracelets'
+    :param raw: optional dict filled with the accelerations before smoothing (same arrays, no copies)
+    :param verbose: if >=1 print logs
+    :return: bracelets accelerations as returned by preprocessing.get_accelerations
+    """
+    pipeline = Pipeline(acceleration_smooth_window=acceleration_smooth_window,
+                        acceleration_smooth_poly=acceleration_smooth_poly, dtype=dtype, verbose=verbose)
+    return pipeline.process_bracelets(accelerations_dict, memory=memory, raw=raw)
+
+
+def process_skeletons(skeletons_frames, camera="Intel",
+                      skeleton_min_duration=5, skeleton_smooth_filter="savgol",
+                      skeleton_smooth_window=7, skeleton_smooth_poly=1,
+                      direction_smooth_filter="savgol",
+                      direction_smooth_window=5, direction_smooth_poly=1,
+                      conversion_smooth_window=3, conversion_smooth_poly=1,
+                      camera_angle=0, skeleton_min_confidence=None, dtype="float64", memory=None, executor=None,
+                      verbose=0):
+    """ Compute the wrist accelerations of the skeletons rotated in the bracelet reference system
+
+    :param skeletons_frames: skeletons data in the format of our dataset
+    :param camera: camera name or joint layout, see get_joint_layout
+    :param skeleton_min_confidence: if not None, wrist and elbow points with lower confidence are discarded
+    :param dtype: floating point precision of positions, directions and accelerations ("float32" or "float64"),
+                  timestamps are always float64
+    :param memory: optional dict filled with the bytes used by the output of each stage
+    :param executor: optional concurrent.futures executor (e.g. ThreadPoolExecutor) processing the skeletons in
+                     parallel inside each stage, the output is the same of the serial processing
+    :return: rotated accelerations as returned by core.get_skeleton_accelerations_rotated
+    """
+    pipeline = Pipeline(camera=camera, skeleton_min_duration=skeleton_min_duration,
+                        skeleton_smooth_filter=skeleton_smooth_filter, skeleton_smooth_window=skeleton_smooth_window,
+                        skeleton_smooth_poly=skeleton_smooth_poly, direction_smooth_filter=direction_smooth_filter,
+                        direction_smooth_window=direction_smooth_window, direction_smooth_poly=direction_smooth_poly,
+                        conversion_smooth_window=conversion_smooth_window,
+                        conversion_smooth_poly=conversion_smooth_poly, camera_angle=camera_angle,
+                        skeleton_min_confidence=skeleton_min_confidence, dtype=dtype, executor=executor,
+                        verbose=verbose)
+    return pipeline.process_skeletons(skeletons_frames, memory=memory)
 
 
 def identify_and_track(skeletons_frames, accelerations_dict, camera="Intel",
@@ -12,39 +66,197 @@ def identify_and_track(skeletons_frames, accelerations_dict, camera="Intel",
                        direction_smooth_filter="savgol",
                        direction_smooth_window=5, direction_smooth_poly=1,
                        conversion_smooth_window=3, conversion_smooth_poly=1,
-                       camera_angle=0, similarity_weight=0.7, verbose=0):
-    assert camera == "Intel" or camera == "Kinect", "Type of camera not valid (Intel or Kinect)"
-    # Select points
-    if camera == 'Intel':
-        elbow = 6
-        wrist = 7
-        tot_points = 18
-    elif camera == 'Kinect':
-        elbow = 5
-        wrist = 6
-        tot_points = 32
-    wrist_points = preproc.get_positions_one_point(skeletons_frames, wrist, tot_points, verbose=verbose)
-    elbow_points = preproc.get_positions_one_point(skeletons_frames, elbow, tot_points, verbose=verbose)
-    accelerations = preproc.get_accelerations(accelerations_dict, verbose=verbose)
-    accelerations = filtering.smooth_accelerations(accelerations, window=acceleration_smooth_window,
-                                                   poly=acceleration_smooth_poly)
-    wrist_points = skeleton.filter_skeletons(wrist_points, min_duration=skeleton_min_duration, verbose=verbose)
-    elbow_points = skeleton.filter_skeletons(elbow_points, min_duration=skeleton_min_duration, verbose=verbose)
-    wrist_points, elbow_points = skeleton.post_process_xy(wrist_points, elbow_points,
-                                                          smooth_filter=skeleton_smooth_filter,
-                                                          window=skeleton_smooth_window,
-                                                          poly=skeleton_smooth_poly,
-                                                          verbose=verbose)
-    wrist_points, elbow_points, directions = skeleton.get_directions(wrist_points,elbow_points,
-                                                                     smooth_filter=direction_smooth_filter,
-                                                                     window=direction_smooth_window,
-                                                                     poly=direction_smooth_poly,
-                                                                     verbose=verbose)
-    skel_accel = conversion.get_skeletons_point_accelerations(wrist_points,
-                                                              window=conversion_smooth_window,
-                                                              poly=conversion_smooth_poly,
-                                                              verbose=verbose)
-    skel_accel_gravity = core.add_gravity_to_skeletons_accelerations(skel_accel, camera_angle, verbose=verbose)
-    skel_accel_rotated = core.get_skeleton_accelerations_rotated(skel_accel_gravity, directions, verbose=verbose)
-    associations = core.do_association(skel_accel_rotated, accelerations, similarity_weight, verbose=verbose)
+                       camera_angle=0, skeleton_min_confidence=None, similarity_weight=0.7,
+                       similarity_min_overlap=None, similarity_band=None, similarity_joint=False, clock=None,
+                       dtype="float64", memory=None, executor=None, intermediates=None, verbose=0):
+    config = PipelineConfig(camera=camera, acceleration_smooth_window=acceleration_smooth_window,
+                            acceleration_smooth_poly=acceleration_smooth_poly,
+                            skeleton_min_duration=skeleton_min_duration, skeleton_smooth_filter=skeleton_smooth_filter,
+                            skeleton_smooth_window=skeleton_smooth_window, skeleton_smooth_poly=skeleton_smooth_poly,
+                            direction_smooth_filter=direction_smooth_filter,
+                            direction_smooth_window=direction_smooth_window,
+                            direction_smooth_poly=direction_smooth_poly,
+                            conversion_smooth_window=conversion_smooth_window,
+                            conversion_smooth_poly=conversion_smooth_poly, camera_angle=camera_angle,
+                            skeleton_min_confidence=skeleton_min_confidence, similarity_weight=similarity_weight,
+                            similarity_min_overlap=similarity_min_overlap, similarity_band=similarity_band,
+                            similarity_joint=similarity_joint, dtype=dtype)
+    pipeline = Pipeline(config, clock=clock, executor=executor, verbose=verbose)
+    return pipeline.run(skeletons_frames, accelerations_dict, memory=memory, intermediates=intermediates)
+
+
+def camera_association_costs(skeletons_frames, accelerations, similarity_weight=0.7, similarity_min_overlap=None,
+                             similarity_band=None, similarity_joint=False, **skeleton_params):
+    """ Process the skeletons of one camera and compare them with the (already preprocessed) bracelets
+
+    :param skeletons_frames: skeletons data in the format of our dataset
+    :param accelerations: bracelets accelerations as returned by preprocess_bracelets
+    :param similarity_weight: weight for derivative comparison
+    :param similarity_min_overlap: minimum temporal overlap for a pair to be compared, see core.do_association
+    :param similarity_band: maximum time difference of the points aligned by DTW, see core.do_association
+    :param similarity_joint: if True raw and derivative are compared with one multi-feature DTW, see
+                             core.association_costs
+    :param skeleton_params: parameters of process_skeletons
+    :return: rotated skeletons accelerations and costs, present, rows, columns as returned by core.association_costs
+    """
+    skel_accel_rotated = process_skeletons(skeletons_frames, **skeleton_params)
+    costs, present, rows, columns = core.association_costs(skel_accel_rotated, accelerations, similarity_weight,
+                                                           min_overlap=similarity_min_overlap, band=similarity_band,
+                                                           joint=similarity_joint)
+    return skel_accel_rotated, costs, present, rows, columns
+
+
+def identify_and_track_multi_camera(cameras, accelerations_dict,
+                                    acceleration_smooth_window=35, acceleration_smooth_poly=1,
+                                    skeleton_min_duration=5, skeleton_smooth_filter="savgol",
+                                    skeleton_smooth_window=7, skeleton_smooth_poly=1,
+                                    direction_smooth_filter="savgol",
+                                    direction_smooth_window=5, direction_smooth_poly=1,
+                                    conversion_smooth_window=3, conversion_smooth_poly=1,
+                                    skeleton_min_confidence=None, similarity_weight=0.7, similarity_min_overlap=None,
+                                    similarity_band=None, similarity_joint=False, overlapping_views=True,
+                                    dtype="float64", executor=None, verbose=0):
+    """ Identify and track skeletons of several cameras with the same set of bracelets. Bracelets are preprocessed
+        once, the skeletons of each camera are processed in parallel and the association is solved jointly.
+
+    :param cameras: dictionary of skeleton streams as
+                    {<camera_name1>: {'frames': skeletons data in the format of our dataset,
+                                      'camera': camera name or joint layout (see get_joint_layout, Default: "Intel"),
+                                      'camera_angle': camera rotation angle (Default: 0)},
+                     <camera_name2>: {...}, ...
+                    }
+    :param accelerations_dict: acceleration data in the format of our dataset
+    :param overlapping_views: if True the cameras watch overlapping areas and a bracelet can be associated to one
+                              skeleton per camera, otherwise to only one skeleton among all cameras
+    :param executor: concurrent.futures executor running the cameras, if None a thread pool with one worker per
+                     camera is used
+    :param verbose: if >=1 print logs
+    :return: list of association Dicts as returned by identify_and_track, with the additional key 'camera'
+    """
+    accelerations = preprocess_bracelets(accelerations_dict, acceleration_smooth_window=acceleration_smooth_window,
+                                         acceleration_smooth_poly=acceleration_smooth_poly, dtype=dtype,
+                                         verbose=verbose)
+    names = list(cameras)
+    if len(names) == 0:
+        return []
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=len(names))
+    try:
+        futures = [executor.submit(camera_association_costs, cameras[name]['frames'], accelerations,
+                                   similarity_weight=similarity_weight,
+                                   similarity_min_overlap=similarity_min_overlap,
+                                   similarity_band=similarity_band,
+                                   similarity_joint=similarity_joint,
+                                   camera=cameras[name].get('camera', "Intel"),
+                                   skeleton_min_duration=skeleton_min_duration,
+                                   skeleton_smooth_filter=skeleton_smooth_filter,
+                                   skeleton_smooth_window=skeleton_smooth_window,
+                                   skeleton_smooth_poly=skeleton_smooth_poly,
+                                   direction_smooth_filter=direction_smooth_filter,
+                                   direction_smooth_window=direction_smooth_window,
+                                   direction_smooth_poly=direction_smooth_poly,
+                                   conversion_smooth_window=conversion_smooth_window,
+                                   conversion_smooth_poly=conversion_smooth_poly,
+                                   camera_angle=cameras[name].get('camera_angle', 0),
+                                   skeleton_min_confidence=skeleton_min_confidence, dtype=dtype, verbose=verbose)
+                   for name in names]
+        results = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+    # Stack the cost matrices of all cameras, columns are the same bracelets for all of them
+    columns = list(accelerations)
+    rotated = [result[0] for result in results]
+    costs = np.vstack([result[1].reshape(-1, len(columns)) for result in results])
+    present = np.vstack([result[2].reshape(-1, len(columns)) for result in results])
+    rows = [(k, id_sk) for k, result in enumerate(results) for id_sk in result[3]]
+    groups = np.array([k for k, _ in rows], dtype=int) if overlapping_views else None
+    associations = []
+    for row, col in core.solve_association(costs, present, groups=groups):
+        k, id_sk = rows[row]
+        association = core.association_from_match(rotated[k], id_sk, columns[col])
+        association['camera'] = names[k]
+        associations.append(association)
+    if verbose >= 1:
+        print("Multi-camera association computed for", str(len(names)), "camera(s)")
+        print('------------------------------------------------------------')
     return associations
+
+
+def identify_and_track_windows(skeletons_frames, accelerations_dict, window=10, memory=None, checkpoint=None,
+                               checkpoint_interval=10, clock_sync=False, on_window=None, verbose=0, **params):
+    """ Run identify_and_track on consecutive chunks of a recording
+
+    :param skeletons_frames: skeletons data in the format of our dataset, ordered by timestamp
+    :param accelerations_dict: acceleration data in the format of our dataset, ordered by timestamp
+    :param window: chunk size in seconds
+    :param memory: optional dict filled with the peak bytes used by the output of each stage over the chunks
+    :param checkpoint: optional JSON file where the state of the run (associations of the completed chunks, next chunk,
+                       memory peaks and clock estimates) is saved. If it exists and was saved with the same inputs and
+                       parameters, the run resumes from the first unfinished chunk
+    :param checkpoint_interval: number of chunks between two checkpoints, the last chunk is always saved
+    :param clock_sync: if True the clock offset and drift of each bracelet are estimated over the chunks and the
+                       bracelets timestamps are corrected before the comparison (see clock.ClockEstimator), use it with
+                       a similarity_band
+    :param on_window: optional function called after each chunk as on_window(ts, associations, intermediates), with
+                      the start timestamp of the chunk, its associations and the outputs of its stages (see
+                      Pipeline.run), e.g. to keep diagnostics.plot_data of each chunk without processing the recording
+                      again. It is not called for the chunks in which the PIT failed or restored from the checkpoint
+    :param verbose: if >=1 print logs
+    :param params: parameters of identify_and_track
+    :return: list of the associations of each chunk, chunks in which the PIT failed are not included
+    """
+    if len(skeletons_frames) == 0:
+        return []
+    # Get first and last timestamp
+    first_ts = skeletons_frames[0]['timestamp']
+    last_ts = skeletons_frames[-1]['timestamp']
+    associations_list = []
+    next_ts = int(first_ts)
+    clock = ClockEstimator() if clock_sync else None
+    # The executor does not change the results, it is not part of the checksum
+    executor = params.pop('executor', None)
+    # Constants of the configuration are computed once for all the chunks
+    pipeline = Pipeline(clock=clock, executor=executor, verbose=verbose, **params)
+    digest = None
+    if checkpoint is not None:
+        digest = checkpoint_utils.checksum(skeletons_frames, accelerations_dict,
+                                           dict(params, window=window, clock_sync=clock_sync))
+        state = checkpoint_utils.load_checkpoint(checkpoint, digest, verbose=verbose)
+        if state is not None:
+            associations_list = state['associations_list']
+            next_ts = state['next_ts']
+            if memory is not None:
+                memory.update(state['memory'])
+            if clock is not None:
+                clock.load_state(state['clock'])
+    skeletons_ts = np.array([frame['timestamp'] for frame in skeletons_frames])
+    accelerations_ts = np.array([sample['timestamp'] for sample in accelerations_dict])
+    # Do PIT per chunk
+    completed = 0
+    for ts in range(next_ts, int(last_ts), window):
+        skeletons = preproc.get_window(skeletons_frames, skeletons_ts, ts, ts + window)
+        accels = preproc.get_window(accelerations_dict, accelerations_ts, ts, ts + window)
+        window_memory = {} if memory is not None else None
+        intermediates = {} if on_window is not None else None
+        try:
+            associations = pipeline.run(skeletons, accels, memory=window_memory, intermediates=intermediates)
+        except Exception as err:
+            print(traceback.format_exc())
+            print("Error in the PIT:", err, "Please contact repositories authors: "
+                                            "https://github.com/matteo-bastico/Multisensor-PIT")
+        else:
+            associations_list.append(associations)
+            if on_window is not None:
+                on_window(ts, associations, intermediates)
+        if memory is not None:
+            for stage, nbytes in window_memory.items():
+                memory[stage] = max(memory.get(stage, 0), nbytes)
+        completed += 1
+        if checkpoint is not None and (completed % checkpoint_interval == 0 or ts + window >= int(last_ts)):
+            checkpoint_utils.save_checkpoint(checkpoint, {'checksum': digest, 'next_ts': ts + window,
+                                                          'associations_list': associations_list,
+                                                          'memory': memory if memory is not None else {},
+                                                          'clock': clock.state() if clock is not None else None})
+    return associations_list
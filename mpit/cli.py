@@ -0,0 +1,211 @@
+import time
+
+# Taken before importing anything else to measure the cold start of the command
+START_TIME = time.perf_counter()
+
+import os
+import sys
+import json
+import pickle
+import argparse
+import mpit.algorithms as algorithms
+import mpit.utils.kernels as kernels
+
+from mpit import __version__
+from concurrent.futures import ThreadPoolExecutor
+from mpit.utils.precision import memory_report
+from mpit.diagnostics import plot_data
+
+
+def build_parser():
+    """ Build the command line parser of the Multisensor-PIT, with the same parameters of identify_and_track
+
+    :return: argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(prog="mpit", description="Multisensor Person Identification and Tracking (PIT)")
+    parser.add_argument("-s", "--skeleton-path", type=str, default="Data/reidentification/case1_1/skeleton.json",
+                        help="Skeleton data in the specified format")
+    parser.add_argument("-a", "--accelerometer-path", type=str, default="Data/reidentification/case1_1/accel.json",
+                        help="Accelerometer data in the specified format")
+    parser.add_argument("-w", "--window", default=10, type=int,
+                        help="Chunk size in seconds.")
+    parser.add_argument("-c", "--camera", default="Intel", type=str,
+                        help="Camera acquiring skeleton data (Intel or Kinect")
+    parser.add_argument("-asw", "--acceleration-smooth-window", default=35, type=int,
+                        help="Smoothing window for acceleration.")
+    parser.add_argument("-asp", "--acceleration-smooth-poly", default=1, type=int,
+                        help="Smoothing poly for acceleration.")
+    parser.add_argument("-smd", "--skeleton-min-duration", default=5, type=int,
+                        help="Minimum duration for a skeleton to be considered valid")
+    parser.add_argument("-ssf", "--skeleton-smooth-filter", default="savgol", type=str,
+                        help="Smoothing filter for skeletons")
+    parser.add_argument("-ssw", "--skeleton-smooth-window", default=7, type=int,
+                        help="Smoothing window for skeletons.")
+    parser.add_argument("-ssp", "--skeleton-smooth-poly", default=1, type=int,
+                        help="Smoothing poly for skeletons.")
+    parser.add_argument("-dsw", "--direction-smooth-window", default=5, type=int,
+                        help="Smoothing window for directions.")
+    parser.add_argument("-dsp", "--direction-smooth-poly", default=1, type=int,
+                        help="Smoothing poly for directions.")
+    parser.add_argument("-dsf", "--direction-smooth-filter", default="savgol", type=str,
+                        help="Smoothing filter for skeletons")
+    parser.add_argument("-csw", "--conversion-smooth-window", default=3, type=int,
+                        help="Smoothing window for conversion of skeletons positions to accelerations.")
+    parser.add_argument("-csp", "--conversion-smooth-poly", default=1, type=int,
+                        help="Smoothing window for conversion of skeletons positions to accelerations.")
+    parser.add_argument("-ca", "--camera-angle", default=0, type=int,
+                        help="Camera rotation angle on the y-axis.")
+    parser.add_argument("-smc", "--skeleton-min-confidence", default=None, type=float,
+                        help="Minimum confidence of the wrist and elbow points, lower ones are discarded.")
+    parser.add_argument("-v", "--verbose", default=0, type=int,
+                        help=">=1 for console logs.")
+    parser.add_argument("-sw", "--similarity-weight", default=0.7, type=float,
+                        help="Weight for similarities measures.")
+    parser.add_argument("-smo", "--similarity-min-overlap", default=None, type=float,
+                        help="Minimum time overlap in seconds for a skeleton and a bracelet to be compared.")
+    parser.add_argument("-sb", "--similarity-band", default=None, type=float,
+                        help="Maximum time difference in seconds of the samples aligned by DTW (Default: unbounded).")
+    parser.add_argument("-sj", "--similarity-joint", action="store_true",
+                        help="Compare raw and derivative accelerations with one multi-feature DTW weighted by "
+                             "--similarity-weight instead of two DTW.")
+    parser.add_argument("-dt", "--dtype", default="float64", type=str, choices=["float32", "float64"],
+                        help="Floating point precision of the pipeline arrays.")
+    parser.add_argument("-k", "--kernels", default="auto", type=str, choices=["auto", "numba", "numpy"],
+                        help="Implementation of DTW, differentiation and rotation: numba kernels (pip install "
+                             "mpit[fast]) or NumPy, auto uses numba if installed.")
+    return parser
+
+
+def pit_params(args):
+    """ Extract the parameters of identify_and_track from the parsed arguments
+
+    :param args: arguments parsed with the parser of build_parser
+    :return: dict of identify_and_track keyword arguments
+    """
+    return {'camera': args.camera,
+            'acceleration_smooth_window': args.acceleration_smooth_window,
+            'acceleration_smooth_poly': args.acceleration_smooth_poly,
+            'skeleton_min_duration': args.skeleton_min_duration,
+            'skeleton_smooth_filter': args.skeleton_smooth_filter,
+            'skeleton_smooth_window': args.skeleton_smooth_window,
+            'skeleton_smooth_poly': args.skeleton_smooth_poly,
+            'direction_smooth_filter': args.direction_smooth_filter,
+            'direction_smooth_window': args.direction_smooth_window,
+            'direction_smooth_poly': args.direction_smooth_poly,
+            'conversion_smooth_window': args.conversion_smooth_window,
+            'conversion_smooth_poly': args.conversion_smooth_poly,
+            'camera_angle': args.camera_angle,
+            'skeleton_min_confidence': args.skeleton_min_confidence,
+            'similarity_weight': args.similarity_weight,
+            'similarity_min_overlap': args.similarity_min_overlap,
+            'similarity_band': args.similarity_band,
+            'similarity_joint': args.similarity_joint,
+            'dtype': args.dtype}
+
+
+def load_data(path):
+    """ Load skeletons or accelerations data of our dataset, in .json or pickled .txt format
+
+    :param path: path of the data file
+    :return: list of skeletons frames or acceleration measurements
+    """
+    if path.endswith(".txt"):
+        with open(path, "rb") as fs:
+            return pickle.load(fs)
+    with open(path, "r") as fs:
+        return json.load(fs)
+
+
+def add_checkpoint_arguments(parser):
+    """ Add the checkpoint and clock arguments of identify_and_track_windows to parser """
+    parser.add_argument("-ck", "--checkpoint", default=None, type=str,
+                        help="JSON file where to save the progress, a killed run restarted with the same inputs and "
+                             "parameters resumes from the first unfinished chunk (Default: None)")
+    parser.add_argument("-cki", "--checkpoint-interval", default=10, type=int,
+                        help="Number of chunks between two checkpoints (Default: 10)")
+    parser.add_argument("-cs", "--clock-sync", action="store_true",
+                        help="Estimate the clock offset and drift of each bracelet over the chunks and correct its "
+                             "timestamps, use it with --similarity-band.")
+    return parser
+
+
+def main(argv=None):
+    parser = add_checkpoint_arguments(build_parser())
+    parser.add_argument("-o", "--output", default=None, type=str,
+                        help="JSON file where to save the associations of each chunk (Default: standard output)")
+    parser.add_argument("-p", "--plot", action="store_true",
+                        help="Plot the associations, requires matplotlib (pip install mpit[plot]).")
+    parser.add_argument("-ps", "--plot-step", default=1, type=int,
+                        help="Keep one frame every plot-step for the plot, to plot long recordings (Default: 1).")
+    parser.add_argument("-t", "--timings", action="store_true",
+                        help="Print startup, loading and processing times to standard error.")
+    parser.add_argument("-m", "--memory-report", action="store_true",
+                        help="Print the peak memory used by each stage over the chunks to standard error.")
+    parser.add_argument("-j", "--jobs", default=1, type=int,
+                        help="Number of threads processing the skeletons of each chunk in parallel (Default: 1).")
+    parser.add_argument("-tl", "--timeline", default=None, type=str,
+                        help="Association timeline file (.npz) where to append the associations, created if missing.")
+    parser.add_argument("--version", action="version", version="%(prog)s " + __version__)
+    args = parser.parse_args(argv)
+    kernels.set_backend(args.kernels)
+    startup_time = time.perf_counter() - START_TIME
+    skeleton_list = load_data(args.skeleton_path)
+    accel_list = load_data(args.accelerometer_path)
+    loading_time = time.perf_counter() - START_TIME - startup_time
+    memory = {} if args.memory_report else None
+    executor = ThreadPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    # The plot uses the positions computed by the PIT, decimated while processing the chunks
+    windows = []
+    on_window = None
+    if args.plot:
+        def on_window(ts, associations, intermediates):
+            windows.append(plot_data(intermediates, step=args.plot_step))
+    try:
+        associations_list = algorithms.identify_and_track_windows(skeleton_list, accel_list, window=args.window,
+                                                                  memory=memory, checkpoint=args.checkpoint,
+                                                                  checkpoint_interval=args.checkpoint_interval,
+                                                                  clock_sync=args.clock_sync, on_window=on_window,
+                                                                  executor=executor, verbose=args.verbose,
+                                                                  **pit_params(args))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    processing_time = time.perf_counter() - START_TIME - startup_time - loading_time
+    output = json.dumps(associations_list, default=float)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as fs:
+            fs.write(output)
+    if args.timeline is not None:
+        from mpit.timeline import AssociationTimeline
+        # np.savez adds the .npz extension if missing
+        path = args.timeline if args.timeline.endswith(".npz") else args.timeline + ".npz"
+        timeline = AssociationTimeline.load(path) if os.path.exists(path) else AssociationTimeline()
+        timeline.extend(associations_list)
+        timeline.save(path)
+    if args.timings:
+        print("Startup: %.3f s, loading: %.3f s, processing: %.3f s" % (startup_time, loading_time, processing_time),
+              file=sys.stderr)
+    if args.memory_report:
+        print(memory_report(memory), file=sys.stderr)
+    if args.plot:
+        try:
+            import matplotlib.pyplot as plt
+            from mpit.visualization import plot_associations
+        except ImportError:
+            parser.error("plotting requires matplotlib, install it with: pip install mpit[plot]")
+        # Chunks restored from a checkpoint have no plot data, the skeletons are then processed again
+        plot_associations(skeleton_list, associations_list, camera=args.camera,
+                          skeleton_min_duration=args.skeleton_min_duration,
+                          skeleton_smooth_filter=args.skeleton_smooth_filter,
+                          skeleton_smooth_window=args.skeleton_smooth_window,
+                          skeleton_smooth_poly=args.skeleton_smooth_poly,
+                          windows=windows if len(windows) == len(associations_list) else None,
+                          verbose=args.verbose)
+        plt.show()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import threading
+import numpy as np
+
+import mpit.utils.tracks as tracks
+
+
+def magnitude(ax, ay, az):
+    """ Norm of 3D accelerations, independent from the orientation of the sensor """
+    return np.sqrt(np.square(ax) + np.square(ay) + np.square(az))
+
+
+def cross_correlation(t_ref, ref, t_sig, sig, center, max_lag, resolution):
+    """ Normalized cross-correlation of two irregularly sampled signals for lags in [center - max_lag,
+        center + max_lag]: sig(t + lag) is compared with ref(t)
+
+    :param t_ref: np.array of timestamps of the reference signal
+    :param ref: np.array of values of the reference signal
+    :param t_sig: np.array of timestamps of the lagged signal
+    :param sig: np.array of values of the lagged signal
+    :param center: center of the lags searched
+    :param max_lag: maximum distance of the lags from center, in seconds
+    :param resolution: sampling step of the common grid and of the lags, in seconds
+    :return: (lag, correlation, span) of the correlation peak, None if the signals do not overlap enough. span is
+             the duration of the compared reference
+    """
+    lo = max(t_ref[0], t_sig[0] - center + max_lag)
+    hi = min(t_ref[-1], t_sig[-1] - center - max_lag)
+    if hi - lo < 2 * resolution:
+        return None
+    grid = np.arange(lo, hi, resolution)
+    n_lags = int(round(2 * max_lag / resolution)) + 1
+    ref_grid = np.interp(grid, t_ref, ref)
+    ref_grid -= ref_grid.mean()
+    ref_norm = np.sqrt(np.dot(ref_grid, ref_grid))
+    sig_grid = np.interp(grid[0] + center - max_lag + np.arange(len(grid) + n_lags - 1) * resolution, t_sig, sig)
+    # Sum and sum of squares of each lagged window, from cumulative sums, to normalize the correlation
+    n = len(grid)
+    cumsum = np.concatenate(([0], np.cumsum(sig_grid)))
+    cumsum_sq = np.concatenate(([0], np.cumsum(np.square(sig_grid))))
+    window_sum = cumsum[n:] - cumsum[:-n]
+    window_var = (cumsum_sq[n:] - cumsum_sq[:-n]) - np.square(window_sum) / n
+    sig_norm = np.sqrt(np.maximum(window_var, 0))
+    # ref_grid has zero mean, so the mean of each window does not contribute
+    correlation = np.correlate(sig_grid, ref_grid, mode='valid')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = correlation / (ref_norm * sig_norm)
+    correlation[~np.isfinite(correlation)] = -1
+    peak = int(np.argmax(correlation))
+    shift = 0.0
+    # Parabolic interpolation of the peak between the grid lags
+    if 0 < peak < len(correlation) - 1:
+        left, middle, right = correlation[peak - 1:peak + 2]
+        denominator = left - 2 * middle + right
+        if denominator < 0:
+            shift = 0.5 * (left - right) / denominator
+    return center - max_lag + (peak + shift) * resolution, float(correlation[peak]), hi - lo
+
+
+class ClockEstimator:
+    """ Session-level estimate of the clock offset and drift of each bracelet with respect to the camera.
+
+        For every window, the magnitude of each bracelet acceleration is cross-correlated with the magnitude of the
+        wrist accelerations of the skeletons (both include gravity, so the magnitudes do not depend on the
+        orientations). The best matching skeleton gives one measurement (time, offset) weighted by its correlation,
+        and the offset of each bracelet is modelled as offset(t) = offset + drift * t, fitted by weighted least squares
+        on all the measurements with running sums, so each update is O(1). The search of the next windows is centered
+        on the current estimate.
+
+        correct returns the bracelet accelerations with timestamps in the camera clock (t - offset(t)), so that the
+        similarity can use a narrow alignment band (see comparison.compare_accel).
+    """
+
+    def __init__(self, max_offset=2.0, resolution=0.02, min_span=5.0, min_correlation=0.5, min_drift_span=60.0,
+                 forgetting=1.0):
+        """
+
+        :param max_offset: maximum distance in seconds of the measured offsets from the current estimate
+        :param resolution: resolution in seconds of the cross-correlation
+        :param min_span: minimum overlap in seconds between a skeleton and a bracelet to measure the offset
+        :param min_correlation: minimum normalized correlation for a measurement to be used
+        :param min_drift_span: minimum time in seconds between the first and last measurements to estimate the drift,
+                               before only the offset is estimated
+        :param forgetting: weight multiplying the past measurements at each new one, 1 keeps all of them
+        """
+        self.max_offset = max_offset
+        self.resolution = resolution
+        self.min_span = min_span
+        self.min_correlation = min_correlation
+        self.min_drift_span = min_drift_span
+        self.forgetting = forgetting
+        self.t_ref = None
+        # Running sums [w, w*t, w*o, w*t*t, w*t*o, first t, last t] of the measurements of each bracelet
+        self.sums = {}
+        self.lock = threading.Lock()
+
+    def offset(self, id_br, t):
+        """ Estimated offset of a bracelet clock at camera times t
+
+        :param id_br: bracelet identifier
+        :param t: timestamp or np.array of timestamps
+        :return: offset in seconds (0 if the bracelet has no estimate)
+        """
+        if id_br not in self.sums:
+            return np.zeros_like(t, dtype=np.float64) if np.ndim(t) else 0.0
+        w, wt, wo, wtt, wto, first, last = self.sums[id_br]
+        mean_t = wt / w
+        mean_o = wo / w
+        drift = 0.0
+        variance = wtt / w - mean_t * mean_t
+        if last - first >= self.min_drift_span and variance > 0:
+            drift = (wto / w - mean_t * mean_o) / variance
+        return mean_o + drift * (np.asarray(t, dtype=np.float64) - self.t_ref - mean_t)
+
+    def measure(self, rotated_accel, accelerations):
+        """ Measure the offset of each bracelet in one window
+
+        :param rotated_accel: skeleton accelerations as returned by core.get_skeleton_accelerations_rotated
+        :param accelerations: bracelets accelerations as returned by preprocessing.get_accelerations
+        :return: dict {<id_br>: (time, offset, correlation)} of the bracelets with a valid measurement
+        """
+        skeletons = []
+        for id_sk, skeleton in rotated_accel['skeletons'].items():
+            t = tracks.track_t(rotated_accel, id_sk, len(skeleton['au']))
+            valid = ~np.isnan(skeleton['au'])
+            if valid.sum() > 1 and t[valid][-1] - t[valid][0] >= self.min_span:
+                # The acceleration of the frames i, i + 1, i + 2 has the timestamp of frame i (forward differences),
+                # it is centered one frame later, otherwise the offsets are overestimated by one frame
+                t = t + np.median(np.diff(t))
+                skeletons.append((t[valid], magnitude(skeleton['au'][valid], skeleton['av'][valid],
+                                                      skeleton['aw'][valid]).astype(np.float64)))
+        measurements = {}
+        for id_br, accel in accelerations.items():
+            if len(accel['t']) < 2:
+                continue
+            center = float(self.offset(id_br, accel['t'][len(accel['t']) // 2]))
+            br_magnitude = magnitude(accel['ax'], accel['ay'], accel['az']).astype(np.float64)
+            best = None
+            for t, sk_magnitude in skeletons:
+                result = cross_correlation(t, sk_magnitude, accel['t'], br_magnitude, center, self.max_offset,
+                                           self.resolution)
+                if result is None or result[2] < self.min_span:
+                    continue
+                if best is None or result[1] > best[2]:
+                    best = ((t[0] + t[-1]) / 2, result[0], result[1])
+            if best is not None and best[2] >= self.min_correlation:
+                measurements[id_br] = best
+        return measurements
+
+    def add(self, id_br, t, offset, weight=1.0):
+        """ Add one measurement of the offset of a bracelet at camera time t """
+        if self.t_ref is None:
+            self.t_ref = float(t)
+        t = float(t) - self.t_ref
+        if id_br in self.sums:
+            sums = self.sums[id_br]
+            for k in range(5):
+                sums[k] *= self.forgetting
+            sums[5] = min(sums[5], t)
+            sums[6] = max(sums[6], t)
+        else:
+            sums = self.sums[id_br] = [0.0, 0.0, 0.0, 0.0, 0.0, t, t]
+        sums[0] += weight
+        sums[1] += weight * t
+        sums[2] += weight * offset
+        sums[3] += weight * t * t
+        sums[4] += weight * t * offset
+
+    def update(self, rotated_accel, accelerations):
+        """ Measure the offsets in one window and update the estimates
+
+        :return: measurements as returned by measure
+        """
+        with self.lock:
+            measurements = self.measure(rotated_accel, accelerations)
+            for id_br, (t, offset, correlation) in measurements.items():
+                self.add(id_br, t, offset, weight=correlation)
+        return measurements
+
+    def correct(self, accelerations):
+        """ Convert the bracelets timestamps to the camera clock
+
+        :param accelerations: bracelets accelerations as returned by preprocessing.get_accelerations
+        :return: new dict with the same arrays and corrected timestamps
+        """
+        with self.lock:
+            corrected = {}
+            for id_br, accel in accelerations.items():
+                corrected[id_br] = dict(accel)
+                if id_br in self.sums:
+                    corrected[id_br]['t'] = accel['t'] - self.offset(id_br, accel['t'])
+        return corrected
+
+    def state(self):
+        """ JSON serializable state, see load_state """
+        return {'t_ref': self.t_ref, 'sums': [[id_br, sums] for id_br, sums in self.sums.items()]}
+
+    def load_state(self, state):
+        """ Restore the estimates saved with state """
+        self.t_ref = state['t_ref']
+        self.sums = {id_br: list(sums) for id_br, sums in state['sums']}
@@ -1,9 +1,207 @@
-import similaritymeasures
-
+import functools
 import numpy as np
+import mpit.utils.tracks as tracks
+import mpit.utils.kernels as kernels
+
+from mpit.utils.conversion import finite_difference, valid_difference
+
+
+def dtw_series(t, values, t0):
+    """ Build the series (time, value) compared with DTW. Times are taken relative to t0 in float64, so that the
+        series can be stored in the precision of values (absolute timestamps do not fit in float32)
+
+    :param t: np.array of timestamps
+    :param values: np.array of values, or np.array((len(t), features)) for several features
+    :param t0: reference timestamp
+    :return: np.array((len(t), 1 + features)) in the dtype of values
+    """
+    return np.column_stack((t - t0, values)).astype(values.dtype, copy=False)
+
+
+def band_limits(t_exp, t_num, band):
+    """ Columns of each row of the DTW cost matrix inside a time band, widened where needed so that a warping path
+        between the first and the last points always exists
+
+    :param t_exp: np.array of n sorted times of the rows
+    :param t_num: np.array of m sorted times of the columns
+    :param band: half width of the band in seconds, np.inf for the full matrix
+    :return: lo, hi: np.array of n int64, the columns of row i are lo[i] .. hi[i]
+    """
+    m = len(t_num)
+    lo = np.minimum(np.searchsorted(t_num, t_exp - band, side='left'), m - 1).astype(np.int64)
+    hi = np.searchsorted(t_num, t_exp + band, side='right').astype(np.int64) - 1
+    lo[0] = 0
+    hi[-1] = m - 1
+    hi = np.maximum.accumulate(np.maximum(hi, lo))
+    # Each row must start at most one column after the end of the previous one
+    lo[1:] = np.minimum(lo[1:], hi[:-1] + 1)
+    return lo, hi
+
+
+def dtw_banded(exp_data, num_data, band, weights=None):
+    """ DTW distance of similaritymeasures.dtw (euclidean) restricted to the pairs of points closer than band in time
+        (first column), see band_limits. Each row of the accumulated cost is computed at once, with the prefix minimum
+        form of the recurrence d[i, j] = c[i, j] + min(d[i - 1, j], d[i - 1, j - 1], d[i, j - 1]), so the cost is
+        O(len(exp_data)) vectorized steps on the band instead of a Python loop on the full matrix.
 
+    :param exp_data: np.array((n, 2)) of (time, value) sorted by time, or np.array((n, 1 + features))
+    :param num_data: np.array((m, 2)) of (time, value) sorted by time, or np.array((m, 1 + features))
+    :param band: half width of the band in seconds
+    :param weights: if not None, weights of the features, the local cost of two points is their weighted euclidean
+                    distance sqrt(dt^2 + sum_k weights[k] * dv_k^2)
+    :return: DTW distance
+    """
+    t_exp = exp_data[:, 0].astype(np.float64)
+    v_exp = exp_data[:, 1:].astype(np.float64)
+    t_num = num_data[:, 0].astype(np.float64)
+    v_num = num_data[:, 1:].astype(np.float64)
+
+    def local_cost(i, first, last):
+        dt = t_num[first:last + 1] - t_exp[i]
+        if weights is None:
+            return np.hypot(dt, v_num[first:last + 1, 0] - v_exp[i, 0])
+        return np.sqrt(np.square(dt) + np.square(v_num[first:last + 1] - v_exp[i]) @ weights)
+
+    lo, hi = band_limits(t_exp, t_num, band)
+    prev = np.cumsum(local_cost(0, 0, hi[0]))
+    for i in range(1, len(t_exp)):
+        cost = local_cost(i, lo[i], hi[i])
+        # Previous row on the columns lo[i] - 1 .. hi[i], inf outside of its band
+        above = np.full(hi[i] - lo[i] + 2, np.inf)
+        first = max(lo[i - 1], lo[i] - 1)
+        last = min(hi[i - 1], hi[i])
+        if last >= first:
+            above[first - lo[i] + 1:last - lo[i] + 2] = prev[first - lo[i - 1]:last - lo[i - 1] + 1]
+        # Best of the vertical and diagonal moves, then horizontal moves as a prefix minimum
+        best = np.minimum(above[1:], above[:-1])
+        accumulated = np.cumsum(cost)
+        prev = accumulated + np.minimum.accumulate(best - accumulated + cost)
+    return prev[-1]
+
+
+def dtw_distance(sk_data, bracelet_data, band=None, weights=None):
+    """ DTW distance between a skeleton and a bracelet series
+
+    :param sk_data: np.array((n, 2)) of (time, value), see dtw_series
+    :param bracelet_data: np.array((m, 2)) of (time, value)
+    :param band: if not None, maximum time difference in seconds of the aligned points (see dtw_banded), otherwise
+                 the DTW is unconstrained (same distance of similaritymeasures.dtw)
+    :param weights: if not None, weights of the features of multi-feature series, see dtw_banded
+    :return: DTW distance
+    """
+    if band is None:
+        band = np.inf
+    compiled = kernels.get_kernels()
+    if compiled is None:
+        return dtw_banded(sk_data, bracelet_data, band, weights=weights)
+    t_exp = np.ascontiguousarray(sk_data[:, 0], dtype=np.float64)
+    t_num = np.ascontiguousarray(bracelet_data[:, 0], dtype=np.float64)
+    lo, hi = band_limits(t_exp, t_num, band)
+    weights = np.ones(1) if weights is None else np.asarray(weights, dtype=np.float64)
+    return compiled['dtw'](t_exp, np.ascontiguousarray(sk_data[:, 1:], dtype=np.float64), t_num,
+                           np.ascontiguousarray(bracelet_data[:, 1:], dtype=np.float64), weights, lo, hi)
+
+
+def derivative_of(data, der_data):
+    """ True if der_data is at the times of data without the last one, as the finite differences of data """
+    return len(der_data) == len(data) - 1 > 0 and np.array_equal(der_data[:, 0], data[:-1, 0])
 
-def compare_accel(skeleton_accel, bracelet_accel):
+
+def dtw_distances(sk_data, bracelet_data, sk_der, bracelet_der, band=None):
+    """ DTW distances of the values and of the derivatives of a skeleton and a bracelet. With the numba kernels, if
+        the derivatives are at the times of the values without the last one, both distances are computed in one pass
+        over the cost matrix (see kernels.dtw_fused)
+
+    :param sk_data: np.array((n, 2)) of (time, value) of the skeleton, see dtw_series
+    :param bracelet_data: np.array((m, 2)) of (time, value) of the bracelet
+    :param sk_der: np.array of (time, derivative) of the skeleton
+    :param bracelet_der: np.array of (time, derivative) of the bracelet
+    :param band: maximum time difference of the aligned points, see dtw_distance
+    :return: (values distance, derivatives distance)
+    """
+    compiled = kernels.get_kernels()
+    if compiled is None or not derivative_of(sk_data, sk_der) or not derivative_of(bracelet_data, bracelet_der):
+        return dtw_distance(sk_data, bracelet_data, band=band), dtw_distance(sk_der, bracelet_der, band=band)
+    if band is None:
+        band = np.inf
+    t_exp = np.ascontiguousarray(sk_data[:, 0], dtype=np.float64)
+    t_num = np.ascontiguousarray(bracelet_data[:, 0], dtype=np.float64)
+    lo, hi = band_limits(t_exp, t_num, band)
+    lo_d, hi_d = band_limits(t_exp[:-1], t_num[:-1], band)
+    return compiled['dtw_fused'](t_exp, np.ascontiguousarray(sk_data[:, 1], dtype=np.float64),
+                                 np.ascontiguousarray(sk_der[:, 1], dtype=np.float64), t_num,
+                                 np.ascontiguousarray(bracelet_data[:, 1], dtype=np.float64),
+                                 np.ascontiguousarray(bracelet_der[:, 1], dtype=np.float64), lo, hi, lo_d, hi_d)
+
+
+def time_spans(skeleton_accel, bracelet_accel):
+    """ Compute the valid time span of each skeleton (from its non-NaN 'au') and of each bracelet
+
+    :param skeleton_accel: dictionary of accelerations in the format of compare_accel
+    :param bracelet_accel: dictionary of bracelet accelerations in the format of compare_accel
+    :return: skeleton_spans: dict {<id_sk>: (first_ts, last_ts)}, skeletons without valid values are not included
+             bracelet_spans: dict {<id_br>: (first_ts, last_ts)}, bracelets without samples are not included
+    """
+    skeleton_spans = {}
+    for id_sk in skeleton_accel['skeletons']:
+        au = skeleton_accel['skeletons'][id_sk]['au']
+        valids = np.flatnonzero(~np.isnan(au))
+        skeletons_ts = tracks.track_t(skeleton_accel, id_sk, len(au))
+        if valids.size > 0:
+            skeleton_spans[id_sk] = (skeletons_ts[valids[0]], skeletons_ts[valids[-1]])
+    bracelet_spans = {}
+    for id_br in bracelet_accel:
+        if len(bracelet_accel[id_br]['t']) > 0:
+            bracelet_spans[id_br] = (np.min(bracelet_accel[id_br]['t']), np.max(bracelet_accel[id_br]['t']))
+    return skeleton_spans, bracelet_spans
+
+
+def overlapping_pairs(skeleton_spans, bracelet_spans, min_overlap=0):
+    """ Find the skeleton-bracelet pairs whose time spans overlap at least min_overlap seconds. Bracelets spans are
+        indexed by start time so that, for each skeleton, only the bracelets starting before its end are checked.
+
+    :param skeleton_spans: dict {<id_sk>: (first_ts, last_ts)}
+    :param bracelet_spans: dict {<id_br>: (first_ts, last_ts)}
+    :param min_overlap: minimum overlap in seconds for a pair to be compared
+    :return: dict {<id_sk>: {<id_br>: (overlap_start, overlap_end), ...}, ...} with only the overlapping pairs
+    """
+    ids_br = list(bracelet_spans)
+    starts = np.array([bracelet_spans[id_br][0] for id_br in ids_br], dtype=float)
+    ends = np.array([bracelet_spans[id_br][1] for id_br in ids_br], dtype=float)
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+    pairs = {}
+    for id_sk, (sk_start, sk_end) in skeleton_spans.items():
+        # Bracelets starting after sk_end - min_overlap can not overlap enough
+        candidates = order[:np.searchsorted(sorted_starts, sk_end - min_overlap, side='right')]
+        lo = np.maximum(starts[candidates], sk_start)
+        hi = np.minimum(ends[candidates], sk_end)
+        keep = hi - lo >= min_overlap
+        pairs[id_sk] = {ids_br[j]: (lo_j, hi_j) for j, lo_j, hi_j in zip(candidates[keep], lo[keep], hi[keep])}
+    return pairs
+
+
+def compare_skeleton_accel(skeleton_accel, bracelet_accel, id_sk, band=None):
+    """ Similarities of one skeleton with every bracelet on the full window, see compare_accel
+
+    :return: dict {<id_br>: similarity}, NaN for bracelets without samples
+    """
+    skeletons_ts = skeleton_accel['t']
+    t0 = skeletons_ts[0] if len(skeletons_ts) > 0 else 0
+    au = skeleton_accel['skeletons'][id_sk]['au']
+    valids = np.where(~np.isnan(au))
+    sk_data = dtw_series(tracks.track_t(skeleton_accel, id_sk, len(au))[valids], au[valids], t0)
+    similarities = {}
+    for id_brac in bracelet_accel:
+        if len(bracelet_accel[id_brac]['t']) > 0:
+            bracelet_data = dtw_series(bracelet_accel[id_brac]['t'], bracelet_accel[id_brac]['ax'], t0)
+            similarities[id_brac] = dtw_distance(sk_data, bracelet_data, band=band)
+        else:
+            similarities[id_brac] = np.nan
+    return similarities
+
+
+def compare_accel(skeleton_accel, bracelet_accel, min_overlap=None, band=None, executor=None):
     """
     
     :param skeleton_accel: dictionary of accelerations in the following format:
@@ -24,30 +222,71 @@ def compare_accel(skeleton_accel, bracelet_accel):
                                           }
                               <id_br2>: {...}, ...
                               }
+    :param min_overlap: if not None, minimum temporal overlap in seconds between a skeleton and a bracelet to be
+                        compared. Pairs overlapping less are not included in the output and DTW is computed only on
+                        the overlapping span. If None, every skeleton is compared with every bracelet on the full window
+    :param band: if not None, DTW only aligns points closer than band seconds, for bracelets timestamps already
+                 corrected to the camera clock (see clock.ClockEstimator)
+    :param executor: optional concurrent.futures executor comparing the skeletons in parallel
     :return: dict with DTW similarities
     """
+    if min_overlap is not None:
+        return compare_accel_overlapping(skeleton_accel, bracelet_accel, min_overlap, band=band, executor=executor)
+    ids = list(skeleton_accel['skeletons'])
+    return dict(zip(ids, tracks.map_tracks(functools.partial(compare_skeleton_accel, skeleton_accel, bracelet_accel,
+                                                             band=band),
+                                           ids, executor=executor)))
+
+
+def compare_skeleton_accel_overlapping(skeleton_accel, bracelet_accel, pairs, empty_br, id_sk, band=None):
+    """ Similarities of one skeleton with the bracelets overlapping it, see compare_accel_overlapping
+
+    :param pairs: overlapping pairs as returned by overlapping_pairs
+    :param empty_br: list of the bracelets without samples
+    :return: dict {<id_br>: similarity}
+    """
     skeletons_ts = skeleton_accel['t']
-    reid_dict = {}
-    for id_sk in skeleton_accel['skeletons']:
-        valids = np.where(~np.isnan(skeleton_accel['skeletons'][id_sk]['au']))
-        if len(valids) > 0:
-            reid_dict[id_sk] = {}
-            for id_brac in bracelet_accel:
-                if len(bracelet_accel[id_brac]['t']) > 0:
-                    sk_data = np.zeros((len(valids[0]), 2))
-                    sk_data[:, 0] = skeletons_ts[valids]
-                    sk_data[:, 1] = skeleton_accel['skeletons'][id_sk]['au'][valids]
-                    bracelet_data = np.zeros((len(bracelet_accel[id_brac]['t']), 2))
-                    bracelet_data[:, 0] = bracelet_accel[id_brac]['t']
-                    bracelet_data[:, 1] = bracelet_accel[id_brac]['ax']
-                    dtw, d = similaritymeasures.dtw(sk_data, bracelet_data)
-                    reid_dict[id_sk][id_brac] = dtw
-                else:
-                    reid_dict[id_sk][id_brac] = np.nan
-    return reid_dict
-
-
-def compare_accel_der(skeleton_accel, bracelet_accel):
+    t0 = skeletons_ts[0] if len(skeletons_ts) > 0 else 0
+    au = skeleton_accel['skeletons'][id_sk]['au']
+    sk_ts = tracks.track_t(skeleton_accel, id_sk, len(au))
+    similarities = {}
+    for id_brac, (lo, hi) in pairs[id_sk].items():
+        sk_valids = ~np.isnan(au) & (sk_ts >= lo) & (sk_ts <= hi)
+        br_ts = bracelet_accel[id_brac]['t']
+        br_valids = (br_ts >= lo) & (br_ts <= hi)
+        # Spans overlap but there are no samples in common span
+        if not sk_valids.any() or not br_valids.any():
+            continue
+        sk_data = dtw_series(sk_ts[sk_valids], au[sk_valids], t0)
+        bracelet_data = dtw_series(br_ts[br_valids], bracelet_accel[id_brac]['ax'][br_valids], t0)
+        similarities[id_brac] = dtw_distance(sk_data, bracelet_data, band=band)
+    for id_brac in empty_br:
+        similarities[id_brac] = np.nan
+    return similarities
+
+
+def compare_accel_overlapping(skeleton_accel, bracelet_accel, min_overlap=0, band=None, executor=None):
+    """ Same as compare_accel but only on the skeleton-bracelet pairs overlapping in time at least min_overlap
+        seconds, restricting DTW to the overlapping span. Bracelets without samples get NaN similarities as in
+        compare_accel.
+
+    :param skeleton_accel: dictionary of accelerations in the format of compare_accel
+    :param bracelet_accel: dictionary of bracelet accelerations in the format of compare_accel
+    :param min_overlap: minimum overlap in seconds for a pair to be compared
+    :param band: maximum time difference of the aligned points, see compare_accel
+    :param executor: optional concurrent.futures executor comparing the skeletons in parallel
+    :return: dict with DTW similarities of the overlapping pairs
+    """
+    skeleton_spans, bracelet_spans = time_spans(skeleton_accel, bracelet_accel)
+    pairs = overlapping_pairs(skeleton_spans, bracelet_spans, min_overlap)
+    empty_br = [id_br for id_br in bracelet_accel if id_br not in bracelet_spans]
+    ids = list(pairs)
+    return dict(zip(ids, tracks.map_tracks(functools.partial(compare_skeleton_accel_overlapping, skeleton_accel,
+                                                             bracelet_accel, pairs, empty_br, band=band),
+                                           ids, executor=executor)))
+
+
+def compare_accel_der(skeleton_accel, bracelet_accel, min_overlap=None, band=None, executor=None):
     """
     
     :param skeleton_accel: dictionary of accelerations in the following format:
@@ -68,17 +307,16 @@ def compare_accel_der(skeleton_accel, bracelet_accel):
                                           }
                               <id_br2>: {...}, ...
                               }
+    :param min_overlap: minimum temporal overlap in seconds between compared pairs, see compare_accel
+    :param band: maximum time difference of the aligned points, see compare_accel
+    :param executor: optional concurrent.futures executor comparing the skeletons in parallel
     :return: dict with DTW similarities
     """
     # Derivative
     for id_sk in skeleton_accel['skeletons']:
         # Diff skeleton accels only in u
-        valids = np.where(~np.isnan(skeleton_accel['skeletons'][id_sk]['au']))
-        der_valids = np.diff(skeleton_accel['skeletons'][id_sk]['au'][valids]) / np.diff(skeleton_accel['t'][valids])
-        der_tot = np.empty(len(skeleton_accel['skeletons'][id_sk]['au']) - 1)
-        der_tot[:] = np.nan
-        der_tot[valids[0][:-1]] = der_valids
-        skeleton_accel['skeletons'][id_sk]['au'] = der_tot
+        au = skeleton_accel['skeletons'][id_sk]['au']
+        skeleton_accel['skeletons'][id_sk]['au'] = valid_difference(tracks.track_t(skeleton_accel, id_sk, len(au)), au)
     skeleton_accel['t'] = skeleton_accel['t'][:-1]
     invalid_br = []
     for id_br in bracelet_accel:
@@ -88,9 +326,217 @@ def compare_accel_der(skeleton_accel, bracelet_accel):
                   " from derivative comparison." % str(id_br))
             invalid_br.append(id_br)
         else:
-            bracelet_accel[id_br]['ax'] = np.diff(bracelet_accel[id_br]['ax']) / np.diff(bracelet_accel[id_br]['t'])
+            bracelet_accel[id_br]['ax'] = finite_difference(bracelet_accel[id_br]['t'], bracelet_accel[id_br]['ax'])
             bracelet_accel[id_br]['t'] = bracelet_accel[id_br]['t'][:-1]
     # Remove invalid bracelets
     for id_br in invalid_br:
         del bracelet_accel[id_br]
-    return compare_accel(skeleton_accel, bracelet_accel)
+    return compare_accel(skeleton_accel, bracelet_accel, min_overlap=min_overlap, band=band, executor=executor)
+
+
+def skeleton_features(skeleton_accel, id_sk):
+    """ Series of a skeleton compared by compare_accel_fused, computed once: the non-NaN values of 'au' and their
+        finite differences (the same of compare_accel_der)
+
+    :param skeleton_accel: dictionary of accelerations in the format of compare_accel
+    :param id_sk: skeleton identifier
+    :return: {'raw': (t, au), 'der': (t, derivatives), 'joint': (t, np.array((n, 2)) of (au, derivative))}, the
+             derivatives and the joint series are at the times of the values without the last one
+    """
+    au = skeleton_accel['skeletons'][id_sk]['au']
+    valids = ~np.isnan(au)
+    t = tracks.track_t(skeleton_accel, id_sk, len(au))[valids]
+    au = au[valids]
+    der = finite_difference(t, au)
+    keep = ~np.isnan(der)
+    t_der = t[:-1][keep]
+    return {'raw': (t, au), 'der': (t_der, der[keep]),
+            'joint': (t_der, np.stack((au[:-1][keep], der[keep]), axis=-1))}
+
+
+def bracelet_features(bracelet_accel):
+    """ Series of the bracelets compared by compare_accel_fused, computed once: the values of 'ax' and their finite
+        differences. Bracelets with equal timestamps have no derivatives, as in compare_accel_der.
+
+    :param bracelet_accel: dictionary of bracelet accelerations in the format of compare_accel
+    :return: dict {<id_br>: series as returned by skeleton_features}, 'der' and 'joint' are None for the bracelets
+             without derivatives
+    """
+    features = {}
+    for id_br, accel in bracelet_accel.items():
+        features[id_br] = {'raw': (accel['t'], accel['ax']), 'der': None, 'joint': None}
+        if 0 in np.diff(accel['t']):
+            print("WARNING: Bracelet data of %s contain equal timestamps, removed"
+                  " from derivative comparison." % str(id_br))
+            continue
+        der = finite_difference(accel['t'], accel['ax'])
+        t_der = accel['t'][:-1]
+        features[id_br]['der'] = (t_der, der)
+        features[id_br]['joint'] = (t_der, np.stack((accel['ax'][:-1], der), axis=-1))
+    return features
+
+
+def pair_series(sk_series, br_series, t0, span=None):
+    """ DTW series of a skeleton and a bracelet, restricted to span if given
+
+    :param sk_series: (t, values) of the skeleton
+    :param br_series: (t, values) of the bracelet
+    :param t0: reference timestamp, see dtw_series
+    :param span: optional (start, end) timestamps of the compared span
+    :return: (sk_data, bracelet_data), None if one of them has no samples
+    """
+    (sk_t, sk_values), (br_t, br_values) = sk_series, br_series
+    if span is not None:
+        sk_in = (sk_t >= span[0]) & (sk_t <= span[1])
+        br_in = (br_t >= span[0]) & (br_t <= span[1])
+        sk_t, sk_values, br_t, br_values = sk_t[sk_in], sk_values[sk_in], br_t[br_in], br_values[br_in]
+    if len(sk_t) == 0 or len(br_t) == 0:
+        return None
+    return dtw_series(sk_t, sk_values, t0), dtw_series(br_t, br_values, t0)
+
+
+def feature_pairs(skeletons, bracelets, feature, min_overlap=None):
+    """ Skeleton-bracelet pairs compared on one feature, see compare_accel_fused
+
+    :param skeletons: dict {<id_sk>: series as returned by skeleton_features}
+    :param bracelets: dict {<id_br>: series as returned by bracelet_features}
+    :param feature: 'raw', 'der' or 'joint'
+    :param min_overlap: minimum overlap in seconds of the pairs, if None every pair is compared on the full window
+    :return: pairs: dict {<id_sk>: {<id_br>: span or None for the full window}}
+             empty_br: list of the bracelets without samples, with NaN similarities
+    """
+    bracelet_spans = {id_br: (np.min(series[feature][0]), np.max(series[feature][0]))
+                      for id_br, series in bracelets.items()
+                      if series[feature] is not None and len(series[feature][0]) > 0}
+    empty_br = [id_br for id_br, series in bracelets.items()
+                if series[feature] is not None and id_br not in bracelet_spans]
+    if min_overlap is None:
+        full = dict.fromkeys(bracelet_spans)
+        return {id_sk: full for id_sk in skeletons}, empty_br
+    skeleton_spans = {id_sk: (series[feature][0][0], series[feature][0][-1])
+                      for id_sk, series in skeletons.items() if len(series[feature][0]) > 0}
+    return overlapping_pairs(skeleton_spans, bracelet_spans, min_overlap), empty_br
+
+
+def compare_skeleton_fused(skeletons, bracelets, t0, raw_pairs, der_pairs, band, id_sk):
+    """ Raw and derivative similarities of one skeleton, both distances of a pair are computed together (see
+        dtw_distances)
+
+    :param raw_pairs: (pairs, empty_br) of the raw values as returned by feature_pairs
+    :param der_pairs: (pairs, empty_br) of the derivatives
+    :return: (raw similarities, derivative similarities) as dict {<id_br>: similarity}
+    """
+    series = {}
+    for feature, (pairs, _) in (('raw', raw_pairs), ('der', der_pairs)):
+        series[feature] = {}
+        for id_br, span in pairs.get(id_sk, {}).items():
+            data = pair_series(skeletons[id_sk][feature], bracelets[id_br][feature], t0, span)
+            if data is not None:
+                series[feature][id_br] = data
+    raw, der = {}, {}
+    for id_br, (sk_data, bracelet_data) in series['raw'].items():
+        if id_br in series['der']:
+            raw[id_br], der[id_br] = dtw_distances(sk_data, bracelet_data, *series['der'][id_br], band=band)
+        else:
+            raw[id_br] = dtw_distance(sk_data, bracelet_data, band=band)
+    for id_br, (sk_data, bracelet_data) in series['der'].items():
+        if id_br not in der:
+            der[id_br] = dtw_distance(sk_data, bracelet_data, band=band)
+    for similarities, (_, empty_br) in ((raw, raw_pairs), (der, der_pairs)):
+        for id_br in empty_br:
+            similarities[id_br] = np.nan
+    return raw, der
+
+
+def compare_accel_fused(skeleton_accel, bracelet_accel, min_overlap=None, band=None, executor=None):
+    """ Same results of compare_accel and compare_accel_der, without modifying (or copying) the accelerations. The
+        series of each skeleton and bracelet and their derivatives are computed once, and the raw and derivative
+        distances of each pair are computed together.
+
+    :param skeleton_accel: dictionary of accelerations in the format of compare_accel
+    :param bracelet_accel: dictionary of bracelet accelerations in the format of compare_accel
+    :param min_overlap: minimum temporal overlap in seconds between compared pairs, see compare_accel
+    :param band: maximum time difference of the aligned points, see compare_accel
+    :param executor: optional concurrent.futures executor comparing the skeletons in parallel
+    :return: (raw similarities, derivative similarities) as returned by compare_accel and compare_accel_der
+    """
+    skeletons_ts = skeleton_accel['t']
+    t0 = skeletons_ts[0] if len(skeletons_ts) > 0 else 0
+    skeletons = {id_sk: skeleton_features(skeleton_accel, id_sk) for id_sk in skeleton_accel['skeletons']}
+    bracelets = bracelet_features(bracelet_accel)
+    raw_pairs = feature_pairs(skeletons, bracelets, 'raw', min_overlap)
+    der_pairs = feature_pairs(skeletons, bracelets, 'der', min_overlap)
+    ids = list(raw_pairs[0])
+    results = tracks.map_tracks(functools.partial(compare_skeleton_fused, skeletons, bracelets, t0, raw_pairs,
+                                                  der_pairs, band), ids, executor=executor)
+    raw = {id_sk: result[0] for id_sk, result in zip(ids, results)}
+    der = {id_sk: result[1] for id_sk, result in zip(ids, results) if id_sk in der_pairs[0]}
+    return raw, der
+
+
+def compare_skeleton_joint(skeletons, bracelets, t0, pairs, weights, band, id_sk):
+    """ Joint similarities of one skeleton, see compare_accel_joint
+
+    :param pairs: (pairs, empty_br) of the raw values as returned by feature_pairs
+    :return: dict {<id_br>: similarity}
+    """
+    similarities = {}
+    for id_br, span in pairs[0].get(id_sk, {}).items():
+        data = None
+        if bracelets[id_br]['joint'] is not None:
+            data = pair_series(skeletons[id_sk]['joint'], bracelets[id_br]['joint'], t0, span)
+        if data is not None:
+            similarities[id_br] = dtw_distance(*data, band=band, weights=weights)
+            continue
+        # Without derivatives (equal timestamps or single samples) only the values are compared
+        data = pair_series(skeletons[id_sk]['raw'], bracelets[id_br]['raw'], t0, span)
+        if data is not None:
+            similarities[id_br] = dtw_distance(*data, band=band)
+    for id_br in pairs[1]:
+        similarities[id_br] = np.nan
+    return similarities
+
+
+def compare_accel_joint(skeleton_accel, bracelet_accel, weight, min_overlap=None, band=None, executor=None):
+    """ Multi-feature DTW similarities: one DTW aligns the values and their derivatives together, on the times of
+        the derivatives, with the local cost sqrt(dt^2 + weight * dv^2 + (1 - weight) * dd^2). It replaces the two DTW
+        of compare_accel_fused (with two different alignments) by one.
+
+    :param skeleton_accel: dictionary of accelerations in the format of compare_accel
+    :param bracelet_accel: dictionary of bracelet accelerations in the format of compare_accel
+    :param weight: weight of the values, the derivatives have weight 1 - weight
+    :param min_overlap: minimum temporal overlap in seconds between compared pairs, see compare_accel
+    :param band: maximum time difference of the aligned points, see compare_accel
+    :param executor: optional concurrent.futures executor comparing the skeletons in parallel
+    :return: dict with DTW similarities, with the pairs of compare_accel
+    """
+    skeletons_ts = skeleton_accel['t']
+    t0 = skeletons_ts[0] if len(skeletons_ts) > 0 else 0
+    skeletons = {id_sk: skeleton_features(skeleton_accel, id_sk) for id_sk in skeleton_accel['skeletons']}
+    bracelets = bracelet_features(bracelet_accel)
+    pairs = feature_pairs(skeletons, bracelets, 'raw', min_overlap)
+    ids = list(pairs[0])
+    return dict(zip(ids, tracks.map_tracks(functools.partial(compare_skeleton_joint, skeletons, bracelets, t0, pairs,
+                                                             np.array([weight, 1 - weight]), band),
+                                           ids, executor=executor)))
+
+
+def similarity_matrix(similarities, skeleton_ids, bracelet_ids):
+    """ Convert the nested dict returned by compare_accel into an id-indexed cost matrix
+
+    :param similarities: dict with DTW similarities as returned by compare_accel
+                         {<id_sk1>: {<id_br1>: value, <id_br2>: value, ...}, ...}
+    :param skeleton_ids: list of skeleton identifiers, one per row
+    :param bracelet_ids: list of bracelet identifiers, one per column
+    :return: costs: np.array((len(skeleton_ids), len(bracelet_ids))) of similarities, NaN where missing
+             present: boolean np.array of the same shape, True where the pair is in similarities
+    """
+    costs = np.full((len(skeleton_ids), len(bracelet_ids)), np.nan)
+    present = np.zeros(costs.shape, dtype=bool)
+    columns = {id_br: j for j, id_br in enumerate(bracelet_ids)}
+    for i, id_sk in enumerate(skeleton_ids):
+        row = similarities.get(id_sk, {})
+        cols = [columns[id_br] for id_br in row if id_br in columns]
+        costs[i, cols] = [row[id_br] for id_br in row if id_br in columns]
+        present[i, cols] = True
+    return costs, present
@@ -1,15 +1,34 @@
 import math
-import copy
+import functools
 import numpy as np
-import pandas as pd
+import mpit.utils.tracks as tracks
 
-from mpit.utils.conversion import rotation_matrix
-from mpit.comparison import compare_accel, compare_accel_der
-from scipy.constants import g
-from scipy.optimize import linear_sum_assignment
+from mpit.utils.conversion import rotation_matrix, rotation_axes, project
+from mpit.comparison import compare_accel_fused, compare_accel_joint, similarity_matrix
 
+# Standard acceleration of gravity in m/s^2 (same value of scipy.constants.g, which is slow to import)
+g = 9.80665
 
-def add_gravity_to_skeletons_accelerations(accelerations, angle=0, verbose=1):
+
+def gravity_vector(angle=0):
+    """ Acceleration of gravity in the camera coordinates
+
+    :param angle: angle of the camera with respect to the ground plane between -90 and 90 degrees
+    :return: np.array(3) of the gravity acceleration components
+    """
+    # degree to radiant
+    angle_rad = math.radians(angle)
+    # default acceleration is in same direction of original y-axis (parallel to the ground pointing down)
+    acc_g = [0, -g, 0]
+    # rotation axis is -x
+    axis = [1, 0, 0]
+    # Generate rotation matrix around axis with angle angle_rad
+    rot_mat = rotation_matrix(axis, angle_rad)
+    # Obtain gravity accelerations components
+    return np.dot(rot_mat, acc_g)
+
+
+def add_gravity_to_skeletons_accelerations(accelerations, angle=0, gravity=None, verbose=1):
     """
 
     :param accelerations: dictionary in the following format:
@@ -23,19 +42,11 @@ def add_gravity_to_skeletons_accelerations(accelerations, angle=0, verbose=1):
                                          ... }
                             }
     :param angle: angle of the camera with respect to the ground plane between -90 and 90 degrees
+    :param gravity: optional gravity vector precomputed with gravity_vector(angle)
     :param verbose: if >=1 print logs
     :return: dictionary in the same format of the input with added gravity accelerations
     """
-    # degree to radiant
-    angle_rad = math.radians(angle)
-    # default acceleration is in same direction of original y-axis (parallel to the ground pointing down)
-    acc_g = [0, -g, 0]
-    # rotation axis is -x
-    axis = [1, 0, 0]
-    # Generate rotation matrix around axis with angle angle_rad
-    rot_mat = rotation_matrix(axis, angle_rad)
-    # Obtain gravity accelerations components
-    acc_g = np.dot(rot_mat, acc_g)
+    acc_g = gravity_vector(angle) if gravity is None else gravity
     for id_br in accelerations['skeletons']:
         accelerations['skeletons'][id_br]['ax'] += acc_g[0]
         accelerations['skeletons'][id_br]['ay'] += acc_g[1]
@@ -46,7 +57,32 @@ def add_gravity_to_skeletons_accelerations(accelerations, angle=0, verbose=1):
     return accelerations
 
 
-def get_skeleton_accelerations_rotated(accelerations, directions, verbose=1):
+def rotate_skeleton_accelerations(accelerations, directions, id_sk):
+    """ Rotate the accelerations of one skeleton, see get_skeleton_accelerations_rotated
+
+    :return: dict {'u', 'v', 'w', 'au', 'av', 'aw'} of the skeleton
+    """
+    # Computations are done in the precision of the directions
+    u, v, w = rotation_axes(directions['skeletons'][id_sk])
+    acc_skeleton = accelerations['skeletons'][id_sk]
+    acc_skeleton = np.transpose(np.vstack((acc_skeleton['ax'], acc_skeleton['ay'], acc_skeleton['az']))).astype(
+        u.dtype, copy=False)
+    # Axes on the frames of the accelerations (the last two frames of the directions are lost for
+    # differentiation)
+    start = tracks.track_start(accelerations, id_sk)
+    direction_start = tracks.track_start(directions, id_sk)
+    u_accel = tracks.crop(u, direction_start, start, len(acc_skeleton))
+    v_accel = tracks.crop(v, direction_start, start, len(acc_skeleton))
+    w_accel = tracks.crop(w, direction_start, start, len(acc_skeleton))
+    # Extract accelerations in new coordinates
+    au, av, aw = project(acc_skeleton, u_accel, v_accel, w_accel)
+    # Save accelerations and also axis, sparse tracks store all of them on the frames of the accelerations
+    if 'starts' in accelerations:
+        u, v, w = u_accel, v_accel, w_accel
+    return {'u': u, 'v': v, 'w': w, 'au': au, 'av': av, 'aw': aw}
+
+
+def get_skeleton_accelerations_rotated(accelerations, directions, executor=None, verbose=1):
     """ Rotate skeleton accelerations based on the directions provided
     
     :param accelerations: dictionary of accelerations in the following format:
@@ -67,6 +103,7 @@ def get_skeleton_accelerations_rotated(accelerations, directions, verbose=1):
                               }
                          }
     
+    :param executor: optional concurrent.futures executor processing the skeletons in parallel
     :param verbose: if >=1 print logs
     :return: dictionary of accelerations in the following format:
              { 't': <timestamps>,
@@ -80,63 +117,117 @@ def get_skeleton_accelerations_rotated(accelerations, directions, verbose=1):
             }
 
     """
-    skeletons_directions = directions['skeletons']
-    skeletons = {}
-    for id_sk in skeletons_directions:
-        # Try to follow
-        # https://math.stackexchange.com/questions/542801/rotate-3d-coordinate-system-such-that-z-axis-is-parallel-to-a-given-vector
-        # Compute magnitudes of bracelet x-directions
-        magnitudes = np.linalg.norm(skeletons_directions[id_sk], axis=1)
-        # Compute bracelet x-directions normalized
-        directions_norm = skeletons_directions[id_sk] / magnitudes[:, None]
-        # Compute angles between x-axis of camera and normalized direction of bracelet x-axis
-        angles = np.arccos(np.dot(directions_norm, (1, 0, 0)))
-        # Compute vector product between x-axis of camera and normalized direction of bracelet x-axis = b
-        b = np.cross((1, 0, 0), directions_norm)
-        b_magnitudes = np.linalg.norm(b, axis=1)
-        b_norm = b / (b_magnitudes[:, None] + np.finfo(float).eps)
-        # Now compute the parameters of the quaternion rotation matrix
-        q0 = np.cos(angles / 2)
-        q1 = np.sin(angles / 2) * b_norm[:, 0]
-        q2 = np.sin(angles / 2) * b_norm[:, 1]
-        q3 = np.sin(angles / 2) * b_norm[:, 2]
-        # Generate the Q matrix 3x3xn where n is the number of frames
-        q_mat = np.array((
-            (np.square(q0) + np.square(q1) - np.square(q2) - np.square(q3),
-             2 * (np.multiply(q1, q2) - np.multiply(q0, q3)),
-             2 * (np.multiply(q1, q3) + np.multiply(q0, q2))),
-            (2 * (np.multiply(q2, q1) + np.multiply(q0, q3)),
-             np.square(q0) - np.square(q1) + np.square(q2) - np.square(q3),
-             2 * (np.multiply(q2, q3) - np.multiply(q0, q1))),
-            (2 * (np.multiply(q3, q1) - np.multiply(q0, q2)), 2 * (np.multiply(q3, q2) + np.multiply(q0, q1)),
-             np.square(q0) - np.square(q1) - np.square(q2) + np.square(q3)
-             )))
-        # Compute new axis directions
-        u = []
-        v = []
-        w = []
-        for i in range(np.shape(q_mat)[2]):
-            u.append(np.dot(q_mat[:, :, i], (1, 0, 0)))
-            v.append(np.dot(q_mat[:, :, i], (0, 1, 0)))
-            w.append(np.dot(q_mat[:, :, i], (0, 0, 1)))
-        u = np.array(u)
-        v = np.array(v)
-        w = np.array(w)
-        acc_skeleton = accelerations['skeletons'][id_sk]
-        acc_skeleton = np.transpose(np.vstack((acc_skeleton['ax'], acc_skeleton['ay'], acc_skeleton['az'])))
-        # Extract accelerations in new coordinates
-        au = np.einsum('ij,ij->i', acc_skeleton, u[:-2, :])
-        av = np.einsum('ij,ij->i', acc_skeleton, v[:-2, :])
-        aw = np.einsum('ij,ij->i', acc_skeleton, w[:-2, :])
-        # Save accelerations and also axis
-        skeletons[id_sk] = {'u': u, 'v': v, 'w': w, 'au': au, 'av': av, 'aw': aw}
+    ids = list(directions['skeletons'])
+    skeletons = dict(zip(ids, tracks.map_tracks(functools.partial(rotate_skeleton_accelerations, accelerations,
+                                                                  directions),
+                                                ids, executor=executor)))
     if verbose >= 1:
         print("Skeleton accelerations rotated correctly according to directions.")
         print('------------------------------------------------------------')
+    if 'starts' in accelerations:
+        starts = {id_sk: tracks.track_start(accelerations, id_sk) for id_sk in skeletons}
+        return {'t': accelerations['t'], 'skeletons': skeletons, 'starts': starts}
     return {'t': accelerations['t'], 'skeletons': skeletons}
 
 
-def do_association(rotated_accel, accel_bracelet, weight, verbose=1):
+def association_costs(rotated_accel, accel_bracelet, weight, min_overlap=None, band=None, joint=False, executor=None):
+    """ Compute the cost matrix between skeletons and bracelets combining raw and derivative DTW similarities
+
+    :param rotated_accel: dictionary of rotated skeleton accelerations, see do_association
+    :param accel_bracelet: dictionary of bracelet accelerations, see do_association
+    :param weight: weight for derivative comparison
+    :param min_overlap: if not None, minimum temporal overlap in seconds for a skeleton and a bracelet to be compared,
+                        see compare_accel
+    :param band: if not None, maximum time difference in seconds of the points aligned by DTW, see compare_accel
+    :param joint: if True, raw and derivative are compared with one multi-feature DTW weighted by weight (see
+                  compare_accel_joint) instead of combining two DTW similarities
+    :param executor: optional concurrent.futures executor computing the similarities of the skeletons in parallel
+    :return: costs: np.array((n_skeletons, n_bracelets)) of combined similarities
+             present: boolean np.array of the same shape, False for pairs not compared
+             rows: list of skeleton identifiers, one per row
+             columns: list of bracelet identifiers, one per column
+    """
+    columns = list(accel_bracelet)
+    if joint:
+        joint_mse = compare_accel_joint(rotated_accel, accel_bracelet, weight, min_overlap=min_overlap, band=band,
+                                        executor=executor)
+        rows = list(joint_mse)
+        costs, present = similarity_matrix(joint_mse, rows, columns)
+        return costs, present, rows, columns
+    # Comparison raw and derivative
+    normal_mse, der_mse = compare_accel_fused(rotated_accel, accel_bracelet, min_overlap=min_overlap, band=band,
+                                              executor=executor)
+    # Combine results in a cost matrix, rows are skeletons and columns bracelets
+    rows = list(normal_mse)
+    normal_costs, normal_present = similarity_matrix(normal_mse, rows, columns)
+    der_costs, der_present = similarity_matrix(der_mse, rows, columns)
+    # Rows with missing derivatives likely have problems in bracelets timestamps, use only normal for them
+    der_complete = (der_present | ~normal_present).all(axis=1)
+    costs = np.where(der_complete[:, None], weight * normal_costs + (1 - weight) * der_costs, normal_costs)
+    return costs, normal_present, rows, columns
+
+
+def solve_association(costs, present, groups=None):
+    """ Solve the skeleton-bracelet assignment with the Hungarian algorithm
+
+    :param costs: np.array((n_skeletons, n_bracelets)) of costs as returned by association_costs
+    :param present: boolean np.array of the same shape, False for pairs that can not be associated
+    :param groups: optional np.array of n_skeletons labels (e.g. camera of each skeleton). If given, each group of
+                   rows is assigned separately, so that a bracelet can be associated to one skeleton per group, and a
+                   bracelet with invalid costs in one group is discarded only in that group
+    :return: list of associated (row, column) indices of costs
+    """
+    if groups is None:
+        return assign(costs, present)
+    matches = []
+    for group in dict.fromkeys(groups):
+        group_rows = np.flatnonzero(groups == group)
+        matches.extend((group_rows[row], col) for row, col in assign(costs[group_rows], present[group_rows]))
+    return matches
+
+
+def assign(costs, present):
+    """ Hungarian assignment of all the rows of costs, see solve_association
+
+    :return: list of associated (row, column) indices of costs
+    """
+    # Discard bracelets with NaN or inf costs -> probably error in bracelet timestamps
+    # Pairs not compared (not overlapping in time) are not taken into account
+    valid_columns = np.logical_and((np.isfinite(costs) | ~present).all(axis=0), present.any(axis=0))
+    columns = np.flatnonzero(valid_columns)
+    costs = costs[:, valid_columns]
+    present = present[:, valid_columns]
+    # If array is empty everything was NaN -> probably error in bracelet timestamps
+    if costs.size == 0:
+        return []
+    # Pairs not compared can not be associated, give them a cost higher than any complete assignment
+    if not present.all():
+        costs = costs.copy()
+        costs[~present] = (np.abs(costs[present]).sum() + 1) * 2
+    # Imported here, scipy.optimize is slow to import and only needed when there is something to assign
+    from scipy.optimize import linear_sum_assignment
+    # Hungarian
+    row_ind, col_ind = linear_sum_assignment(costs)
+    return [(row, columns[col]) for row, col in zip(row_ind, col_ind) if present[row, col]]
+
+
+def association_from_match(rotated_accel, id_sk, id_br):
+    """ Build the association dict of a skeleton with a bracelet over the valid timestamps of the skeleton
+
+    :param rotated_accel: dictionary of rotated skeleton accelerations, see do_association
+    :param id_sk: skeleton identifier
+    :param id_br: bracelet identifier
+    :return: association as {'ts_start': ..., 'ts_end': ..., 'skeleton_id': ..., 'bracelet_id': ...}
+    """
+    # Extract timestamps
+    au = rotated_accel['skeletons'][id_sk]['au']
+    valids = np.where(~np.isnan(au))
+    valid_ts = tracks.track_t(rotated_accel, id_sk, len(au))[valids]
+    return {'ts_start': valid_ts[0], 'ts_end': valid_ts[-1], 'skeleton_id': str(id_sk), 'bracelet_id': str(id_br)}
+
+
+def do_association(rotated_accel, accel_bracelet, weight, min_overlap=None, band=None, joint=False, executor=None,
+                   intermediates=None, verbose=1):
     """
 
     :param verbose: if >=1 print logs
@@ -159,70 +250,25 @@ def do_association(rotated_accel, accel_bracelet, weight, verbose=1):
                               <id_br2>: {...}, ...
                               }
     :param weight: weight for derivative comparison
+    :param min_overlap: if not None, minimum temporal overlap in seconds for a skeleton and a bracelet to be compared
+                        and associated, see compare_accel
+    :param band: if not None, maximum time difference in seconds of the points aligned by DTW, see compare_accel
+    :param joint: if True, use one multi-feature DTW for raw and derivative, see association_costs
+    :param executor: optional concurrent.futures executor computing the similarities of the skeletons in parallel
+    :param intermediates: optional dict where the cost matrix is saved as
+                          {'costs': {'costs': ..., 'present': ..., 'rows': ..., 'columns': ...}}, see association_costs
     :return: list of association in the from
             {'ts_start': ...,
              'ts_end': ...,
              'skeleton_id': ...,
              'bracelet_id': ...}
     """
-    associations = []
-    # Comparison raw
-    normal_mse = compare_accel(rotated_accel, accel_bracelet)
-    # Comparison derivative
-    der_mse = compare_accel_der(copy.deepcopy(rotated_accel),
-                                copy.deepcopy(accel_bracelet))
-    # Combine results
-    columns = []
-    for id_br in accel_bracelet:
-        columns.append(id_br)
-    rows = []
-    for id_sk in normal_mse:
-        rows.append(id_sk)
-    df_mse = pd.DataFrame(columns=columns, index=rows)
-    for id_sk in normal_mse:
-        # No probelm in the derivative then the two sets have same elements
-        if set(normal_mse[id_sk]) & set(der_mse[id_sk]) == set(normal_mse[id_sk]):
-            tot_weight = {k: weight * normal_mse[id_sk].get(k, 0) + (1 - weight) * der_mse[id_sk].get(k, 0) for k in
-                          set(normal_mse[id_sk]) & set(der_mse[id_sk])}
-            for id_br in tot_weight:
-                df_mse.loc[id_sk][id_br] = tot_weight[id_br]
-        # Likely problem in bracelets timestamps
-        else:
-            # Use only normal -> errors in derivatives of bracelet
-            tot_weight = {k: normal_mse[id_sk].get(k, 0) for k in set(normal_mse[id_sk])}
-            for id_br in tot_weight:
-                df_mse.loc[id_sk][id_br] = tot_weight[id_br]
-    np_mse = df_mse.to_numpy(dtype=float)
-    np_mse = np_mse[:, np.logical_and(~np.isnan(np.array(np_mse)).any(axis=0),
-                                      ~np.isinf(np.array(np_mse)).any(axis=0))]
-    # If array is empty everything was NaN -> probably error in bracelet timestamps
-    if np_mse.size > 0:
-        # Hungarian
-        row_ind, col_ind = linear_sum_assignment(np_mse)
-        # print("Hungarian result:")
-        if len(columns) >= len(rows):
-            # Same number of sk and bracelets
-            for i, (index, row) in enumerate(df_mse.iterrows()):
-                # Extract timestamps
-                valids = np.where(~np.isnan(rotated_accel['skeletons'][str(index)]['au']))
-                valid_ts = rotated_accel['t'][valids]
-                ts_start = valid_ts[0]
-                ts_end = valid_ts[-1]
-                # print("Skeleton %s associated with bracelet %s" % (str(index), str(df_mse.columns[col_ind[i]])))
-                associations.append({'ts_start': ts_start, 'ts_end': ts_end,
-                                     'skeleton_id': str(index), 'bracelet_id': str(df_mse.columns[col_ind[i]])})
-        else:
-            # Less bracelets than skeletons
-            for row, col in zip(row_ind, col_ind):
-                # Extract timestamps
-                valids = np.where(~np.isnan(rotated_accel['skeletons'][str(rows[row])]['au']))
-                valid_ts = rotated_accel['t'][valids]
-                ts_start = valid_ts[0]
-                ts_end = valid_ts[-1]
-                # print("Skeleton %s associated with bracelet %s" % (str(rows[row]), str(columns[col])))
-                associations.append({'ts_start': ts_start, 'ts_end': ts_end,
-                                     'skeleton_id': str(rows[row]),
-                                     'bracelet_id': str(columns[col])})
+    costs, present, rows, columns = association_costs(rotated_accel, accel_bracelet, weight, min_overlap=min_overlap,
+                                                      band=band, joint=joint, executor=executor)
+    if intermediates is not None:
+        intermediates['costs'] = {'costs': costs, 'present': present, 'rows': rows, 'columns': columns}
+    associations = [association_from_match(rotated_accel, rows[row], columns[col])
+                    for row, col in solve_association(costs, present)]
     if verbose >= 1:
         print("Association computed with DTW similarities")
         print('------------------------------------------------------------')
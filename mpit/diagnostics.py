@@ -0,0 +1,79 @@
+import numpy as np
+import mpit.utils.tracks as tracks
+
+# Values kept in the plot data of the skeletons structures, None keeps the whole track (directions)
+PLOT_STAGES = {'wrist': ('px', 'py', 'pz'),
+               'elbow': ('px', 'py', 'pz'),
+               'directions': None,
+               'rotated_accelerations': ('au', 'av', 'aw')}
+
+
+def decimation_indices(length, step):
+    """ Frames kept by decimate: one every step and the last one, so that the decimated window has the same span
+
+    :param length: number of frames
+    :param step: decimation step in frames
+    :return: np.array of at most length // step + 2 increasing frame indices
+    """
+    indices = np.arange(0, length, step)
+    if length > 0 and indices[-1] != length - 1:
+        indices = np.append(indices, length - 1)
+    return indices
+
+
+def decimate_track(values, indices, start):
+    """ Copy of the values of a track starting at frame start on the frames indices, see decimate """
+    return values[indices[np.searchsorted(indices, start):np.searchsorted(indices, start + len(values))] - start]
+
+
+def decimate(frames, step, keys=None):
+    """ Keep one frame every step of a positions, directions or accelerations structure, plus its last frame. The
+        output is aligned on frames['t'][decimation_indices(...)] and its arrays are copies, so that it does not keep
+        the arrays of the input in memory
+
+    :param frames: structure as {'t': ..., 'skeletons': {<id_sk>: ...}, 'starts'?: ...}
+    :param step: decimation step in frames
+    :param keys: if not None, values of the skeletons dicts to keep
+    :return: new structure in the same format, with 'starts' if frames has them
+    """
+    indices = decimation_indices(len(frames['t']), step)
+    skeletons = {}
+    starts = {}
+    for id_sk, skeleton in frames['skeletons'].items():
+        start = tracks.track_start(frames, id_sk)
+        if isinstance(skeleton, dict):
+            skeletons[id_sk] = {key: decimate_track(values, indices, start) for key, values in skeleton.items()
+                                if keys is None or key in keys}
+        else:
+            skeletons[id_sk] = decimate_track(skeleton, indices, start)
+        # Index of the first kept frame of the track in the decimated 't'
+        starts[id_sk] = int(np.searchsorted(indices, start))
+    decimated = {'t': frames['t'][indices], 'skeletons': skeletons}
+    if 'starts' in frames:
+        decimated['starts'] = starts
+    return decimated
+
+
+def plot_data(intermediates, step=1):
+    """ Plot-ready copy of the intermediates of one window, decimated to keep the diagnostics of long recordings small
+
+    :param intermediates: outputs of the stages of one window as filled by Pipeline.run
+    :param step: decimation step, in frames for the skeletons and in samples for the bracelets
+    :return: dict with the stages of intermediates:
+             'wrist', 'elbow', 'directions', 'rotated_accelerations': dense structures (see tracks.densify) on the
+                                                                      frames kept by decimate, with NaN where a
+                                                                      skeleton is missing
+             'bracelets': {<id_br>: {'t', 'ax', 'ay', 'az'}} decimated in the same way
+             'costs': cost matrix as returned by core.do_association (not decimated)
+    """
+    data = {}
+    for stage, keys in PLOT_STAGES.items():
+        if stage in intermediates:
+            data[stage] = tracks.densify(decimate(intermediates[stage], step, keys=keys))
+    if 'bracelets' in intermediates:
+        data['bracelets'] = {id_br: {key: np.asarray(values)[decimation_indices(len(accel['t']), step)]
+                                     for key, values in accel.items()}
+                             for id_br, accel in intermediates['bracelets'].items()}
+    if 'costs' in intermediates:
+        data['costs'] = intermediates['costs']
+    return data
@@ -0,0 +1,202 @@
+import mpit.utils.preprocessing as preproc
+import mpit.utils.conversion as conversion
+import mpit.utils.filtering as filtering
+import mpit.utils.kernels as kernels
+import mpit.core as core
+import mpit.skeleton as skeleton
+
+from mpit.utils.precision import get_dtype, array_nbytes
+
+# Elbow and wrist joints indexes and total number of joints of the supported cameras
+CAMERAS = {'Intel': {'elbow': 6, 'wrist': 7, 'tot_points': 18},
+           'Kinect': {'elbow': 5, 'wrist': 6, 'tot_points': 32}}
+
+
+def get_joint_layout(camera):
+    """ Get the joint layout of a camera
+
+    :param camera: name of a supported camera ("Intel" or "Kinect") or custom layout as
+                   {'elbow': <index>, 'wrist': <index>, 'tot_points': <number of joints>}
+    :return: layout as {'elbow': <index>, 'wrist': <index>, 'tot_points': <number of joints>}
+    """
+    if isinstance(camera, dict):
+        assert {'elbow', 'wrist', 'tot_points'} <= set(camera), \
+            "Joint layout not valid, it must contain elbow, wrist and tot_points"
+        return camera
+    assert camera in CAMERAS, "Type of camera not valid (Intel or Kinect)"
+    return CAMERAS[camera]
+
+
+class PipelineConfig:
+    """ Parameters of the PIT, with the same names and defaults of identify_and_track """
+
+    def __init__(self, camera="Intel", acceleration_smooth_window=35, acceleration_smooth_poly=1,
+                 skeleton_min_duration=5, skeleton_smooth_filter="savgol", skeleton_smooth_window=7,
+                 skeleton_smooth_poly=1, direction_smooth_filter="savgol", direction_smooth_window=5,
+                 direction_smooth_poly=1, conversion_smooth_window=3, conversion_smooth_poly=1, camera_angle=0,
+                 skeleton_min_confidence=None, similarity_weight=0.7, similarity_min_overlap=None,
+                 similarity_band=None, similarity_joint=False, dtype="float64"):
+        """ See identify_and_track for the description of the parameters """
+        self.camera = camera
+        self.acceleration_smooth_window = acceleration_smooth_window
+        self.acceleration_smooth_poly = acceleration_smooth_poly
+        self.skeleton_min_duration = skeleton_min_duration
+        self.skeleton_smooth_filter = skeleton_smooth_filter
+        self.skeleton_smooth_window = skeleton_smooth_window
+        self.skeleton_smooth_poly = skeleton_smooth_poly
+        self.direction_smooth_filter = direction_smooth_filter
+        self.direction_smooth_window = direction_smooth_window
+        self.direction_smooth_poly = direction_smooth_poly
+        self.conversion_smooth_window = conversion_smooth_window
+        self.conversion_smooth_poly = conversion_smooth_poly
+        self.camera_angle = camera_angle
+        self.skeleton_min_confidence = skeleton_min_confidence
+        self.similarity_weight = similarity_weight
+        self.similarity_min_overlap = similarity_min_overlap
+        self.similarity_band = similarity_band
+        self.similarity_joint = similarity_joint
+        self.dtype = dtype
+
+    def params(self):
+        """ Parameters as a dict of identify_and_track keyword arguments """
+        return dict(vars(self))
+
+
+class Pipeline:
+    """ PIT pipeline built once for a configuration and run on many windows.
+
+        The constants of the configuration are computed when the pipeline is built: joint layout, precision, gravity
+        vector, Savitzky-Golay coefficients of every smoothing (see filtering.SavgolFilter) and the DTW kernels of the
+        selected backend (compiled here with numba). run only does the work depending on the data of the window.
+        run does not modify the pipeline (the clock estimator has its own lock), so the same pipeline can process
+        several windows at the same time.
+    """
+
+    def __init__(self, config=None, clock=None, executor=None, verbose=0, **params):
+        """
+
+        :param config: PipelineConfig, if None it is built from params
+        :param clock: optional clock.ClockEstimator shared by the windows, see identify_and_track
+        :param executor: optional concurrent.futures executor processing the skeletons of each window in parallel
+        :param verbose: if >=1 print logs
+        :param params: parameters of PipelineConfig, only if config is None
+        """
+        assert config is None or len(params) == 0, \
+            "Give the parameters either in config or as keyword arguments, not both: " + ", ".join(params)
+        self.config = config if config is not None else PipelineConfig(**params)
+        self.clock = clock
+        self.executor = executor
+        self.verbose = verbose
+        config = self.config
+        self.layout = get_joint_layout(config.camera)
+        self.dtype = get_dtype(config.dtype)
+        self.gravity = core.gravity_vector(config.camera_angle)
+        self.acceleration_filter = filtering.SavgolFilter(config.acceleration_smooth_window,
+                                                          config.acceleration_smooth_poly)
+        self.skeleton_filter = filtering.smoother(config.skeleton_smooth_filter, window=config.skeleton_smooth_window,
+                                                  poly=config.skeleton_smooth_poly)
+        self.direction_filter = filtering.smoother(config.direction_smooth_filter,
+                                                   window=config.direction_smooth_window,
+                                                   poly=config.direction_smooth_poly)
+        self.conversion_filter = filtering.SavgolFilter(config.conversion_smooth_window, config.conversion_smooth_poly)
+        # Compile (or load from the numba cache) the kernels of the selected backend now rather than in the first window
+        kernels.get_kernels()
+
+    def process_bracelets(self, accelerations_dict, memory=None, raw=None):
+        """ Extract and smooth bracelets accelerations, see algorithms.preprocess_bracelets """
+        accelerations = preproc.get_accelerations(accelerations_dict, verbose=self.verbose, dtype=self.dtype)
+        if raw is not None:
+            # Smoothing replaces the arrays of accelerations, the copies keep the original ones
+            raw.update({id_br: dict(accel) for id_br, accel in accelerations.items()})
+        accelerations = filtering.smooth_accelerations(accelerations, smooth_filter=self.acceleration_filter)
+        if memory is not None:
+            memory['bracelets'] = array_nbytes(accelerations)
+        return accelerations
+
+    def process_skeletons(self, skeletons_frames, memory=None, intermediates=None):
+        """ Compute the wrist accelerations of the skeletons rotated in the bracelet reference system, see
+            algorithms.process_skeletons. If intermediates is a dict, it is filled with the outputs of the stages, see
+            run
+        """
+        config = self.config
+        verbose = self.verbose
+        # Skeletons shorter than skeleton_min_duration are not extracted at all, the others only on their own frames
+        scan = preproc.scan_skeletons(skeletons_frames)
+        ids = preproc.select_skeletons(scan, min_duration=config.skeleton_min_duration)
+        wrist_points = preproc.get_positions_one_point(skeletons_frames, self.layout['wrist'],
+                                                       self.layout['tot_points'], verbose=verbose, dtype=self.dtype,
+                                                       ids=ids, min_confidence=config.skeleton_min_confidence,
+                                                       scan=scan, sparse=True)
+        elbow_points = preproc.get_positions_one_point(skeletons_frames, self.layout['elbow'],
+                                                       self.layout['tot_points'], verbose=verbose, dtype=self.dtype,
+                                                       ids=ids, min_confidence=config.skeleton_min_confidence,
+                                                       scan=scan, sparse=True)
+        if memory is not None:
+            memory['positions'] = array_nbytes(wrist_points) + array_nbytes(elbow_points)
+        wrist_points = skeleton.filter_skeletons(wrist_points, min_duration=config.skeleton_min_duration,
+                                                 verbose=verbose)
+        elbow_points = skeleton.filter_skeletons(elbow_points, min_duration=config.skeleton_min_duration,
+                                                 verbose=verbose)
+        wrist_points, elbow_points = skeleton.post_process_xy(wrist_points, elbow_points,
+                                                              smooth_filter=self.skeleton_filter,
+                                                              window=config.skeleton_smooth_window,
+                                                              poly=config.skeleton_smooth_poly,
+                                                              executor=self.executor,
+                                                              verbose=verbose)
+        wrist_points, elbow_points, directions = skeleton.get_directions(wrist_points, elbow_points,
+                                                                         smooth_filter=self.direction_filter,
+                                                                         window=config.direction_smooth_window,
+                                                                         poly=config.direction_smooth_poly,
+                                                                         executor=self.executor,
+                                                                         verbose=verbose)
+        skel_accel = conversion.get_skeletons_point_accelerations(wrist_points,
+                                                                  window=config.conversion_smooth_window,
+                                                                  poly=config.conversion_smooth_poly,
+                                                                  smooth_filter=self.conversion_filter,
+                                                                  executor=self.executor,
+                                                                  verbose=verbose)
+        skel_accel_gravity = core.add_gravity_to_skeletons_accelerations(skel_accel, gravity=self.gravity,
+                                                                         verbose=verbose)
+        skel_accel_rotated = core.get_skeleton_accelerations_rotated(skel_accel_gravity, directions,
+                                                                     executor=self.executor, verbose=verbose)
+        if memory is not None:
+            memory['directions'] = array_nbytes(directions)
+            memory['accelerations'] = array_nbytes(skel_accel)
+            memory['rotated_accelerations'] = array_nbytes(skel_accel_rotated)
+        if intermediates is not None:
+            intermediates['wrist'] = wrist_points
+            intermediates['elbow'] = elbow_points
+            intermediates['directions'] = directions
+            intermediates['rotated_accelerations'] = skel_accel_rotated
+        return skel_accel_rotated
+
+    def associate(self, skel_accel_rotated, accelerations, intermediates=None):
+        """ Associate the skeletons to the bracelets, see core.do_association """
+        return core.do_association(skel_accel_rotated, accelerations, self.config.similarity_weight,
+                                   min_overlap=self.config.similarity_min_overlap, band=self.config.similarity_band,
+                                   joint=self.config.similarity_joint, executor=self.executor,
+                                   intermediates=intermediates, verbose=self.verbose)
+
+    def run(self, skeletons_frames, accelerations_dict, memory=None, intermediates=None):
+        """ Identify and track the skeletons of one window
+
+        :param skeletons_frames: skeletons data in the format of our dataset
+        :param accelerations_dict: acceleration data in the format of our dataset
+        :param memory: optional dict filled with the bytes used by the output of each stage
+        :param intermediates: optional dict filled with the outputs of the stages, as computed (not copied):
+                              'bracelets': smoothed bracelets accelerations (with corrected timestamps if there is a
+                                           clock), 'wrist' and 'elbow': smoothed positions, 'directions',
+                                           'rotated_accelerations' and 'costs' (see core.do_association). See
+                                           diagnostics.plot_data for a decimated copy to keep or plot
+        :return: list of associations as returned by identify_and_track
+        """
+        raw_accelerations = {} if self.clock is not None else None
+        accelerations = self.process_bracelets(accelerations_dict, memory=memory, raw=raw_accelerations)
+        skel_accel_rotated = self.process_skeletons(skeletons_frames, memory=memory, intermediates=intermediates)
+        if self.clock is not None:
+            # The smoothing of the bracelets removes most of the motion used to measure the offsets
+            self.clock.update(skel_accel_rotated, raw_accelerations)
+            accelerations = self.clock.correct(accelerations)
+        if intermediates is not None:
+            intermediates['bracelets'] = accelerations
+        return self.associate(skel_accel_rotated, accelerations, intermediates=intermediates)
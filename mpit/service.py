@@ -0,0 +1,406 @@
+import sys
+import json
+import math
+import bisect
+import asyncio
+import collections
+import mpit.utils.kernels as kernels
+
+from mpit.cli import build_parser, pit_params
+from mpit.clock import ClockEstimator
+from mpit.pipeline import Pipeline
+
+
+class SourceQueue:
+    """ Bounded queue of the items of one source (the camera or one bracelet) kept ordered by timestamp """
+
+    def __init__(self, max_size):
+        """
+
+        :param max_size: maximum number of items kept in the queue
+        """
+        self.max_size = max_size
+        self.timestamps = collections.deque()
+        self.items = collections.deque()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, timestamp, item):
+        """ Insert an item in time order
+
+        :param timestamp: timestamp of the item
+        :param item: item to insert
+        :return: False if the queue is full and the item was dropped, True otherwise
+        """
+        if len(self.items) >= self.max_size:
+            return False
+        # Items arrive mostly in order, only the late ones are inserted
+        if len(self.timestamps) == 0 or timestamp >= self.timestamps[-1]:
+            self.timestamps.append(timestamp)
+            self.items.append(item)
+        else:
+            index = bisect.bisect_right(self.timestamps, timestamp)
+            self.timestamps.insert(index, timestamp)
+            self.items.insert(index, item)
+        return True
+
+    def pop_until(self, end_ts):
+        """ Remove and return the items with timestamp < end_ts
+
+        :param end_ts: end timestamp (excluded)
+        :return: list of items in time order
+        """
+        items = []
+        while len(self.timestamps) > 0 and self.timestamps[0] < end_ts:
+            self.timestamps.popleft()
+            items.append(self.items.popleft())
+        return items
+
+
+class PITService:
+    """ Asyncio service receiving skeleton frames and bracelet samples as newline-delimited JSON and publishing the
+        associations of each window.
+
+        Each line received is a skeleton frame in the format of our dataset ({'skeletons': ..., 'timestamp': ...}),
+        an acceleration measurement ({'x', 'y', 'z', 'timestamp', 'id'}) or {'type': 'subscribe'} to receive on the
+        same connection the associations of every processed window as
+        {'type': 'associations', 'ts_start': ..., 'ts_end': ..., 'associations': [...]}.
+
+        Items are buffered in bounded per-source queues. Windows are closed when the skeleton timestamps pass their
+        end by lateness seconds (windows without skeleton frames are skipped at once) and processed with
+        identify_and_track in an executor, at most max_pending windows at a time: when processing is behind, reading
+        from the connections stops, which pushes back on the senders.
+        Items not fitting in their queue or arriving after their window was closed are dropped and counted in stats.
+        A skeleton frame far ahead of the others (e.g. from a wrong clock) moves the watermark by max_advance seconds
+        only, so that it does not close the windows still receiving data.
+    """
+
+    def __init__(self, window=10, lateness=1.0, max_queue_size=100000, max_pending=2, max_subscriber_queue=100,
+                 max_advance=60.0, executor=None, clock_sync=False, verbose=0, **params):
+        """
+
+        :param window: window size in seconds
+        :param lateness: seconds to wait after the end of a window before closing it, for late items
+        :param max_queue_size: maximum number of items buffered per source
+        :param max_pending: maximum number of windows processed at the same time
+        :param max_subscriber_queue: maximum number of results queued per subscriber
+        :param max_advance: maximum advance of the watermark in seconds for each skeleton frame
+        :param executor: concurrent.futures executor running identify_and_track, if None the loop default one
+        :param clock_sync: if True the clock offset and drift of each bracelet are estimated over the windows and the
+                           bracelets timestamps are corrected before the comparison (see clock.ClockEstimator)
+        :param verbose: if >=1 print logs
+        :param params: parameters of identify_and_track, the pipeline (see pipeline.Pipeline) is built once with them
+        """
+        self.window = window
+        self.lateness = lateness
+        self.max_queue_size = max_queue_size
+        self.max_subscriber_queue = max_subscriber_queue
+        self.max_advance = max_advance
+        self.executor = executor
+        self.verbose = verbose
+        self.params = params
+        # Constants of the configuration are computed once for all the windows
+        self.pipeline = Pipeline(clock=ClockEstimator() if clock_sync else None, verbose=verbose, **params)
+        self.skeletons = SourceQueue(max_queue_size)
+        self.bracelets = {}
+        self.window_start = None
+        self.watermark = None
+        self.subscribers = []
+        self.pending = set()
+        self.semaphore = asyncio.Semaphore(max_pending)
+        self.stats = {'frames': 0, 'samples': 0, 'dropped_full': 0, 'dropped_late': 0, 'invalid': 0,
+                      'windows': 0, 'windows_failed': 0, 'windows_skipped': 0, 'dropped_results': 0,
+                      'watermark_bounded': 0}
+        # Items dropped because their queue was full, per source ('skeletons' or bracelet id)
+        self.dropped = {}
+        self.servers = []
+        self.connections = {}
+
+    def subscribe(self):
+        """ Subscribe to the processed windows
+
+        :return: bounded asyncio.Queue receiving the result of each window, results are dropped if it is full
+        """
+        queue = asyncio.Queue(self.max_subscriber_queue)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        if queue in self.subscribers:
+            self.subscribers.remove(queue)
+
+    def put(self, message):
+        """ Buffer one skeleton frame or acceleration measurement
+
+        :param message: decoded message
+        :return: True if the message was buffered, False if it was dropped
+        """
+        timestamp = message['timestamp']
+        if self.window_start is not None and timestamp < self.window_start:
+            self.stats['dropped_late'] += 1
+            return False
+        if 'skeletons' in message:
+            self.stats['frames'] += 1
+            queue = self.skeletons
+            source = 'skeletons'
+            if self.window_start is None:
+                self.window_start = int(timestamp)
+            if self.watermark is None:
+                self.watermark = timestamp
+            elif timestamp > self.watermark + self.max_advance:
+                self.watermark += self.max_advance
+                self.stats['watermark_bounded'] += 1
+            elif timestamp > self.watermark:
+                self.watermark = timestamp
+        else:
+            self.stats['samples'] += 1
+            source = message['id']
+            if source not in self.bracelets:
+                self.bracelets[source] = SourceQueue(self.max_queue_size)
+            queue = self.bracelets[source]
+        if not queue.put(timestamp, message):
+            self.stats['dropped_full'] += 1
+            self.dropped[source] = self.dropped.get(source, 0) + 1
+            # Log the first drop of each source and then one every 1000
+            if self.verbose >= 1 and self.dropped[source] % 1000 == 1:
+                print("Queue of", source, "full,", self.dropped[source], "items dropped, the skeletons watermark is",
+                      self.watermark)
+            return False
+        return True
+
+    def closed_windows(self, flush=False):
+        """ Extract the data of the windows that can be closed
+
+        :param flush: if True close all the windows with buffered data, regardless of the watermark
+        :return: list of (ts_start, ts_end, skeletons frames, acceleration measurements)
+        """
+        windows = []
+        if self.window_start is None:
+            return windows
+        while True:
+            ts_end = self.window_start + self.window
+            if flush:
+                if len(self.skeletons) == 0:
+                    break
+            elif self.watermark < ts_end + self.lateness:
+                break
+            if len(self.skeletons) == 0 or self.skeletons.timestamps[0] >= ts_end:
+                # No frames in this window: jump to the window of the next frame, without passing the last window
+                # that can be closed, dropping the acceleration measurements of the skipped windows
+                next_ts = self.skeletons.timestamps[0] if len(self.skeletons) > 0 else math.inf
+                if not flush:
+                    next_ts = min(next_ts, self.watermark - self.lateness)
+                skipped = max(1, math.floor((next_ts - self.window_start) / self.window))
+                self.window_start += skipped * self.window
+                self.stats['windows_skipped'] += skipped
+                for queue in self.bracelets.values():
+                    queue.pop_until(self.window_start)
+                continue
+            frames = self.skeletons.pop_until(ts_end)
+            accels = []
+            for queue in self.bracelets.values():
+                accels.extend(queue.pop_until(ts_end))
+            accels.sort(key=lambda sample: sample['timestamp'])
+            windows.append((self.window_start, ts_end, frames, accels))
+            self.window_start = ts_end
+        return windows
+
+    async def process(self, ts_start, ts_end, frames, accels):
+        """ Run the pipeline on one window in the executor and publish the result """
+        loop = asyncio.get_running_loop()
+        try:
+            associations = await loop.run_in_executor(self.executor, self.pipeline.run, frames, accels)
+        except Exception as err:
+            self.stats['windows_failed'] += 1
+            if self.verbose >= 1:
+                print("Error in the PIT of window", ts_start, "-", ts_end, ":", err)
+            return
+        finally:
+            self.semaphore.release()
+        self.stats['windows'] += 1
+        result = {'type': 'associations', 'ts_start': ts_start, 'ts_end': ts_end, 'associations': associations}
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(result)
+            except asyncio.QueueFull:
+                self.stats['dropped_results'] += 1
+
+    async def schedule(self, flush=False):
+        """ Start the processing of the closed windows, waiting while max_pending windows are being processed """
+        for window in self.closed_windows(flush=flush):
+            await self.semaphore.acquire()
+            task = asyncio.create_task(self.process(*window))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def flush(self):
+        """ Process all the buffered data, wait for the results and then publish {'type': 'flushed'} """
+        await self.schedule(flush=True)
+        if self.pending:
+            await asyncio.gather(*self.pending)
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait({'type': 'flushed'})
+            except asyncio.QueueFull:
+                self.stats['dropped_results'] += 1
+
+    async def handle_connection(self, reader, writer):
+        """ Read newline-delimited JSON messages from one connection """
+        subscription = None
+        sender = None
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    self.stats['invalid'] += 1
+                    continue
+                if message.get('type') == 'subscribe':
+                    if subscription is None:
+                        subscription = self.subscribe()
+                        sender = asyncio.create_task(self.send_results(subscription, writer))
+                    continue
+                if message.get('type') == 'flush':
+                    await self.flush()
+                    continue
+                if 'timestamp' not in message or ('skeletons' not in message and 'id' not in message):
+                    self.stats['invalid'] += 1
+                    continue
+                if self.put(message):
+                    await self.schedule()
+        finally:
+            if subscription is not None:
+                self.unsubscribe(subscription)
+                sender.cancel()
+            self.connections.pop(task, None)
+            writer.close()
+
+    @staticmethod
+    async def send_results(queue, writer):
+        """ Write the results received from queue to a subscribed connection """
+        while True:
+            result = await queue.get()
+            writer.write((json.dumps(result, default=float) + "\n").encode())
+            await writer.drain()
+
+    async def start(self, host="127.0.0.1", port=8765, path=None):
+        """ Start listening on a local TCP port or, if path is given, on a Unix socket
+
+        :return: asyncio server
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host=host, port=port)
+        self.servers.append(server)
+        return server
+
+    async def close(self):
+        """ Stop listening and close the open connections """
+        for server in self.servers:
+            server.close()
+        for writer in list(self.connections.values()):
+            writer.close()
+        # Let the connection handlers see the end of their streams
+        if self.connections:
+            await asyncio.gather(*self.connections, return_exceptions=True)
+        for server in self.servers:
+            await server.wait_closed()
+        self.servers = []
+
+
+async def open_connection(host="127.0.0.1", port=8765, path=None):
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+
+async def replay(skeletons_frames, accelerations_dict, host="127.0.0.1", port=8765, path=None, flush=True):
+    """ Local stand-in for the camera and bracelet gateways: send recorded data in time order to a PITService
+
+    :param skeletons_frames: skeletons data in the format of our dataset
+    :param accelerations_dict: acceleration data in the format of our dataset
+    :param host: host of the service
+    :param port: TCP port of the service
+    :param path: Unix socket of the service, if given host and port are ignored
+    :param flush: if True ask the service to process the remaining data at the end
+    """
+    reader, writer = await open_connection(host, port, path)
+    items = sorted(list(skeletons_frames) + list(accelerations_dict), key=lambda item: item['timestamp'])
+    for item in items:
+        writer.write((json.dumps(item) + "\n").encode())
+        # Respect the backpressure of the service
+        await writer.drain()
+    if flush:
+        writer.write(b'{"type": "flush"}\n')
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def listen(host="127.0.0.1", port=8765, path=None):
+    """ Subscribe to a PITService and yield the result of each window, until the service flushes or closes """
+    reader, writer = await open_connection(host, port, path)
+    writer.write(b'{"type": "subscribe"}\n')
+    await writer.drain()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            result = json.loads(line)
+            if result['type'] == 'flushed':
+                break
+            yield result
+    finally:
+        writer.close()
+
+
+async def serve(service, host="127.0.0.1", port=8765, path=None):
+    server = await service.start(host=host, port=port, path=path)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = build_parser()
+    parser.description = "Multisensor PIT service receiving newline-delimited JSON over a local socket"
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="Host to listen on.")
+    parser.add_argument("--port", default=8765, type=int, help="TCP port to listen on.")
+    parser.add_argument("--unix-socket", default=None, type=str,
+                        help="Unix socket to listen on instead of TCP.")
+    parser.add_argument("--lateness", default=1.0, type=float,
+                        help="Seconds to wait after the end of a window before processing it.")
+    parser.add_argument("--max-queue-size", default=100000, type=int,
+                        help="Maximum number of items buffered per source.")
+    parser.add_argument("--max-pending", default=2, type=int,
+                        help="Maximum number of windows processed at the same time.")
+    parser.add_argument("--max-advance", default=60.0, type=float,
+                        help="Maximum advance of the skeletons watermark in seconds for each frame.")
+    parser.add_argument("-cs", "--clock-sync", action="store_true",
+                        help="Estimate the clock offset and drift of each bracelet over the windows and correct its "
+                             "timestamps, use it with --similarity-band.")
+    args = parser.parse_args(argv)
+    kernels.set_backend(args.kernels)
+
+    async def run():
+        service = PITService(window=args.window, lateness=args.lateness, max_queue_size=args.max_queue_size,
+                             max_pending=args.max_pending, max_advance=args.max_advance, clock_sync=args.clock_sync,
+                             verbose=args.verbose, **pit_params(args))
+        await serve(service, host=args.host, port=args.port, path=args.unix_socket)
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
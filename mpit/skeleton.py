@@ -1,5 +1,7 @@
+import functools
 import numpy as np
 import mpit.utils.filtering as filt
+import mpit.utils.tracks as tracks
 
 
 def filter_skeletons(frames, min_duration=5, verbose=1):
@@ -26,8 +28,9 @@ def filter_skeletons(frames, min_duration=5, verbose=1):
         # Some valid values
         else:
             valid_ts = np.where(~np.isnan(skeletons[id_sk]['px']))
-            first_ts_x = frames['t'][valid_ts[0][0]]
-            last_ts_x = frames['t'][valid_ts[0][-1]]
+            t = tracks.track_t(frames, id_sk, len(skeletons[id_sk]['px']))
+            first_ts_x = t[valid_ts[0][0]]
+            last_ts_x = t[valid_ts[0][-1]]
             sk_duration = last_ts_x - first_ts_x  # Duration of the skeleton
             if sk_duration < min_duration:
                 invalid_ids_x.append(id_sk)
@@ -37,12 +40,77 @@ def filter_skeletons(frames, min_duration=5, verbose=1):
         print('------------------------------------------------------------')
     # Remove invalid skeleton
     for id_sk in invalid_ids_x:
-        del skeletons[id_sk]
-    frames['skeletons'] = skeletons
+        tracks.remove_track(frames, id_sk)
     return frames
 
 
-def post_process_xy(x_frames, y_frames, smooth_filter="savgol", window=7, poly=1, verbose=1):
+def post_process_skeleton_xy(x_frames, y_frames, id_sk, smooth_filter="savgol", window=7, poly=1):
+    """ Interpolate and smooth x and y points of one skeleton, see post_process_xy
+
+    :return: (valid, y_start): valid is False if the skeleton must be removed, y_start is the new start of y if its
+             values were moved on the frames of x, otherwise None
+    """
+    x_skeletons = x_frames['skeletons']
+    y_skeletons = y_frames['skeletons']
+    # If id_sk is also in y, proceed with post-processing
+    if id_sk not in y_skeletons:
+        return False, None
+    # Values of y outside the frames of x are discarded below, store y on the same frames of x
+    x_start = tracks.track_start(x_frames, id_sk)
+    length = len(x_skeletons[id_sk]['px'])
+    y_start = tracks.track_start(y_frames, id_sk)
+    new_y_start = None
+    if y_start != x_start or len(y_skeletons[id_sk]['px']) != length:
+        for coord in y_skeletons[id_sk]:
+            y_skeletons[id_sk][coord] = tracks.crop(y_skeletons[id_sk][coord], y_start, x_start, length).copy()
+        new_y_start = x_start
+    # x and y are now on the same frames
+    x_t = tracks.track_t(x_frames, id_sk, length)
+    y_t = x_t
+    try:
+        # Get valid ts of x, first and last on px (should be the same on other coordinates)
+        valid_ts_x = np.where(~np.isnan(x_skeletons[id_sk]['px']))
+        first_ts_x = valid_ts_x[0][0]
+        last_ts_x = valid_ts_x[0][-1]
+        # Get valid ts
+        ts = x_t[first_ts_x: last_ts_x]
+        # Find first and last ts in y_frames, if not present there is IndexError then remove skeleton
+        first_ts_y = np.where(y_t == ts[0])[0][0]
+        last_ts_y = np.where(y_t == ts[-1])[0][0]
+        # Set to nan to values of y outside the x window
+        for coord in y_skeletons[id_sk]:  # Iterate over px, py, pz
+            y_skeletons[id_sk][coord][:first_ts_y] = np.nan
+            y_skeletons[id_sk][coord][last_ts_y + 1:] = np.nan
+        # Extract skeleton window for x and y
+        px_x = x_skeletons[id_sk]['px'][first_ts_x: last_ts_x]
+        py_x = x_skeletons[id_sk]['py'][first_ts_x: last_ts_x]
+        pz_x = x_skeletons[id_sk]['pz'][first_ts_x: last_ts_x]
+        px_y = y_skeletons[id_sk]['px'][first_ts_y: last_ts_y + 1]
+        py_y = y_skeletons[id_sk]['py'][first_ts_y: last_ts_y + 1]
+        pz_y = y_skeletons[id_sk]['pz'][first_ts_y: last_ts_y + 1]
+        # Interpolate and smooth valid points if not error
+        px_interp_x, py_interp_x, pz_interp_x = filt.interpolate_points(px_x, py_x, pz_x)
+        px_interp_y, py_interp_y, pz_interp_y = filt.interpolate_points(px_y, py_y, pz_y)
+        px_smooth_x, py_smooth_x, pz_smooth_x = filt.smooth_points(px_interp_x, py_interp_x, pz_interp_x,
+                                                                   smooth_filter=smooth_filter,
+                                                                   window=window, poly=poly)
+        px_smooth_y, py_smooth_y, pz_smooth_y = filt.smooth_points(px_interp_y, py_interp_y, pz_interp_y,
+                                                                   smooth_filter=smooth_filter,
+                                                                   window=window, poly=poly)
+        # Set new Interpolated and filtered
+        x_skeletons[id_sk]['px'][first_ts_x: last_ts_x] = px_smooth_x
+        x_skeletons[id_sk]['py'][first_ts_x: last_ts_x] = py_smooth_x
+        x_skeletons[id_sk]['pz'][first_ts_x: last_ts_x] = pz_smooth_x
+        y_skeletons[id_sk]['px'][first_ts_y: last_ts_y + 1] = px_smooth_y
+        y_skeletons[id_sk]['py'][first_ts_y: last_ts_y + 1] = py_smooth_y
+        y_skeletons[id_sk]['pz'][first_ts_y: last_ts_y + 1] = pz_smooth_y
+    # If error in filtering then remove skeleton from lists
+    except Exception:
+        return False, new_y_start
+    return True, new_y_start
+
+
+def post_process_xy(x_frames, y_frames, smooth_filter="savgol", window=7, poly=1, executor=None, verbose=1):
     """ Interpolate and smooth x and y points together such that they match in frames. x and y must be
         complementary. Skeletons are kept only if present in both sequences. The duration of the skeletons is filtered
         based on the time window x in order to keep the same duration in both sequences.
@@ -67,78 +135,63 @@ def post_process_xy(x_frames, y_frames, smooth_filter="savgol", window=7, poly=1
                          }
     :param window: window of smoothing
     :param poly: polynomial order of smoothing
+    :param executor: optional concurrent.futures executor processing the skeletons in parallel
     :return: smoothed and interpolated sequences of input points with the same data structure
     """
-    x_skeletons = x_frames['skeletons']
-    x_t = x_frames['t']
-    y_skeletons = y_frames['skeletons']
-    y_t = y_frames['t']
+    ids = list(x_frames['skeletons'])
+    results = tracks.map_tracks(functools.partial(post_process_skeleton_xy, x_frames, y_frames,
+                                                  smooth_filter=smooth_filter, window=window, poly=poly),
+                                ids, executor=executor)
     invalid_ids_x = []
     invalid_ids_y = []
-    for id_sk in x_skeletons:
-        # If id_sk is also in y, proceed with post-processing
-        if id_sk in y_skeletons:
-            try:
-                # Get valid ts of x, first and last on px (should be the same on other coordinates)
-                valid_ts_x = np.where(~np.isnan(x_skeletons[id_sk]['px']))
-                first_ts_x = valid_ts_x[0][0]
-                last_ts_x = valid_ts_x[0][-1]
-                # Get valid ts
-                ts = x_t[first_ts_x: last_ts_x]
-                # Find first and last ts in y_frames, if not present there is IndexError then remove skeleton
-                first_ts_y = np.where(y_t == ts[0])[0][0]
-                last_ts_y = np.where(y_t == ts[-1])[0][0]
-                # Set to nan to values of y outside the x window
-                for coord in y_skeletons[id_sk]:  # Iterate over px, py, pz
-                    y_skeletons[id_sk][coord][:first_ts_y] = np.nan
-                    y_skeletons[id_sk][coord][last_ts_y + 1:] = np.nan
-                # Extract skeleton window for x and y
-                px_x = x_skeletons[id_sk]['px'][first_ts_x: last_ts_x]
-                py_x = x_skeletons[id_sk]['py'][first_ts_x: last_ts_x]
-                pz_x = x_skeletons[id_sk]['pz'][first_ts_x: last_ts_x]
-                px_y = y_skeletons[id_sk]['px'][first_ts_y: last_ts_y + 1]
-                py_y = y_skeletons[id_sk]['py'][first_ts_y: last_ts_y + 1]
-                pz_y = y_skeletons[id_sk]['pz'][first_ts_y: last_ts_y + 1]
-                # Interpolate and smooth valid points if not error
-                px_interp_x, py_interp_x, pz_interp_x = filt.interpolate_points(px_x, py_x, pz_x)
-                px_interp_y, py_interp_y, pz_interp_y = filt.interpolate_points(px_y, py_y, pz_y)
-                px_smooth_x, py_smooth_x, pz_smooth_x = filt.smooth_points(px_interp_x, py_interp_x, pz_interp_x,
-                                                                           smooth_filter=smooth_filter,
-                                                                           window=window, poly=poly)
-                px_smooth_y, py_smooth_y, pz_smooth_y = filt.smooth_points(px_interp_y, py_interp_y, pz_interp_y,
-                                                                           smooth_filter=smooth_filter,
-                                                                           window=window, poly=poly)
-                # Set new Interpolated and filtered
-                x_skeletons[id_sk]['px'][first_ts_x: last_ts_x] = px_smooth_x
-                x_skeletons[id_sk]['py'][first_ts_x: last_ts_x] = py_smooth_x
-                x_skeletons[id_sk]['pz'][first_ts_x: last_ts_x] = pz_smooth_x
-                y_skeletons[id_sk]['px'][first_ts_y: last_ts_y + 1] = px_smooth_y
-                y_skeletons[id_sk]['py'][first_ts_y: last_ts_y + 1] = py_smooth_y
-                y_skeletons[id_sk]['pz'][first_ts_y: last_ts_y + 1] = pz_smooth_y
-                # If error in filtering then remove skeleton from lists
-            except Exception:
-                invalid_ids_x.append(id_sk)
-                invalid_ids_y.append(id_sk)
-                continue
-        else:
+    # Shared changes are applied in the order of the skeletons
+    for id_sk, (valid, y_start) in zip(ids, results):
+        if y_start is not None:
+            y_frames.setdefault('starts', {})[id_sk] = y_start
+        if not valid:
             invalid_ids_x.append(id_sk)
-            continue
+            # Skeletons missing in y are only removed from x
+            if id_sk in y_frames['skeletons']:
+                invalid_ids_y.append(id_sk)
     # Remove invalid_ids_x
     for id_sk in invalid_ids_x:
-        del x_skeletons[id_sk]
+        tracks.remove_track(x_frames, id_sk)
     # Remove invalid_ids_y
     for id_sk in invalid_ids_y:
-        del y_skeletons[id_sk]
+        tracks.remove_track(y_frames, id_sk)
     if verbose >= 1:
         print("Removing", str(len(invalid_ids_x)), "and",  str(len(invalid_ids_y)),
               "skeleton(s) for incompatibility between x and y point sequences")
         print('------------------------------------------------------------')
-    x_frames['skeletons'] = x_skeletons
-    y_frames['skeletons'] = y_skeletons
     return x_frames, y_frames
 
 
-def get_directions(x_frames, y_frames, smooth_filter="savgol", window=5, poly=1, verbose=1):
+def get_skeleton_direction(x_frames, y_frames, id_sk, smooth_filter="savgol", window=5, poly=1):
+    """ Compute the directions between x and y points of one skeleton, see get_directions
+
+    :return: np.array((ts, 3)) of directions on the frames of x, None if they can not be computed
+    """
+    try:
+        # Directions are computed on the frames of x
+        x_skeleton = x_frames['skeletons'][id_sk]
+        start = tracks.track_start(x_frames, id_sk)
+        length = len(x_skeleton['px'])
+        y_start = tracks.track_start(y_frames, id_sk)
+        y_skeleton = {coord: tracks.crop(values, y_start, start, length)
+                      for coord, values in y_frames['skeletons'][id_sk].items()}
+        dx = -y_skeleton['px'] + x_skeleton['px']
+        dy = -y_skeleton['py'] + x_skeleton['py']
+        dz = -y_skeleton['pz'] + x_skeleton['pz']
+        # Smooth direction
+        dx_smooth, dy_smooth, dz_smooth = filt.smooth_points(dx, dy, dz, smooth_filter=smooth_filter,
+                                                             window=window, poly=poly)
+        return np.stack((dx_smooth, dy_smooth, dz_smooth), axis=-1)
+    # If not possible remove skeleton (error in smoothing)
+    except Exception:
+        return None
+
+
+def get_directions(x_frames, y_frames, smooth_filter="savgol", window=5, poly=1, executor=None, verbose=1):
     """ Compute all the directions between x and y points. Assume that every skeleton in x is also present in y after
         the skeleton preprocessing.
 
@@ -162,6 +215,7 @@ def get_directions(x_frames, y_frames, smooth_filter="savgol", window=5, poly=1,
                                              }
                          }
     :param window: smoothing window
+    :param executor: optional concurrent.futures executor processing the skeletons in parallel
     :return: x_frames: same format as input (optionally filtered)
              y_frames: same format as input (optionally filtered)
              directions: dictionary of directions in the following format (each of them is a matrix which columns are
@@ -174,26 +228,27 @@ def get_directions(x_frames, y_frames, smooth_filter="savgol", window=5, poly=1,
     """
     invalid_ids = []
     directions = {'t': x_frames['t'], 'skeletons': {}}
+    if 'starts' in x_frames:
+        directions['starts'] = {}
     # Compute directions
-    for id_sk in x_frames['skeletons']:
-        try:
-            dx = -y_frames['skeletons'][id_sk]['px'] + x_frames['skeletons'][id_sk]['px']
-            dy = -y_frames['skeletons'][id_sk]['py'] + x_frames['skeletons'][id_sk]['py']
-            dz = -y_frames['skeletons'][id_sk]['pz'] + x_frames['skeletons'][id_sk]['pz']
-            # Smooth direction
-            dx_smooth, dy_smooth, dz_smooth = filt.smooth_points(dx, dy, dz, smooth_filter=smooth_filter,
-                                                                 window=window, poly=poly)
-            directions['skeletons'][id_sk] = np.stack((dx_smooth, dy_smooth, dz_smooth), axis=-1)
-        # If not possible remove skeleton (error in smoothing)
-        except Exception:
+    ids = list(x_frames['skeletons'])
+    results = tracks.map_tracks(functools.partial(get_skeleton_direction, x_frames, y_frames,
+                                                  smooth_filter=smooth_filter, window=window, poly=poly),
+                                ids, executor=executor)
+    for id_sk, direction in zip(ids, results):
+        if direction is None:
             invalid_ids.append(id_sk)
+            continue
+        directions['skeletons'][id_sk] = direction
+        if 'starts' in directions:
+            directions['starts'][id_sk] = tracks.track_start(x_frames, id_sk)
     if verbose >= 1:
         print("Directions computed, removing", str(len(invalid_ids)), "skeleton(s) for invalid calculations.")
         print('------------------------------------------------------------')
     # Remove invalid_ids
     for id_sk in invalid_ids:
-        del x_frames['skeletons'][id_sk]
-        del y_frames['skeletons'][id_sk]
+        tracks.remove_track(x_frames, id_sk)
+        tracks.remove_track(y_frames, id_sk)
     return x_frames, y_frames, directions
 
 
@@ -0,0 +1,244 @@
+import numpy as np
+
+
+def grow(array, size):
+    """ Return array with capacity for at least size elements, doubling its length if needed """
+    if size <= len(array):
+        return array
+    grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class IntervalIndex:
+    """ Rows of the intervals of one skeleton or bracelet, kept sorted by start time for binary searches.
+
+        The running maximum of the ends of the sorted rows is kept up to date while appending in time order and when
+        the end of a row is extended (only the rows after it change), so interleaved appends and queries cost
+        O(log n) each. Rows appended out of time order are sorted again at the next query.
+    """
+
+    def __init__(self):
+        self.rows = np.empty(8, dtype=np.int64)
+        self.max_ends = np.empty(8)
+        self.size = 0
+        self.sorted = True
+        # Position of each row in rows, while sorted
+        self.positions = {}
+
+    def add(self, row, starts, ends):
+        self.rows = grow(self.rows, self.size + 1)
+        self.max_ends = grow(self.max_ends, self.size + 1)
+        if self.size > 0 and starts[row] < starts[self.rows[self.size - 1]]:
+            self.sorted = False
+        self.rows[self.size] = row
+        if self.sorted:
+            previous = self.max_ends[self.size - 1] if self.size > 0 else -np.inf
+            self.max_ends[self.size] = max(previous, ends[row])
+            self.positions[row] = self.size
+        self.size += 1
+
+    def changed(self, row, end):
+        """ To be called when the end of a row is extended to end """
+        if self.sorted:
+            position = self.positions[row]
+            suffix = self.max_ends[position:self.size]
+            np.maximum(suffix, end, out=suffix)
+
+    def query(self, starts, ends, t_start, t_end):
+        """ Rows of the intervals overlapping [t_start, t_end], in time order
+
+        :param starts: np.array of the start times of all the rows
+        :param ends: np.array of the end times of all the rows
+        :return: np.array of rows
+        """
+        rows = self.rows[:self.size]
+        if not self.sorted:
+            rows[:] = rows[np.argsort(starts[rows], kind='stable')]
+            # Running maximum of the ends, it is sorted also if the intervals overlap
+            self.max_ends[:self.size] = np.maximum.accumulate(ends[rows])
+            self.positions = {row: position for position, row in enumerate(rows.tolist())}
+            self.sorted = True
+        first = np.searchsorted(self.max_ends[:self.size], t_start, side='left')
+        last = np.searchsorted(starts[rows], t_end, side='right')
+        candidates = rows[first:last]
+        return candidates[ends[candidates] >= t_start]
+
+
+class AssociationTimeline:
+    """ Time-indexed store of the associations returned by identify_and_track over a long recording.
+
+        Consecutive associations of the same skeleton-bracelet pair (separated by at most max_gap seconds) are merged
+        into one interval. Intervals are stored in columnar arrays (start, end, skeleton code, bracelet code) with one
+        sorted index per skeleton and per bracelet, so point and range queries are binary searches. The timeline can be
+        appended to as new windows finish and saved to / loaded from a compressed .npz file.
+    """
+
+    def __init__(self, max_gap=1.0):
+        """
+
+        :param max_gap: maximum time in seconds between two associations of the same pair to merge them
+        """
+        self.max_gap = max_gap
+        self.starts = np.empty(64)
+        self.ends = np.empty(64)
+        self.skeletons = np.empty(64, dtype=np.int32)
+        self.bracelets = np.empty(64, dtype=np.int32)
+        self.size = 0
+        # Skeletons are identified by (camera, skeleton_id), camera is None for single camera associations
+        self.skeleton_keys = []
+        self.skeleton_codes = {}
+        self.bracelet_keys = []
+        self.bracelet_codes = {}
+        self.by_skeleton = []
+        self.by_bracelet = []
+        self.last_of_pair = {}
+
+    def __len__(self):
+        return self.size
+
+    def skeleton_code(self, skeleton_id, camera=None):
+        key = (camera, str(skeleton_id))
+        if key not in self.skeleton_codes:
+            self.skeleton_codes[key] = len(self.skeleton_keys)
+            self.skeleton_keys.append(key)
+            self.by_skeleton.append(IntervalIndex())
+        return self.skeleton_codes[key]
+
+    def bracelet_code(self, bracelet_id):
+        key = str(bracelet_id)
+        if key not in self.bracelet_codes:
+            self.bracelet_codes[key] = len(self.bracelet_keys)
+            self.bracelet_keys.append(key)
+            self.by_bracelet.append(IntervalIndex())
+        return self.bracelet_codes[key]
+
+    def add(self, ts_start, ts_end, skeleton_id, bracelet_id, camera=None):
+        """ Add one association, merging it with the last interval of the same pair if close enough in time """
+        sk = self.skeleton_code(skeleton_id, camera)
+        br = self.bracelet_code(bracelet_id)
+        row = self.last_of_pair.get((sk, br))
+        if row is not None and self.starts[row] <= ts_start and ts_start - self.ends[row] <= self.max_gap:
+            if ts_end > self.ends[row]:
+                self.ends[row] = ts_end
+                self.by_skeleton[sk].changed(row, ts_end)
+                self.by_bracelet[br].changed(row, ts_end)
+            return
+        row = self.size
+        self.starts = grow(self.starts, row + 1)
+        self.ends = grow(self.ends, row + 1)
+        self.skeletons = grow(self.skeletons, row + 1)
+        self.bracelets = grow(self.bracelets, row + 1)
+        self.starts[row] = ts_start
+        self.ends[row] = ts_end
+        self.skeletons[row] = sk
+        self.bracelets[row] = br
+        self.size += 1
+        self.by_skeleton[sk].add(row, self.starts, self.ends)
+        self.by_bracelet[br].add(row, self.starts, self.ends)
+        if (sk, br) not in self.last_of_pair or ts_start >= self.starts[self.last_of_pair[(sk, br)]]:
+            self.last_of_pair[(sk, br)] = row
+
+    def append(self, associations):
+        """ Append the associations of one window
+
+        :param associations: list of association Dicts as returned by identify_and_track (optionally with 'camera')
+        """
+        for association in associations:
+            self.add(association['ts_start'], association['ts_end'], association['skeleton_id'],
+                     association['bracelet_id'], association.get('camera'))
+
+    def extend(self, associations_list):
+        """ Append the associations of several windows, as returned by identify_and_track_windows """
+        for associations in associations_list:
+            self.append(associations)
+
+    def interval(self, row):
+        camera, skeleton_id = self.skeleton_keys[self.skeletons[row]]
+        interval = {'ts_start': float(self.starts[row]), 'ts_end': float(self.ends[row]),
+                    'skeleton_id': skeleton_id, 'bracelet_id': self.bracelet_keys[self.bracelets[row]]}
+        if camera is not None:
+            interval['camera'] = camera
+        return interval
+
+    def skeleton_intervals(self, skeleton_id, t_start, t_end, camera=None):
+        """ Associations of a skeleton overlapping [t_start, t_end]
+
+        :return: list of association Dicts in time order
+        """
+        code = self.skeleton_codes.get((camera, str(skeleton_id)))
+        if code is None:
+            return []
+        rows = self.by_skeleton[code].query(self.starts, self.ends, t_start, t_end)
+        return [self.interval(row) for row in rows]
+
+    def bracelet_intervals(self, bracelet_id, t_start, t_end):
+        """ Associations of a bracelet overlapping [t_start, t_end]
+
+        :return: list of association Dicts in time order
+        """
+        code = self.bracelet_codes.get(str(bracelet_id))
+        if code is None:
+            return []
+        rows = self.by_bracelet[code].query(self.starts, self.ends, t_start, t_end)
+        return [self.interval(row) for row in rows]
+
+    def bracelet_at(self, skeleton_id, t, camera=None):
+        """ Bracelet associated to a skeleton at time t
+
+        :return: bracelet identifier or None
+        """
+        intervals = self.skeleton_intervals(skeleton_id, t, t, camera=camera)
+        return intervals[-1]['bracelet_id'] if len(intervals) > 0 else None
+
+    def skeletons_at(self, bracelet_id, t):
+        """ Skeletons associated to a bracelet at time t (one per camera)
+
+        :return: list of association Dicts
+        """
+        return self.bracelet_intervals(bracelet_id, t, t)
+
+    def compact(self):
+        """ Merge the intervals of the same pair that could not be merged while appending, because their windows
+            were appended out of time order
+        """
+        order = np.argsort(self.starts[:self.size], kind='stable')
+        starts = self.starts[order]
+        ends = self.ends[order]
+        skeletons = self.skeletons[order]
+        bracelets = self.bracelets[order]
+        self.size = 0
+        self.last_of_pair = {}
+        self.by_skeleton = [IntervalIndex() for _ in self.skeleton_keys]
+        self.by_bracelet = [IntervalIndex() for _ in self.bracelet_keys]
+        # Adding again in time order merges every interval with the previous one of its pair
+        for row in range(len(starts)):
+            camera, skeleton_id = self.skeleton_keys[skeletons[row]]
+            self.add(starts[row], ends[row], skeleton_id, self.bracelet_keys[bracelets[row]], camera)
+
+    def save(self, path):
+        """ Save the timeline to a compressed .npz file """
+        self.compact()
+        cameras = np.array(["" if camera is None else camera for camera, _ in self.skeleton_keys], dtype=str)
+        np.savez_compressed(path, starts=self.starts[:self.size], ends=self.ends[:self.size],
+                            skeletons=self.skeletons[:self.size], bracelets=self.bracelets[:self.size],
+                            skeleton_ids=np.array([skeleton_id for _, skeleton_id in self.skeleton_keys], dtype=str),
+                            skeleton_cameras=cameras,
+                            has_camera=np.array([camera is not None for camera, _ in self.skeleton_keys], dtype=bool),
+                            bracelet_ids=np.array(self.bracelet_keys, dtype=str),
+                            max_gap=self.max_gap)
+
+    @classmethod
+    def load(cls, path):
+        """ Load a timeline saved with save, new associations can then be appended to it """
+        with np.load(path) as data:
+            timeline = cls(max_gap=float(data['max_gap']))
+            for skeleton_id, camera, has_camera in zip(data['skeleton_ids'], data['skeleton_cameras'],
+                                                       data['has_camera']):
+                timeline.skeleton_code(str(skeleton_id), str(camera) if has_camera else None)
+            for bracelet_id in data['bracelet_ids']:
+                timeline.bracelet_code(str(bracelet_id))
+            for ts_start, ts_end, sk, br in zip(data['starts'], data['ends'], data['skeletons'], data['bracelets']):
+                camera, skeleton_id = timeline.skeleton_keys[sk]
+                timeline.add(ts_start, ts_end, skeleton_id, timeline.bracelet_keys[br], camera)
+        return timeline
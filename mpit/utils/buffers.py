@@ -0,0 +1,250 @@
+import numpy as np
+
+
+class RingBuffer:
+    """ Fixed-capacity circular buffer of numpy values with O(1) appends and contiguous reads of the last values.
+
+        Values are stored twice in an array of length 2 * capacity (at index i and i + capacity), so that the last n
+        values are always a contiguous slice and can be read as a view, without copies.
+    """
+
+    def __init__(self, capacity, shape=(), dtype=float, fill=np.nan):
+        """
+
+        :param capacity: maximum number of values kept
+        :param shape: shape of each value
+        :param dtype: numpy dtype of the values
+        :param fill: value of the unwritten positions
+        """
+        self.capacity = capacity
+        self.fill = fill
+        self.data = np.full(tuple(shape) + (2 * capacity,), fill, dtype=dtype)
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, value):
+        """ Append one value, evicting the oldest one if the buffer is full
+
+        :param value: value of the buffer shape
+        """
+        position = self.total % self.capacity
+        self.data[..., position] = value
+        self.data[..., position + self.capacity] = value
+        self.total += 1
+
+    def view(self, n=None):
+        """ Get the last n values
+
+        :param n: number of values, all the stored values if None
+        :return: view of shape (..., n) of the buffer data, oldest value first
+        """
+        if n is None or n > len(self):
+            n = len(self)
+        end = (self.total - 1) % self.capacity + 1 + self.capacity if self.total > 0 else self.capacity
+        return self.data[..., end - n:end]
+
+    def clear(self):
+        self.data[...] = self.fill
+        self.total = 0
+
+
+def last_seconds(t, duration):
+    """ Number of values of the time-ordered t in the last duration seconds
+
+    :param t: np.array of timestamps ordered in time
+    :param duration: duration in seconds, if None all the values are taken
+    :return: number of values
+    """
+    if duration is None or len(t) == 0:
+        return len(t)
+    return len(t) - np.searchsorted(t, t[-1] - duration, side='left')
+
+
+class SkeletonHistory:
+    """ Rolling history of the positions of some skeleton points for every skeleton id.
+
+        All the skeletons share the same timestamps (the camera frames): each id has a slot in a preallocated array
+        (max_ids, points, 3, 2 * capacity) and a frame writes a column for all slots at once, with NaN for the ids
+        missing in the frame. Ids not seen for more than max_idle seconds are evicted and their slot reused, so memory
+        is bounded regardless of the length of the session.
+    """
+
+    def __init__(self, points, tot_points, capacity=600, max_ids=32, max_idle=5.0, min_confidence=None,
+                 dtype=np.float64):
+        """
+
+        :param points: list of the indexes of the points to keep (e.g. wrist and elbow)
+        :param tot_points: number of points per skeleton depending on the camera
+        :param capacity: number of frames kept
+        :param max_ids: maximum number of skeleton ids kept at the same time, the least recently seen is evicted
+        :param max_idle: seconds after which an id not seen anymore is evicted
+        :param min_confidence: if not None, points with confidence lower than min_confidence are stored as NaN
+        :param dtype: floating point precision of the positions, the timestamps are always float64
+        """
+        self.points = list(points)
+        self.min_confidence = min_confidence
+        self.tot_points = tot_points
+        self.max_ids = max_ids
+        self.max_idle = max_idle
+        self.t = RingBuffer(capacity)
+        self.positions = RingBuffer(capacity, shape=(max_ids, len(self.points), 3), dtype=dtype)
+        self.slots = {}
+        self.last_seen = np.full(max_ids, -np.inf)
+        self.column = np.full((max_ids, len(self.points), 3), np.nan, dtype=dtype)
+        # Slots of column written by the last frame, the others are NaN
+        self.written = set()
+        self.evicted = 0
+
+    def evict(self, id_sk):
+        """ Remove one skeleton id and free its slot """
+        slot = self.slots.pop(id_sk)
+        self.positions.data[slot] = np.nan
+        self.last_seen[slot] = -np.inf
+        self.evicted += 1
+
+    def evict_idle(self, now):
+        """ Remove the skeleton ids not seen for more than max_idle seconds before now """
+        idle = [id_sk for id_sk, slot in self.slots.items() if now - self.last_seen[slot] > self.max_idle]
+        for id_sk in idle:
+            self.evict(id_sk)
+
+    def get_slot(self, id_sk):
+        if id_sk not in self.slots:
+            if len(self.slots) == self.max_ids:
+                # Evict the least recently seen
+                self.evict(min(self.slots, key=lambda id_old: self.last_seen[self.slots[id_old]]))
+            used = set(self.slots.values())
+            self.slots[id_sk] = next(slot for slot in range(self.max_ids) if slot not in used)
+        return self.slots[id_sk]
+
+    def append(self, frame):
+        """ Append one skeleton frame
+
+        :param frame: skeleton frame as {'skeletons': {'<id_sk1>': {'joints3D': [<values>], ...}, ...},
+                                         'timestamp': <value>}
+        """
+        timestamp = frame['timestamp']
+        self.evict_idle(timestamp)
+        written = set()
+        for id_sk, sk in frame['skeletons'].items():
+            slot = self.get_slot(id_sk)
+            self.last_seen[slot] = timestamp
+            written.add(slot)
+            # Check if data are corrupted, if so the order of points cannot be inferred
+            if len(sk['joints3D']) != self.tot_points:
+                self.column[slot] = np.nan
+                continue
+            joints = [sk['joints3D'][point] for point in self.points]
+            self.column[slot] = joints
+            # Replace all -1 values (invalid points) with np.nan, this must be conditioned on z!
+            invalid = [joint[2] == -1 for joint in joints]
+            if self.min_confidence is not None and len(sk.get('confidences', ())) == self.tot_points:
+                invalid = [bad or sk['confidences'][point] < self.min_confidence
+                           for bad, point in zip(invalid, self.points)]
+            if any(invalid):
+                self.column[slot, invalid] = np.nan
+        # Only the slots of the ids of the last frame missing in this one are reset, not the whole column
+        for slot in self.written - written:
+            self.column[slot] = np.nan
+        self.written = written
+        self.t.append(timestamp)
+        self.positions.append(self.column)
+
+    def extend(self, frames):
+        """ Append a list of skeleton frames in the format of get_positions_one_point """
+        for frame in frames:
+            self.append(frame)
+
+    def get_positions_one_point(self, point, duration=None, copy=True):
+        """ Get the history of one point in the same format of preprocessing.get_positions_one_point
+
+        :param point: index of the point (must be one of points)
+        :param duration: seconds of history to get, all the history if None
+        :param copy: if False the arrays are views of the buffer (no copy, but they must not be modified, which the
+                     pipeline stages do)
+        :return: {'t': np.array(values), 'skeletons': {<id_sk1>: {'px': ..., 'py': ..., 'pz': ...}, ...}}
+        """
+        t = self.t.view()
+        n = last_seconds(t, duration)
+        positions = self.positions.view(n)[:, self.points.index(point)]
+        t = t[len(t) - n:]
+        skeletons = {}
+        for id_sk, slot in self.slots.items():
+            p = positions[slot].copy() if copy else positions[slot]
+            skeletons[id_sk] = {'px': p[0], 'py': p[1], 'pz': p[2]}
+        return {'t': t.copy() if copy else t, 'skeletons': skeletons}
+
+
+class BraceletHistory:
+    """ Rolling history of the accelerations of every bracelet id, in two ring buffers (t and ax, ay, az) per id.
+        Ids not seen for more than max_idle seconds are evicted.
+    """
+
+    def __init__(self, capacity=1500, max_ids=32, max_idle=5.0, dtype=np.float64):
+        """
+
+        :param capacity: number of samples kept per bracelet
+        :param max_ids: maximum number of bracelet ids kept at the same time, the least recently seen is evicted
+        :param max_idle: seconds after which an id not seen anymore is evicted
+        :param dtype: floating point precision of the accelerations, the timestamps are always float64
+        """
+        self.capacity = capacity
+        self.dtype = dtype
+        self.max_ids = max_ids
+        self.max_idle = max_idle
+        self.buffers = {}
+        self.last_seen = {}
+        self.evicted = 0
+
+    def evict(self, id_br):
+        del self.buffers[id_br]
+        del self.last_seen[id_br]
+        self.evicted += 1
+
+    def evict_idle(self, now):
+        """ Remove the bracelet ids not seen for more than max_idle seconds before now """
+        for id_br in [id_br for id_br, seen in self.last_seen.items() if now - seen > self.max_idle]:
+            self.evict(id_br)
+
+    def append(self, sample):
+        """ Append one acceleration measurement
+
+        :param sample: measurement as {'x': <value>, 'y': <value>, 'z': <value>, 'timestamp': <value>, 'id': <value>}
+        """
+        timestamp = sample['timestamp']
+        id_br = sample['id']
+        self.evict_idle(timestamp)
+        if id_br not in self.buffers:
+            if len(self.buffers) == self.max_ids:
+                self.evict(min(self.last_seen, key=self.last_seen.get))
+            self.buffers[id_br] = (RingBuffer(self.capacity), RingBuffer(self.capacity, shape=(3,), dtype=self.dtype))
+        self.buffers[id_br][0].append(timestamp)
+        self.buffers[id_br][1].append((sample['x'], sample['y'], sample['z']))
+        self.last_seen[id_br] = timestamp
+
+    def extend(self, samples):
+        """ Append a list of acceleration measurements in the format of get_accelerations """
+        for sample in samples:
+            self.append(sample)
+
+    def get_accelerations(self, duration=None, copy=True):
+        """ Get the history of the bracelets in the same format of preprocessing.get_accelerations
+
+        :param duration: seconds of history to get (relative to the last sample of each bracelet), all if None
+        :param copy: if False the arrays are views of the buffers (no copy, but they must not be modified, which the
+                     pipeline stages do)
+        :return: {<id_br1>: {'ax': ..., 'ay': ..., 'az': ..., 't': ...}, ...}
+        """
+        accelerations = {}
+        for id_br, (t_buffer, buffer) in self.buffers.items():
+            t = t_buffer.view()
+            n = last_seconds(t, duration)
+            t = t[len(t) - n:]
+            values = buffer.view(n)
+            if copy:
+                t = t.copy()
+                values = values.copy()
+            accelerations[id_br] = {'ax': values[0], 'ay': values[1], 'az': values[2], 't': t}
+        return accelerations
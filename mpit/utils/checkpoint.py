@@ -0,0 +1,64 @@
+import os
+import json
+import hashlib
+
+from mpit import __version__
+
+
+def checksum(skeletons_frames, accelerations_dict, params):
+    """ Checksum of the inputs and parameters of a run, a checkpoint is reused only if it matches
+
+    :param skeletons_frames: skeletons data in the format of our dataset
+    :param accelerations_dict: acceleration data in the format of our dataset
+    :param params: dict of the parameters of the run
+    :return: hexadecimal sha256 digest
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps({'version': __version__, 'params': params}, sort_keys=True, default=str).encode())
+    # Items are hashed one at a time to avoid serializing a whole multi-day recording in memory
+    for items in (skeletons_frames, accelerations_dict):
+        sha.update(str(len(items)).encode())
+        for item in items:
+            sha.update(json.dumps(item, sort_keys=True, default=float).encode())
+    return sha.hexdigest()
+
+
+def load_checkpoint(path, digest, verbose=0):
+    """ Load the state saved by save_checkpoint
+
+    :param path: checkpoint file
+    :param digest: checksum of the current run
+    :param verbose: if >=1 print logs
+    :return: saved state, None if the file does not exist, can not be read or belongs to another run
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as fs:
+            state = json.load(fs)
+    except ValueError:
+        if verbose >= 1:
+            print("Checkpoint", path, "is corrupted, starting from the beginning")
+        return None
+    if state.get('checksum') != digest:
+        if verbose >= 1:
+            print("Checkpoint", path, "belongs to different inputs or parameters, starting from the beginning")
+        return None
+    if verbose >= 1:
+        print("Resuming from checkpoint", path, "at timestamp", state['next_ts'])
+        print('------------------------------------------------------------')
+    return state
+
+
+def save_checkpoint(path, state):
+    """ Write the state of a run to path atomically, a run killed while saving keeps the previous checkpoint
+
+    :param path: checkpoint file
+    :param state: JSON serializable dict, must contain 'checksum'
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fs:
+        json.dump(state, fs, default=float)
+        fs.flush()
+        os.fsync(fs.fileno())
+    os.replace(tmp_path, path)
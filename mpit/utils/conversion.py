@@ -1,48 +1,102 @@
 import math
+import functools
 import numpy as np
+import mpit.utils.tracks as tracks
+import mpit.utils.kernels as kernels
 
-from scipy.signal import savgol_filter
+from mpit.utils.filtering import SavgolFilter
 
 
-def velocity_from_position(t, pos, window, poly):
+def finite_difference(t, values):
+    """ Finite differences of values over the differences of t, NaN where one of the two values is NaN
+
+    :param t: np.array of timestamps
+    :param values: np.array of values
+    :return: np.array of len(values) - 1 differences in the dtype of values
+    """
+    compiled = kernels.get_kernels()
+    if compiled is not None:
+        return compiled['finite_difference'](np.asarray(t, dtype=np.float64), values)
+    # Timestamps differences are computed in float64, the result keeps the precision of the values
+    return np.divide(np.diff(values), np.diff(t)).astype(values.dtype, copy=False)
+
+
+def valid_difference(t, values):
+    """ Finite differences between consecutive non-NaN values, skipping the NaNs in between
+
+    :param t: np.array of timestamps
+    :param values: np.array of values
+    :return: np.array of len(values) - 1 values, the difference between two valid values is stored at the index of the
+             first one, NaN elsewhere
+    """
+    compiled = kernels.get_kernels()
+    if compiled is not None:
+        return compiled['valid_difference'](np.asarray(t, dtype=np.float64), values)
+    valids = np.flatnonzero(~np.isnan(values))
+    out = np.full(max(len(values) - 1, 0), np.nan, dtype=values.dtype)
+    out[valids[:-1]] = np.diff(values[valids]) / np.diff(t[valids])
+    return out
+
+
+def velocity_from_position(t, pos, window, poly, smooth_filter=None):
     """
 
     :param t:
     :param pos:
     :param window:
     :param poly:
+    :param smooth_filter: optional SavgolFilter precomputed with window and poly
     :return:
     """
-    dt = np.diff(t)
-    dpos = np.diff(pos)
-    vel = np.divide(dpos, dt)
+    if smooth_filter is None:
+        smooth_filter = SavgolFilter(window, poly)
+    vel = finite_difference(t, pos)
     # smooth valid values
     valid_vel = np.where(~np.isnan(vel))
-    vel_interp = savgol_filter(vel[valid_vel], window, poly, mode='interp')
+    vel_interp = smooth_filter(vel[valid_vel])
     vel[valid_vel] = vel_interp
     return vel
 
 
-def acceleration_from_position(t, pos, window, poly):
+def acceleration_from_position(t, pos, window, poly, smooth_filter=None):
     """
 
     :param t:
     :param pos:
     :param window:
     :param poly:
+    :param smooth_filter: optional SavgolFilter precomputed with window and poly
     :return:
     """
-    vel = velocity_from_position(t, pos, window, poly)
-    dt = np.diff(t)
-    dv = np.diff(vel)
-    a = np.divide(dv, dt[:-1])
+    if smooth_filter is None:
+        smooth_filter = SavgolFilter(window, poly)
+    vel = velocity_from_position(t, pos, window, poly, smooth_filter=smooth_filter)
+    a = finite_difference(t[:-1], vel)
     valid_a = np.where(~np.isnan(a))
-    a_interp = savgol_filter(a[valid_a], window, poly, mode='interp')
+    a_interp = smooth_filter(a[valid_a])
     vel[valid_a] = a_interp
     return a
 
 
-def get_skeletons_point_accelerations(positions_point, window, poly, verbose=1):
+def get_skeleton_point_accelerations(positions_point, id_sk, window, poly, smooth_filter=None):
+    """ Compute accelerations of one point of one skeleton, see get_skeletons_point_accelerations
+
+    :return: dict {'ax': np.array(values), 'ay': np.array(values), 'az': np.array(values)}, coordinates too short
+             for filtering are not included
+    """
+    accelerations = {}
+    for axis, vals in positions_point['skeletons'][id_sk].items():
+        # Otherwise, filtering is not possible
+        if len(vals) > window:
+            # Generate name for accelerations field
+            name = axis.replace('p', 'a')
+            # Sparse tracks are differentiated on their own frames, their accelerations keep the same start
+            accelerations[name] = acceleration_from_position(tracks.track_t(positions_point, id_sk, len(vals)),
+                                                             vals, window, poly, smooth_filter=smooth_filter)
+    return accelerations
+
+
+def get_skeletons_point_accelerations(positions_point, window, poly, smooth_filter=None, executor=None, verbose=1):
     """ Compute accelerations of one skeleton point
 
     :param verbose: if >=1 logs
@@ -56,6 +110,8 @@ def get_skeletons_point_accelerations(positions_point, window, poly, verbose=1):
                            }
     :param window for smoothing
     :param poly for smoothing
+    :param smooth_filter: optional SavgolFilter precomputed with window and poly
+    :param executor: optional concurrent.futures executor processing the skeletons in parallel
     :return: accelerations of one point in numpy format structured as following dict
              {'t': np.array(values),
                   'skeletons' : {<id_sk1>: {'ax': np.array(values),
@@ -71,17 +127,17 @@ def get_skeletons_point_accelerations(positions_point, window, poly, verbose=1):
     skeletons = positions_point['skeletons']
     # Last two are lost for differentiation
     skeletons_accel = {'t': t[:-2]}
-    accel_dict = {}
     # For each skeleton compute the accelerations of the point in x, y, z
-    for id_sk, skeleton in skeletons.items():
-        accel_dict[id_sk] = {}
-        for axis, vals in skeleton.items():
-            # Otherwise, filtering is not possible
-            if len(vals) > window:
-                # Generate name for accelerations field
-                name = axis.replace('p', 'a')
-                accel_dict[id_sk][name] = acceleration_from_position(t, vals, window, poly)
+    if smooth_filter is None:
+        smooth_filter = SavgolFilter(window, poly)
+    ids = list(skeletons)
+    accel_dict = dict(zip(ids, tracks.map_tracks(functools.partial(get_skeleton_point_accelerations, positions_point,
+                                                                   window=window, poly=poly,
+                                                                   smooth_filter=smooth_filter),
+                                                 ids, executor=executor)))
     skeletons_accel['skeletons'] = accel_dict
+    if 'starts' in positions_point:
+        skeletons_accel['starts'] = {id_sk: positions_point['starts'][id_sk] for id_sk in accel_dict}
     if verbose >= 1:
         print("Acceleration correctly computed for skeletons points.")
         print('------------------------------------------------------------')
@@ -107,6 +163,69 @@ def rotation_matrix(axis, theta):
                      [2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc]])
 
 
+def rotation_axes(directions):
+    """ Rotate the camera axes such that the x-axis is parallel to each direction, following
+        https://math.stackexchange.com/questions/542801/rotate-3d-coordinate-system-such-that-z-axis-is-parallel-to-a-given-vector
+
+    :param directions: np.array((n, 3)) of directions, computations are done in their precision
+    :return: u, v, w: np.array((n, 3)) images of the x, y and z camera axes for each frame
+    """
+    compiled = kernels.get_kernels()
+    if compiled is not None:
+        return compiled['rotation_axes'](directions)
+    dtype = directions.dtype
+    x_axis = np.array((1, 0, 0), dtype=dtype)
+    # Compute magnitudes of bracelet x-directions
+    magnitudes = np.linalg.norm(directions, axis=1)
+    # Compute bracelet x-directions normalized
+    directions_norm = directions / magnitudes[:, None]
+    # Compute angles between x-axis of camera and normalized direction of bracelet x-axis
+    angles = np.arccos(np.dot(directions_norm, x_axis))
+    # Compute vector product between x-axis of camera and normalized direction of bracelet x-axis = b
+    b = np.cross(x_axis, directions_norm)
+    b_magnitudes = np.linalg.norm(b, axis=1)
+    b_norm = b / (b_magnitudes[:, None] + np.finfo(dtype).eps)
+    # Now compute the parameters of the quaternion rotation matrix
+    q0 = np.cos(angles / 2)
+    q1 = np.sin(angles / 2) * b_norm[:, 0]
+    q2 = np.sin(angles / 2) * b_norm[:, 1]
+    q3 = np.sin(angles / 2) * b_norm[:, 2]
+    # Generate the Q matrix 3x3xn where n is the number of frames
+    q_mat = np.array((
+        (np.square(q0) + np.square(q1) - np.square(q2) - np.square(q3),
+         2 * (np.multiply(q1, q2) - np.multiply(q0, q3)),
+         2 * (np.multiply(q1, q3) + np.multiply(q0, q2))),
+        (2 * (np.multiply(q2, q1) + np.multiply(q0, q3)),
+         np.square(q0) - np.square(q1) + np.square(q2) - np.square(q3),
+         2 * (np.multiply(q2, q3) - np.multiply(q0, q1))),
+        (2 * (np.multiply(q3, q1) - np.multiply(q0, q2)), 2 * (np.multiply(q3, q2) + np.multiply(q0, q1)),
+         np.square(q0) - np.square(q1) - np.square(q2) + np.square(q3)
+         )), dtype=dtype)
+    # Compute new axis directions, the images of the camera axes are the columns of Q for each frame
+    u = np.ascontiguousarray(q_mat[:, 0, :].T)
+    v = np.ascontiguousarray(q_mat[:, 1, :].T)
+    w = np.ascontiguousarray(q_mat[:, 2, :].T)
+    return u, v, w
+
+
+def project(accelerations, u, v, w):
+    """ Components of the accelerations on the axes of each frame
+
+    :param accelerations: np.array((n, 3)) of accelerations in camera coordinates
+    :param u: np.array((n, 3)) first axis of each frame
+    :param v: np.array((n, 3)) second axis of each frame
+    :param w: np.array((n, 3)) third axis of each frame
+    :return: au, av, aw: np.array(n) components on u, v and w
+    """
+    compiled = kernels.get_kernels()
+    if compiled is not None:
+        return compiled['project'](accelerations, u, v, w)
+    au = np.einsum('ij,ij->i', accelerations, u)
+    av = np.einsum('ij,ij->i', accelerations, v)
+    aw = np.einsum('ij,ij->i', accelerations, w)
+    return au, av, aw
+
+
 def angles_with_axis(vectors):
     """
 
@@ -1,5 +1,7 @@
+import math
 import numpy as np
-from scipy.signal import savgol_filter, wiener
+
+from mpit.utils.precision import as_float_array
 
 
 def nan_helper(y):
@@ -38,35 +40,126 @@ def interpolate_points(px, py, pz):
     return px, py, pz
 
 
+# Spellings of the Wiener filter, "weiner" is the one of the parameters of the PIT
+WIENER = ("weiner", "wiener")
+
+
+def savgol_coeffs(window, poly, deriv=0, delta=1.0, pos=None):
+    """ Coefficients of a Savitzky-Golay filter, same output of scipy.signal.savgol_coeffs(..., use='dot') without
+        importing scipy.signal, which is slow to import
+
+    :param window: window of smoothing
+    :param poly: polynomial order of smoothing
+    :param deriv: order of the derivative to compute (0 for smoothing)
+    :param delta: spacing of the samples, used only if deriv > 0
+    :param pos: position in the window where the polynomial is evaluated, the center if None
+    :return: np.array of window coefficients, to multiply with the window samples
+    """
+    if poly >= window:
+        raise ValueError("polyorder must be less than window_length.")
+    if pos is None:
+        pos = (window - 1) / 2
+    if deriv > poly:
+        return np.zeros(window)
+    # The derivative at pos of the polynomial fitted by least squares on the window samples is linear in them, its
+    # coefficients are the minimum norm solution of A c = y as in scipy
+    powers = (np.arange(window) - pos) ** np.arange(poly + 1)[:, None]
+    derivative = np.zeros(poly + 1)
+    derivative[deriv] = math.factorial(deriv) / delta ** deriv
+    return np.linalg.lstsq(powers, derivative, rcond=None)[0]
+
+
+class SavgolFilter:
+    """ Savitzky-Golay filter with precomputed coefficients, same output of scipy.signal.savgol_filter(x, window,
+        poly) (mode='interp') without computing the coefficients and fitting the edge polynomials at every call.
+
+        The values away from the edges are the dot products of the sliding windows with the coefficients, the first
+        and last window // 2 values are the polynomials fitted on the first and last window samples, which are also
+        linear in the samples and are precomputed as matrices.
+    """
+
+    def __init__(self, window=7, poly=1):
+        """
+
+        :param window: window of smoothing
+        :param poly: polynomial order of smoothing
+        """
+        self.window = window
+        self.poly = poly
+        self.coeffs = savgol_coeffs(window, poly)
+        # Least squares fit of a polynomial on the window samples, evaluated on the edge positions
+        half = window // 2
+        fit = np.linalg.pinv(np.vander(np.arange(window, dtype=float), poly + 1))
+        self.left = np.vander(np.arange(half, dtype=float), poly + 1) @ fit
+        self.right = np.vander(np.arange(window - half, window, dtype=float), poly + 1) @ fit
+
+    def __call__(self, x):
+        """ Smooth a sequence
+
+        :param x: np.array of samples
+        :return: np.array of smoothed samples, in the precision of x if float32, otherwise float64
+        """
+        x = as_float_array(x)
+        if self.window > len(x):
+            raise ValueError("window must be less than or equal to the size of x.")
+        y = np.empty(len(x), dtype=x.dtype)
+        half = self.window // 2
+        # Output index of the first window, as in scipy.ndimage.convolve1d (one sample earlier for even windows)
+        first = (self.window - 1) // 2
+        y[first:first + len(x) - self.window + 1] = np.lib.stride_tricks.sliding_window_view(x, self.window) @ \
+            self.coeffs
+        y[:half] = self.left @ x[:self.window]
+        y[len(x) - half:] = self.right @ x[len(x) - self.window:]
+        return y
+
+
+def smoother(smooth_filter="savgol", window=7, poly=1):
+    """ Precompute a smoothing filter for smooth_points, smooth_accelerations and the conversion of positions to
+        accelerations
+
+    :param smooth_filter: type of filtering, possible values: "savgol", "weiner" (or "wiener")
+    :param window: window of smoothing
+    :param poly: polynomial order of smoothing (only for savgol)
+    :return: SavgolFilter for "savgol", otherwise "wiener" (the Wiener filter has no coefficients)
+    """
+    assert smooth_filter == "savgol" or smooth_filter in WIENER, \
+        "Invalid filtering type, please choose savgol or weiner"
+    if smooth_filter == "savgol":
+        return SavgolFilter(window, poly)
+    return "wiener"
+
+
 def smooth_points(px, py, pz, smooth_filter="savgol", window=7, poly=1):
     """ Smooth 3D seqeunces
 
     :param px: np.ndarray of points x coordinates
     :param py: np.ndarray of points y coordinates
     :param pz: np.ndarray of points z coordinates
-    :param smooth_filter: type of filtering, possible values: "savgol", "weiner"
+    :param smooth_filter: type of filtering, possible values: "savgol", "weiner" (or "wiener"), or a filter precomputed
+                          with smoother, in which case window and poly are ignored
     :param window: window of smoothing
     :param poly: polynomial order of smoothing
     :return: Smoothed points px, py and pz as numpy arrays
     """
-
-    assert smooth_filter == "savgol" or smooth_filter == "weiner", \
-        "Invalid filtering type, please choose savgol or weiner"
+    if not isinstance(smooth_filter, SavgolFilter):
+        smooth_filter = smoother(smooth_filter, window=window, poly=poly)
     # Discard NaNs eventually
     valid = np.where(~np.isnan(px))
-    if smooth_filter == "savgol":
+    if isinstance(smooth_filter, SavgolFilter):
         # Smooth
-        px[valid] = savgol_filter(px[valid], window, poly)
-        py[valid] = savgol_filter(py[valid], window, poly)
-        pz[valid] = savgol_filter(pz[valid], window, poly)
-    elif smooth_filter == "wiener":
+        px[valid] = smooth_filter(px[valid])
+        py[valid] = smooth_filter(py[valid])
+        pz[valid] = smooth_filter(pz[valid])
+    elif smooth_filter in WIENER:
+        # Imported here, scipy.signal is slow to import
+        from scipy.signal import wiener
         px[valid] = wiener(px[valid], window)
         py[valid] = wiener(py[valid], window)
         pz[valid] = wiener(pz[valid], window)
     return px, py, pz
 
 
-def smooth_accelerations(accelerations, window=35, poly=1):
+def smooth_accelerations(accelerations, window=35, poly=1, smooth_filter=None):
     """ Smooth 3D accelerations
     
     :param accelerations: dictionary as
@@ -79,11 +172,234 @@ def smooth_accelerations(accelerations, window=35, poly=1):
                   }
     :param window: window of smoothing
     :param poly: polynomial order of smoothing
+    :param smooth_filter: optional SavgolFilter precomputed with window and poly
     :return: Smoothed accelerations in the same format as input
     """
-
+    if smooth_filter is None:
+        smooth_filter = SavgolFilter(window, poly)
     for id_br in accelerations:
-        accelerations[id_br]['ax'] = savgol_filter(accelerations[id_br]['ax'], window, poly)
-        accelerations[id_br]['ay'] = savgol_filter(accelerations[id_br]['ay'], window, poly)
-        accelerations[id_br]['az'] = savgol_filter(accelerations[id_br]['az'], window, poly)
+        accelerations[id_br]['ax'] = smooth_filter(accelerations[id_br]['ax'])
+        accelerations[id_br]['ay'] = smooth_filter(accelerations[id_br]['ay'])
+        accelerations[id_br]['az'] = smooth_filter(accelerations[id_br]['az'])
     return accelerations
+
+
+class SavgolStream:
+    """ Stateful Savitzky-Golay filter for continuous streams. The last window - 1 samples are kept between calls,
+        so each sample is processed once and chunk boundaries have no edge effects.
+
+        The filter is causal for lag=0 (the polynomial fitted on the last window samples is evaluated on the last
+        one) or fixed-lag: with lag=window // 2 the output of each sample is delayed by lag samples and equals the
+        zero-phase savgol_filter away from the edges. Samples are assumed equally spaced.
+    """
+
+    def __init__(self, window=7, poly=1, deriv=0, delta=1.0, lag=0):
+        """
+
+        :param window: window of smoothing
+        :param poly: polynomial order of smoothing
+        :param deriv: order of the derivative to compute (0 for smoothing)
+        :param delta: spacing of the samples, used only if deriv > 0
+        :param lag: delay in samples of the output, between 0 (causal) and window - 1
+        """
+        assert 0 <= lag < window, "Invalid lag, it must be between 0 and window - 1"
+        self.window = window
+        self.lag = lag
+        self.coeffs = savgol_coeffs(window, poly, deriv=deriv, delta=delta, pos=window - 1 - lag)
+        self.reset()
+
+    def reset(self):
+        self.t_state = np.empty(0)
+        self.x_state = None
+
+    def process(self, t, x):
+        """ Filter a new chunk of samples
+
+        :param t: np.array of the timestamps of the samples
+        :param x: np.array of the samples, of shape (n,) or (n, channels) to filter several channels together
+        :return: t_out: np.array of the timestamps of the filtered samples (delayed by lag samples)
+                 y: np.array of the filtered samples, nothing is returned until window samples have been seen
+        """
+        t = np.asarray(t, dtype=float)
+        x = as_float_array(x)
+        t_buf = np.concatenate((self.t_state, t))
+        x_buf = x if self.x_state is None else np.concatenate((self.x_state, x))
+        # Keep the last window - 1 samples for the next chunk
+        self.t_state = t_buf[-(self.window - 1):] if self.window > 1 else t_buf[:0]
+        self.x_state = x_buf[-(self.window - 1):] if self.window > 1 else x_buf[:0]
+        if len(x_buf) < self.window:
+            return t_buf[:0], x_buf[:0]
+        windows = np.lib.stride_tricks.sliding_window_view(x_buf, self.window, axis=0)
+        y = windows @ self.coeffs.astype(x_buf.dtype, copy=False)
+        t_out = t_buf[self.window - 1 - self.lag: len(t_buf) - self.lag]
+        return t_out, y
+
+
+class WienerStream:
+    """ Stateful Wiener filter for continuous streams, causal (lag=0) or fixed-lag (lag=window // 2 gives the same
+        centered local statistics of scipy.signal.wiener).
+
+        If the noise power is not given it is estimated as the average of the local variances, like
+        scipy.signal.wiener, but over all the samples seen so far instead of the whole signal, which a stream does not
+        have. This is a deliberate deviation: the first outputs use a noise estimated on few samples, so with
+        estimated noise the output differs from the batch filter, mostly at the beginning of the stream (up to about
+        0.25-0.3 on unit-variance test signals fed in chunks of 10 samples, below 0.01 in one chunk). With a given
+        noise it equals scipy.signal.wiener away from the edges.
+    """
+
+    def __init__(self, window=7, noise=None, lag=0):
+        """
+
+        :param window: window of smoothing
+        :param noise: noise power, estimated if None
+        :param lag: delay in samples of the output, between 0 (causal) and window - 1
+        """
+        assert 0 <= lag < window, "Invalid lag, it must be between 0 and window - 1"
+        self.window = window
+        self.noise = noise
+        self.lag = lag
+        self.reset()
+
+    def reset(self):
+        self.t_state = np.empty(0)
+        self.x_state = None
+        self.var_sum = 0
+        self.var_count = 0
+
+    def process(self, t, x):
+        """ Filter a new chunk of samples
+
+        :param t: np.array of the timestamps of the samples
+        :param x: np.array of the samples, of shape (n,) or (n, channels) to filter several channels together
+        :return: t_out: np.array of the timestamps of the filtered samples (delayed by lag samples)
+                 y: np.array of the filtered samples, nothing is returned until window samples have been seen
+        """
+        t = np.asarray(t, dtype=float)
+        x = as_float_array(x)
+        t_buf = np.concatenate((self.t_state, t))
+        x_buf = x if self.x_state is None else np.concatenate((self.x_state, x))
+        self.t_state = t_buf[-(self.window - 1):] if self.window > 1 else t_buf[:0]
+        self.x_state = x_buf[-(self.window - 1):] if self.window > 1 else x_buf[:0]
+        if len(x_buf) < self.window:
+            return t_buf[:0], x_buf[:0]
+        windows = np.lib.stride_tricks.sliding_window_view(x_buf, self.window, axis=0)
+        local_mean = windows.mean(axis=-1)
+        local_var = np.square(windows).mean(axis=-1) - np.square(local_mean)
+        if self.noise is None:
+            # Accumulated in float64, over long streams float32 would lose precision
+            self.var_sum = self.var_sum + local_var.sum(axis=0, dtype=np.float64)
+            self.var_count += len(local_var)
+            noise = self.var_sum / self.var_count
+        else:
+            noise = self.noise
+        centers = x_buf[self.window - 1 - self.lag: len(x_buf) - self.lag]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y = local_mean + (1 - noise / local_var) * (centers - local_mean)
+        y = np.where(local_var < noise, local_mean, y).astype(x_buf.dtype, copy=False)
+        t_out = t_buf[self.window - 1 - self.lag: len(t_buf) - self.lag]
+        return t_out, y
+
+
+def smoothing_stream(smooth_filter="savgol", window=7, poly=1, lag=0):
+    """ Build the stateful version of the filters of smooth_points
+
+    :param smooth_filter: type of filtering, possible values: "savgol", "weiner" (or "wiener")
+    :param window: window of smoothing
+    :param poly: polynomial order of smoothing (only for savgol)
+    :param lag: delay in samples of the output, 0 for causal filtering
+    :return: SavgolStream or WienerStream
+    """
+    assert smooth_filter == "savgol" or smooth_filter in WIENER, \
+        "Invalid filtering type, please choose savgol or weiner"
+    if smooth_filter == "savgol":
+        return SavgolStream(window=window, poly=poly, lag=lag)
+    return WienerStream(window=window, lag=lag)
+
+
+class DifferentiatorStream:
+    """ Stateful version of conversion.velocity_from_position: finite differences of the samples over their
+        timestamps, smoothed with a SavgolStream. With order=2 the smoothed velocity is differentiated again, as in
+        conversion.acceleration_from_position. NaN samples are skipped.
+    """
+
+    def __init__(self, window=3, poly=1, lag=0, order=1):
+        """
+
+        :param window: window of smoothing of the velocity
+        :param poly: polynomial order of smoothing of the velocity
+        :param lag: delay in samples of the smoothed velocity, 0 for causal filtering
+        :param order: 1 for velocity, 2 for acceleration
+        """
+        assert order in (1, 2), "Invalid order, please choose 1 (velocity) or 2 (acceleration)"
+        self.order = order
+        self.smoother = SavgolStream(window=window, poly=poly, lag=lag)
+        self.reset()
+
+    def reset(self):
+        self.smoother.reset()
+        self.last = [None, None]
+
+    def diff(self, step, t, x):
+        """ Finite differences of a chunk continuing the previous chunk of the same step, the output of each sample
+            is associated to the timestamp of the previous one (as np.diff(x) / np.diff(t) does)
+        """
+        if self.last[step] is not None:
+            t = np.concatenate(([self.last[step][0]], t))
+            x = np.concatenate((self.last[step][1][None], x))
+        if len(t) == 0:
+            return t, x
+        self.last[step] = (t[-1], x[-1])
+        dx = np.diff(x, axis=0) / np.diff(t).reshape((-1,) + (1,) * (x.ndim - 1))
+        return t[:-1], dx.astype(x.dtype, copy=False)
+
+    def process(self, t, x):
+        """ Differentiate a new chunk of samples
+
+        :param t: np.array of the timestamps of the samples
+        :param x: np.array of the samples, of shape (n,) or (n, channels)
+        :return: t_out: np.array of the timestamps of the outputs
+                 y: np.array of the velocities (order=1) or accelerations (order=2)
+        """
+        t = np.asarray(t, dtype=float)
+        x = as_float_array(x)
+        # Empty polls return nothing and leave the state unchanged
+        if len(t) == 0:
+            return t, x
+        valid = ~np.isnan(x).reshape(len(x), -1).any(axis=1)
+        t_vel, vel = self.diff(0, t[valid], x[valid])
+        t_vel, vel = self.smoother.process(t_vel, vel)
+        if self.order == 1:
+            return t_vel, vel
+        return self.diff(1, t_vel, vel)
+
+
+class AccelerationsStream:
+    """ Stateful version of smooth_accelerations, with one SavgolStream per bracelet """
+
+    def __init__(self, window=35, poly=1, lag=0):
+        """
+
+        :param window: window of smoothing
+        :param poly: polynomial order of smoothing
+        :param lag: delay in samples of the output, 0 for causal filtering
+        """
+        self.window = window
+        self.poly = poly
+        self.lag = lag
+        self.streams = {}
+
+    def process(self, accelerations):
+        """ Smooth a new chunk of bracelet accelerations
+
+        :param accelerations: new samples in the format of preprocessing.get_accelerations
+        :return: smoothed accelerations in the same format, with the timestamps of the (delayed) outputs
+        """
+        smoothed = {}
+        for id_br in accelerations:
+            if id_br not in self.streams:
+                self.streams[id_br] = SavgolStream(window=self.window, poly=self.poly, lag=self.lag)
+            values = np.stack((accelerations[id_br]['ax'], accelerations[id_br]['ay'], accelerations[id_br]['az']),
+                              axis=-1)
+            t, values = self.streams[id_br].process(accelerations[id_br]['t'], values)
+            smoothed[id_br] = {'ax': values[:, 0], 'ay': values[:, 1], 'az': values[:, 2], 't': t}
+        return smoothed
@@ -0,0 +1,263 @@
+import os
+import math
+import importlib.util
+import numpy as np
+
+# Possible backends: "auto" uses the compiled kernels if numba is installed, "numba" and "numpy" force one of them
+BACKENDS = ("auto", "numba", "numpy")
+backend = "auto"
+# Compiled kernels, built at the first use (compilation takes a few seconds without the numba cache)
+compiled = None
+available = None
+
+
+def numba_available():
+    """ True if numba can be imported, checked without importing it (numba is slow to import) """
+    global available
+    if available is None:
+        available = importlib.util.find_spec("numba") is not None
+    return available
+
+
+def set_backend(name):
+    """ Select the implementation of the kernels of DTW, differentiation and rotation
+
+    :param name: "auto" (numba if installed, otherwise NumPy), "numba" or "numpy"
+    """
+    global backend
+    assert name in BACKENDS, "Invalid kernels backend, please choose auto, numba or numpy"
+    if name == "numba" and not numba_available():
+        raise ImportError("numba kernels require numba, install it with: pip install mpit[fast]")
+    backend = name
+
+
+def get_backend():
+    """ Backend actually used, "numba" or "numpy" """
+    if backend == "numpy" or (backend == "auto" and not numba_available()):
+        return "numpy"
+    return "numba"
+
+
+def get_kernels():
+    """ Compiled kernels of the selected backend
+
+    :return: dict {<name>: compiled function} with the functions below, None if the NumPy backend is selected
+    """
+    global compiled
+    if get_backend() == "numpy":
+        return None
+    if compiled is None:
+        import numba
+        # nogil lets the kernels run in parallel in threads
+        compiled = {name: numba.njit(cache=True, nogil=True)(function)
+                    for name, function in (('dtw', dtw), ('dtw_fused', dtw_fused),
+                                           ('finite_difference', finite_difference),
+                                           ('valid_difference', valid_difference),
+                                           ('rotation_axes', rotation_axes), ('project', project))}
+    return compiled
+
+
+def dtw(t_exp, v_exp, t_num, v_num, weights, lo, hi):
+    """ DTW distance with the recurrence of similaritymeasures.dtw, computed only on the columns [lo[i], hi[i]] of
+        each row i and keeping two rows in memory. The local cost of two points is their weighted euclidean distance
+        sqrt(dt^2 + sum_k weights[k] * dv_k^2), with one feature of weight 1 it is the distance of
+        similaritymeasures.dtw
+
+    :param t_exp: np.array of n float64 times of the first series
+    :param v_exp: np.array((n, features)) of float64 values of the first series
+    :param t_num: np.array of m float64 times of the second series
+    :param v_num: np.array((m, features)) of float64 values of the second series
+    :param weights: np.array of float64 weights of the features
+    :param lo: np.array of n int64 first columns of the rows, lo[0] = 0 and lo[i] <= hi[i - 1] + 1
+    :param hi: non-decreasing np.array of n int64 last columns of the rows, hi[n - 1] = m - 1
+    :return: DTW distance
+    """
+    n = len(t_exp)
+    m = len(t_num)
+    previous = np.full(m, np.inf)
+    current = np.full(m, np.inf)
+    accumulated = 0.0
+    for j in range(hi[0] + 1):
+        squared = (t_num[j] - t_exp[0]) ** 2
+        for k in range(len(weights)):
+            squared += weights[k] * (v_num[j, k] - v_exp[0, k]) ** 2
+        accumulated += math.sqrt(squared)
+        previous[j] = accumulated
+    for i in range(1, n):
+        # current still contains row i - 2
+        if i >= 2:
+            for j in range(lo[i - 2], hi[i - 2] + 1):
+                current[j] = np.inf
+        left = np.inf
+        for j in range(lo[i], hi[i] + 1):
+            best = previous[j]
+            if j > 0:
+                best = min(best, previous[j - 1], left)
+            squared = (t_num[j] - t_exp[i]) ** 2
+            for k in range(len(weights)):
+                squared += weights[k] * (v_num[j, k] - v_exp[i, k]) ** 2
+            left = best + math.sqrt(squared)
+            current[j] = left
+        previous, current = current, previous
+    return previous[m - 1]
+
+
+def dtw_fused(t_exp, v_exp, d_exp, t_num, v_num, d_num, lo, hi, lo_d, hi_d):
+    """ DTW distances of the values and of their derivatives in one pass. The derivatives are on the same times of the
+        values without the last one (d_exp[i] is at t_exp[i]), so the cost matrix of the derivatives is the one of the
+        values without the last row and column and both recurrences share the rows and the time differences.
+        Same results of dtw on the two series.
+
+    :param t_exp: np.array of n float64 times of the first series
+    :param v_exp: np.array of n float64 values of the first series
+    :param d_exp: np.array of n - 1 float64 derivatives of the first series
+    :param t_num: np.array of m float64 times of the second series
+    :param v_num: np.array of m float64 values of the second series
+    :param d_num: np.array of m - 1 float64 derivatives of the second series
+    :param lo: first columns of the rows of the values, see dtw
+    :param hi: last columns of the rows of the values, see dtw
+    :param lo_d: first columns of the n - 1 rows of the derivatives
+    :param hi_d: last columns of the n - 1 rows of the derivatives
+    :return: (values distance, derivatives distance)
+    """
+    n = len(t_exp)
+    m = len(t_num)
+    previous = np.full(m, np.inf)
+    current = np.full(m, np.inf)
+    previous_d = np.full(m - 1, np.inf)
+    current_d = np.full(m - 1, np.inf)
+    accumulated = 0.0
+    accumulated_d = 0.0
+    for j in range(max(hi[0], hi_d[0]) + 1):
+        dt2 = (t_num[j] - t_exp[0]) ** 2
+        if j <= hi[0]:
+            accumulated += math.sqrt(dt2 + (v_num[j] - v_exp[0]) ** 2)
+            previous[j] = accumulated
+        if j <= hi_d[0]:
+            accumulated_d += math.sqrt(dt2 + (d_num[j] - d_exp[0]) ** 2)
+            previous_d[j] = accumulated_d
+    for i in range(1, n):
+        derivative = i < n - 1
+        # current and current_d still contain row i - 2
+        if i >= 2:
+            for j in range(lo[i - 2], hi[i - 2] + 1):
+                current[j] = np.inf
+            if derivative:
+                for j in range(lo_d[i - 2], hi_d[i - 2] + 1):
+                    current_d[j] = np.inf
+        first = lo[i]
+        last = hi[i]
+        if derivative:
+            first = min(first, lo_d[i])
+            last = max(last, hi_d[i])
+        left = np.inf
+        left_d = np.inf
+        for j in range(first, last + 1):
+            dt2 = (t_num[j] - t_exp[i]) ** 2
+            if lo[i] <= j <= hi[i]:
+                best = previous[j]
+                if j > 0:
+                    best = min(best, previous[j - 1], left)
+                left = best + math.sqrt(dt2 + (v_num[j] - v_exp[i]) ** 2)
+                current[j] = left
+            if derivative and lo_d[i] <= j <= hi_d[i]:
+                best = previous_d[j]
+                if j > 0:
+                    best = min(best, previous_d[j - 1], left_d)
+                left_d = best + math.sqrt(dt2 + (d_num[j] - d_exp[i]) ** 2)
+                current_d[j] = left_d
+        previous, current = current, previous
+        if derivative:
+            previous_d, current_d = current_d, previous_d
+    return previous[m - 1], previous_d[m - 2]
+
+
+def finite_difference(t, values):
+    """ Finite differences values[i + 1] - values[i] over t[i + 1] - t[i], NaN if one of the values is NaN
+
+    :param t: np.array of n float64 timestamps
+    :param values: np.array of n values
+    :return: np.array of n - 1 differences in the dtype of values
+    """
+    out = np.empty(max(len(values) - 1, 0), dtype=values.dtype)
+    for i in range(len(out)):
+        out[i] = (values[i + 1] - values[i]) / (t[i + 1] - t[i])
+    return out
+
+
+def valid_difference(t, values):
+    """ Finite differences between consecutive non-NaN values, stored at the index of the first one
+
+    :param t: np.array of n float64 timestamps
+    :param values: np.array of n values
+    :return: np.array of n - 1 differences in the dtype of values, NaN at the other indices
+    """
+    out = np.full(max(len(values) - 1, 0), np.nan, dtype=values.dtype)
+    last = -1
+    for i in range(len(values)):
+        if not np.isnan(values[i]):
+            if last >= 0:
+                out[last] = (values[i] - values[last]) / (t[i] - t[last])
+            last = i
+    return out
+
+
+def rotation_axes(directions):
+    """ Images u, v, w of the camera axes by the rotation bringing the x-axis on each direction (quaternion of the
+        rotation around x-axis ^ direction)
+
+    :param directions: np.array((n, 3)) of directions
+    :return: u, v, w: np.array((n, 3)) in the dtype of directions
+    """
+    n = directions.shape[0]
+    u = np.empty((n, 3), dtype=directions.dtype)
+    v = np.empty((n, 3), dtype=directions.dtype)
+    w = np.empty((n, 3), dtype=directions.dtype)
+    eps = np.finfo(directions.dtype).eps
+    for k in range(n):
+        magnitude = np.sqrt(directions[k, 0] ** 2 + directions[k, 1] ** 2 + directions[k, 2] ** 2)
+        nx = directions[k, 0] / magnitude
+        ny = directions[k, 1] / magnitude
+        nz = directions[k, 2] / magnitude
+        angle = np.arccos(nx)
+        # x-axis ^ direction = (0, -nz, ny)
+        b_magnitude = np.sqrt(nz * nz + ny * ny) + eps
+        half_sin = np.sin(angle / 2)
+        q0 = np.cos(angle / 2)
+        # The rotation axis has no x component, NaN directions still give NaN axes through q0, q2 and q3
+        q1 = 0.0
+        q2 = half_sin * (-nz / b_magnitude)
+        q3 = half_sin * (ny / b_magnitude)
+        u[k, 0] = q0 * q0 + q1 * q1 - q2 * q2 - q3 * q3
+        u[k, 1] = 2 * (q2 * q1 + q0 * q3)
+        u[k, 2] = 2 * (q3 * q1 - q0 * q2)
+        v[k, 0] = 2 * (q1 * q2 - q0 * q3)
+        v[k, 1] = q0 * q0 - q1 * q1 + q2 * q2 - q3 * q3
+        v[k, 2] = 2 * (q3 * q2 + q0 * q1)
+        w[k, 0] = 2 * (q1 * q3 + q0 * q2)
+        w[k, 1] = 2 * (q2 * q3 - q0 * q1)
+        w[k, 2] = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+    return u, v, w
+
+
+def project(accelerations, u, v, w):
+    """ Components of the accelerations on the axes u, v, w of each frame
+
+    :param accelerations: np.array((n, 3))
+    :param u: np.array((n, 3))
+    :param v: np.array((n, 3))
+    :param w: np.array((n, 3))
+    :return: au, av, aw: np.array(n) in the dtype of accelerations
+    """
+    n = accelerations.shape[0]
+    au = np.empty(n, dtype=accelerations.dtype)
+    av = np.empty(n, dtype=accelerations.dtype)
+    aw = np.empty(n, dtype=accelerations.dtype)
+    for k in range(n):
+        au[k] = accelerations[k, 0] * u[k, 0] + accelerations[k, 1] * u[k, 1] + accelerations[k, 2] * u[k, 2]
+        av[k] = accelerations[k, 0] * v[k, 0] + accelerations[k, 1] * v[k, 1] + accelerations[k, 2] * v[k, 2]
+        aw[k] = accelerations[k, 0] * w[k, 0] + accelerations[k, 1] * w[k, 1] + accelerations[k, 2] * w[k, 2]
+    return au, av, aw
+
+
+set_backend(os.environ.get("MPIT_KERNELS", "auto"))
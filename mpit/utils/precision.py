@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def get_dtype(dtype):
+    """ Validate the floating point precision used for the pipeline arrays
+
+    :param dtype: "float32", "float64" or the corresponding numpy type
+    :return: numpy dtype
+    """
+    dtype = np.dtype(dtype)
+    assert dtype in (np.float32, np.float64), "Invalid dtype, please choose float32 or float64"
+    return dtype
+
+
+def as_float_array(x):
+    """ Convert to a floating point numpy array, keeping float32 precision if the input already has it
+
+    :param x: array-like
+    :return: np.array of dtype float32 or float64
+    """
+    x = np.asarray(x)
+    return x if x.dtype == np.float32 else x.astype(np.float64, copy=False)
+
+
+def array_nbytes(structure):
+    """ Memory used by the numpy arrays of a pipeline structure (nested dicts, lists and tuples of arrays)
+
+    :param structure: structure returned by one of the pipeline stages
+    :return: number of bytes
+    """
+    if isinstance(structure, np.ndarray):
+        return structure.nbytes
+    if isinstance(structure, dict):
+        return sum(array_nbytes(value) for value in structure.values())
+    if isinstance(structure, (list, tuple)):
+        return sum(array_nbytes(value) for value in structure)
+    return 0
+
+
+def memory_report(memory):
+    """ Format the memory used by the pipeline stages
+
+    :param memory: dict {<stage>: <bytes>} as filled by algorithms.identify_and_track
+    :return: report string with one line per stage
+    """
+    lines = ["%-24s %10.1f KiB" % (stage, nbytes / 1024) for stage, nbytes in memory.items()]
+    lines.append("%-24s %10.1f KiB" % ("total", sum(memory.values()) / 1024))
+    return "\n".join(lines)
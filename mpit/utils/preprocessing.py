@@ -1,7 +1,49 @@
 import numpy as np
 
+from mpit.utils.tracks import crop
 
-def get_positions_one_point(frames, point, tot_points, verbose=1):
+
+def scan_skeletons(frames):
+    """ Lightweight scan of the skeleton ids of a sequence, without reading the joints
+
+    :param frames: list of skeletons frames, see get_positions_one_point
+    :return: {'t': np.array(timestamps),
+              'skeletons': {<id_sk1>: {'first': <index of the first frame>,
+                                       'last': <index of the last frame>,
+                                       'frames': <number of frames>},
+                            <id_sk2>: {...}, ...
+                            }
+              } with the ids in order of first appearance
+    """
+    t = np.empty(len(frames), dtype=np.float64)
+    skeletons = {}
+    for id_fr, frame in enumerate(frames):
+        t[id_fr] = frame['timestamp']
+        for id_sk in frame['skeletons']:
+            if id_sk in skeletons:
+                skeletons[id_sk]['last'] = id_fr
+                skeletons[id_sk]['frames'] += 1
+            else:
+                skeletons[id_sk] = {'first': id_fr, 'last': id_fr, 'frames': 1}
+    return {'t': t, 'skeletons': skeletons}
+
+
+def select_skeletons(scan, min_duration=0, min_frames=1):
+    """ Ids of a scan that can pass the duration filter of skeleton.filter_skeletons. The time between the first and
+        last frame of an id bounds the duration of its valid points, so the ids discarded here would be discarded later.
+
+    :param scan: scan as returned by scan_skeletons
+    :param min_duration: minimum duration in seconds for a skeleton to be valid
+    :param min_frames: minimum number of frames for a skeleton to be valid
+    :return: list of ids in order of first appearance
+    """
+    t = scan['t']
+    return [id_sk for id_sk, seen in scan['skeletons'].items()
+            if t[seen['last']] - t[seen['first']] >= min_duration and seen['frames'] >= min_frames]
+
+
+def get_positions_one_point(frames, point, tot_points, verbose=1, dtype=np.float64, ids=None, min_confidence=None,
+                            scan=None, sparse=False):
     """ Extract from full skeletons sequences of the point of interest
 
     :param frames: list of skeletons frames as
@@ -16,75 +58,65 @@ def get_positions_one_point(frames, point, tot_points, verbose=1):
     :param point: number of the point to get (int)
     :param tot_points: number of points per skeleton depending on the camera
     :param verbose: if >1 print logs
+    :param dtype: floating point precision of the positions, the timestamps are always float64
+    :param ids: ids to extract (e.g. from select_skeletons), all the ids if None
+    :param min_confidence: if not None, points with confidence lower than min_confidence are set to NaN
+    :param scan: scan of frames as returned by scan_skeletons, computed if None
+    :param sparse: if True each skeleton is stored only from its first to its last frame, the index of its first frame
+                   in 't' is given in 'starts' (see utils.tracks), otherwise the arrays are as long as 't'
     :return: positions of one point in numpy format structured as following dict
              {'t': np.array(values),
               'skeletons' : {<id_sk1>: {'px': np.array(values),
                                         'py': np.array(values),
                                         'pz': np.array(values)},
                              <id_sk2>: {...}, ...
-                             }
+                             },
+              'starts': {<id_sk1>: <index of the first value in t>, ...}  (only if sparse)
               }
 
     """
-
-    t = []  # Timestamps
-    skeletons_point = {}  # Dict for skeletons point
-    # For each frame in the sequence
-    for id_fr, frame in enumerate(frames):
-        t.append(frame['timestamp'])  # Add timestamp to list
-        skeletons = frame["skeletons"]
-        # For each skeleton in the frame create a vector with the positions of the wrist in x, y and z
+    if scan is None:
+        scan = scan_skeletons(frames)
+    t = scan['t']
+    if ids is None:
+        ids = list(scan['skeletons'])
+    # One block per skeleton from its first to its last frame, frames where the skeleton is missing stay NaN
+    starts = {id_sk: scan['skeletons'][id_sk]['first'] for id_sk in ids}
+    blocks = {id_sk: np.full((3, scan['skeletons'][id_sk]['last'] - starts[id_sk] + 1), np.nan) for id_sk in ids}
+    # Only the frames where at least one of the ids appears are read
+    first = min(starts.values(), default=0)
+    last = max((scan['skeletons'][id_sk]['last'] for id_sk in ids), default=-1)
+    for id_fr in range(first, last + 1):
+        skeletons = frames[id_fr]["skeletons"]
         for id_sk in skeletons:
+            block = blocks.get(id_sk)
+            if block is None:
+                continue
             # Check if data are corrupted, if so the order of points cannot be inferred
-            if len(skeletons[id_sk]['joints3D']) == tot_points:
-                insert_point = skeletons[id_sk]['joints3D'][point]  # Point to add to the sequence
-            else:
-                insert_point = [np.nan, np.nan, np.nan]
-            # If id_sk has already data related
-            if id_sk in skeletons_point.keys():
-                skeletons_point[id_sk]['px'] = np.append(skeletons_point[id_sk]['px'],
-                                                         insert_point[0])
-                skeletons_point[id_sk]['py'] = np.append(skeletons_point[id_sk]['py'],
-                                                         insert_point[1])
-                skeletons_point[id_sk]['pz'] = np.append(skeletons_point[id_sk]['pz'],
-                                                         insert_point[2])
-            # Otherwise, add new id_sk to skeletons_point
-            else:
-                skeletons_point[id_sk] = {}
-                # If first frame
-                if id_fr == 0:
-                    skeletons_point[id_sk]['px'] = np.array(insert_point[0], dtype=np.float)
-                    skeletons_point[id_sk]['py'] = np.array(insert_point[1], dtype=np.float)
-                    skeletons_point[id_sk]['pz'] = np.array(insert_point[2], dtype=np.float)
-                else:
-                    # Generate a vector of null values till id_fr-1
-                    skeletons_point[id_sk]['px'] = np.append([np.nan] * (id_fr - 1), insert_point[0])
-                    skeletons_point[id_sk]['py'] = np.append([np.nan] * (id_fr - 1), insert_point[1])
-                    skeletons_point[id_sk]['pz'] = np.append([np.nan] * (id_fr - 1), insert_point[2])
-    t = np.array(t)
-    # Check if some array is not full, only for x because the others coordinates are the same
-    # Fill with np.nan values the missing skeletons
-    for id_sk in skeletons_point:
-        size = skeletons_point[id_sk]['px'].size
-        if t.size != size:
-            skeletons_point[id_sk]['px'] = np.append(skeletons_point[id_sk]['px'],
-                                                     [np.nan] * (t.size - size))
-            skeletons_point[id_sk]['py'] = np.append(skeletons_point[id_sk]['py'],
-                                                     [np.nan] * (t.size - size))
-            skeletons_point[id_sk]['pz'] = np.append(skeletons_point[id_sk]['pz'],
-                                                     [np.nan] * (t.size - size))
+            if len(skeletons[id_sk]['joints3D']) != tot_points:
+                continue
+            if min_confidence is not None and len(skeletons[id_sk].get('confidences', ())) == tot_points and \
+                    skeletons[id_sk]['confidences'][point] < min_confidence:
+                continue
+            block[:, id_fr - starts[id_sk]] = skeletons[id_sk]['joints3D'][point]
+    skeletons_point = {}
+    for id_sk, block in blocks.items():
         # Replace all -1 values (invalid points) with np.nan, this must be conditioned on z!
-        skeletons_point[id_sk]['px'][skeletons_point[id_sk]['pz'] == -1] = np.nan
-        skeletons_point[id_sk]['py'][skeletons_point[id_sk]['pz'] == -1] = np.nan
-        skeletons_point[id_sk]['pz'][skeletons_point[id_sk]['pz'] == -1] = np.nan
+        block[:, block[2] == -1] = np.nan
+        if not sparse:
+            block = np.ascontiguousarray(crop(block.T, starts[id_sk], 0, t.size).T)
+        block = block.astype(dtype, copy=False)
+        skeletons_point[id_sk] = {'px': block[0], 'py': block[1], 'pz': block[2]}
     if verbose >= 1:
         print('Skeletons extracted correctly, ' + str(skeletons_point.keys().__len__()) +
-              ' skeleton(s) identifiers found in the sequence')
+              ' skeleton(s) identifiers extracted out of ' + str(len(scan['skeletons'])) + ' in the sequence')
         print('------------------------------------------------------------')
+    if sparse:
+        return {'t': t, 'skeletons': skeletons_point, 'starts': starts}
     return {'t': t, 'skeletons': skeletons_point}
 
 
-def get_accelerations(accelerations, verbose=1):
+def get_accelerations(accelerations, verbose=1, dtype=np.float64):
     """ Change format of accelerations for faster computation
 
     :param accelerations: list of acceleration measurements as
@@ -95,6 +127,7 @@ def get_accelerations(accelerations, verbose=1):
                                   'id': <value>}, ...
                                 ]
     :param verbose: if >1 print logs
+    :param dtype: floating point precision of the accelerations, the timestamps are always float64
     :return: dictionary as
             {<id_br1>: {'ax': np.array(values),
                         'ay': np.array(values),
@@ -120,8 +153,26 @@ def get_accelerations(accelerations, verbose=1):
             accel_dict[sample['id']]['ay'] = np.array(sample['y'])
             accel_dict[sample['id']]['az'] = np.array(sample['z'])
             accel_dict[sample['id']]['t'] = np.array(sample['timestamp'])
+    for id_br in accel_dict:
+        for coord in ('ax', 'ay', 'az'):
+            accel_dict[id_br][coord] = accel_dict[id_br][coord].astype(dtype, copy=False)
+        accel_dict[id_br]['t'] = accel_dict[id_br]['t'].astype(np.float64, copy=False)
     if verbose >= 1:
         print('Accelerations extracted correctly, ' + str(accel_dict.keys().__len__()) +
               ' bracelet(s) identifiers found in the sequence')
         print('------------------------------------------------------------')
     return accel_dict
+
+
+def get_window(items_list, timestamps, start_ts, end_ts):
+    """ Extract the items with start_ts <= timestamp < end_ts from a time-ordered list
+
+    :param items_list: list of skeleton frames or acceleration measurements ordered by 'timestamp'
+    :param timestamps: np.array of the timestamps of items_list (computed once for all the windows)
+    :param start_ts: start of the window (included)
+    :param end_ts: end of the window (excluded)
+    :return: list of the items in the window
+    """
+    first = np.searchsorted(timestamps, start_ts, side='left')
+    last = np.searchsorted(timestamps, end_ts, side='left')
+    return items_list[first:last]
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+def track_start(frames, id_sk):
+    """ Index in frames['t'] of the first value of a skeleton track
+
+    Structures of the pipeline ({'t': ..., 'skeletons': {<id_sk>: ...}}) can store each skeleton as a block covering
+    only the frames from its first to its last observation, with the index of the first frame of each block in
+    frames['starts'] = {<id_sk>: <index>}. Skeletons missing from 'starts' are dense (start 0).
+
+    :param frames: positions, directions or accelerations structure
+    :param id_sk: skeleton identifier
+    :return: start index
+    """
+    return frames.get('starts', {}).get(id_sk, 0)
+
+
+def track_t(frames, id_sk, length):
+    """ Timestamps of the values of a skeleton track
+
+    :param frames: positions, directions or accelerations structure
+    :param id_sk: skeleton identifier
+    :param length: number of values of the track
+    :return: np.array of timestamps (view of frames['t'])
+    """
+    start = track_start(frames, id_sk)
+    return frames['t'][start:start + length]
+
+
+def crop(values, start, new_start, length):
+    """ Values of a block on another range of frames, NaN where the block has no values
+
+    :param values: np.array with the frames on the first axis
+    :param start: frame index of the first value
+    :param new_start: frame index of the first value of the output
+    :param length: number of values of the output
+    :return: np.array of length values (a view if the range is inside the block)
+    """
+    if new_start >= start and new_start + length <= start + len(values):
+        return values[new_start - start:new_start - start + length]
+    out = np.full((length,) + values.shape[1:], np.nan, dtype=values.dtype)
+    lo = max(start, new_start)
+    hi = min(start + len(values), new_start + length)
+    if hi > lo:
+        out[lo - new_start:hi - new_start] = values[lo - start:hi - start]
+    return out
+
+
+def remove_track(frames, id_sk):
+    """ Remove a skeleton from a structure together with its start """
+    del frames['skeletons'][id_sk]
+    frames.get('starts', {}).pop(id_sk, None)
+
+
+def densify(frames):
+    """ Convert a structure with blocks into the dense format (every track as long as frames['t'])
+
+    :param frames: positions or accelerations structure
+    :return: new structure without 'starts'
+    """
+    length = len(frames['t'])
+    skeletons = {}
+    for id_sk, skeleton in frames['skeletons'].items():
+        start = track_start(frames, id_sk)
+        if isinstance(skeleton, dict):
+            skeletons[id_sk] = {key: crop(values, start, 0, length) for key, values in skeleton.items()}
+        else:
+            skeletons[id_sk] = crop(skeleton, start, 0, length)
+    return {'t': frames['t'], 'skeletons': skeletons}
+
+
+def map_tracks(function, ids, executor=None):
+    """ Apply a function to each skeleton, in parallel if an executor is given. The function must only modify the data
+        of its skeleton, changes shared by the skeletons are applied by the caller in the order of the results, so
+        that the output does not depend on the scheduling
+
+    :param function: function of one skeleton identifier
+    :param ids: list of skeleton identifiers
+    :param executor: optional concurrent.futures executor (threads, the kernels release the GIL)
+    :return: list of the results in the order of ids
+    """
+    if executor is None:
+        return [function(id_sk) for id_sk in ids]
+    return list(executor.map(function, ids))
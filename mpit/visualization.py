@@ -0,0 +1,77 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import mpit.utils.preprocessing as preproc
+import mpit.skeleton as skeleton
+
+from mpit.algorithms import get_joint_layout
+
+
+def plot_associations(skeletons_frames, associations_list, camera="Intel", skeleton_min_duration=5,
+                      skeleton_smooth_filter="savgol", skeleton_smooth_window=7, skeleton_smooth_poly=1, windows=None,
+                      verbose=0):
+    """ Plot the skeletons wrist x locations over time with the associated bracelets of each chunk
+
+    :param skeletons_frames: skeletons data in the format of our dataset, not used if windows is given
+    :param associations_list: list of the associations of each chunk as returned by identify_and_track_windows
+    :param camera: camera name or joint layout, see algorithms.get_joint_layout
+    :param skeleton_min_duration: minimum duration in seconds for a skeleton to be plotted
+    :param skeleton_smooth_filter: smoothing filter for skeletons
+    :param skeleton_smooth_window: smoothing window for skeletons
+    :param skeleton_smooth_poly: smoothing poly for skeletons
+    :param windows: optional list of the plot data of each chunk (see diagnostics.plot_data), if given the wrist
+                    positions computed by the PIT are plotted instead of processing skeletons_frames again
+    :param verbose: if >=1 print logs
+    """
+    plt.figure(figsize=(8, 4))
+    if windows is not None:
+        plot_windows_positions(windows)
+    else:
+        plot_positions(skeletons_frames, camera=camera, skeleton_min_duration=skeleton_min_duration,
+                       skeleton_smooth_filter=skeleton_smooth_filter, skeleton_smooth_window=skeleton_smooth_window,
+                       skeleton_smooth_poly=skeleton_smooth_poly, verbose=verbose)
+    y_min, y_max = plt.gca().get_ylim()
+    for associations in associations_list:
+        if len(associations) > 0:
+            plt.axvline(x=associations[0]['ts_end'], color="r")
+            i = 0
+            for association in associations:
+                plt.text(association['ts_start'], (0.8-i)*y_max,
+                         str(association['skeleton_id']) + "->" + str(association['bracelet_id']), fontsize=8)
+                i += 0.1
+    plt.title("Skeletons x locations over time with associated bracelets")
+    plt.legend(loc='lower left')
+
+
+def plot_positions(skeletons_frames, camera="Intel", skeleton_min_duration=5, skeleton_smooth_filter="savgol",
+                   skeleton_smooth_window=7, skeleton_smooth_poly=1, verbose=0):
+    """ Process the skeletons of a whole recording and plot their wrist x locations, see plot_associations """
+    layout = get_joint_layout(camera)
+    wrist_points = preproc.get_positions_one_point(skeletons_frames, layout['wrist'], layout['tot_points'],
+                                                   verbose=verbose)
+    elbow_points = preproc.get_positions_one_point(skeletons_frames, layout['elbow'], layout['tot_points'],
+                                                   verbose=verbose)
+    wrist_points = skeleton.filter_skeletons(wrist_points, min_duration=skeleton_min_duration, verbose=verbose)
+    elbow_points = skeleton.filter_skeletons(elbow_points, min_duration=skeleton_min_duration, verbose=verbose)
+    wrist_points, elbow_points = skeleton.post_process_xy(wrist_points, elbow_points,
+                                                          smooth_filter=skeleton_smooth_filter,
+                                                          window=skeleton_smooth_window,
+                                                          poly=skeleton_smooth_poly,
+                                                          verbose=verbose)
+    t = np.copy(wrist_points['t'])
+    skeletons = wrist_points['skeletons']
+    for id in skeletons:
+        plt.plot(t, skeletons[str(id)]['px'], label=id)
+
+
+def plot_windows_positions(windows):
+    """ Plot the wrist x locations computed by the PIT in each chunk, with one color per skeleton
+
+    :param windows: list of the plot data of each chunk, see diagnostics.plot_data
+    """
+    colors = {}
+    for data in windows:
+        positions = data['wrist']
+        for id in positions['skeletons']:
+            line, = plt.plot(positions['t'], positions['skeletons'][id]['px'], color=colors.get(id),
+                             label=None if id in colors else id)
+            colors.setdefault(id, line.get_color())
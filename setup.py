@@ -10,8 +10,11 @@ setup(
     author='Matteo Bastico',
     license='MIT',
     install_requires=['scipy>=1.7.2',
-                      'numpy>=1.21.4',
-                      'similaritymeasures>=0.4.4',
-                      'matplotlib>=3.5.2',
-                      'pandas>=1.4.2']
+                      'numpy>=1.21.4'],
+    extras_require={'plot': ['matplotlib>=3.5.2'],
+                    'fast': ['numba>=0.56'],
+                    'test': ['pytest>=7',
+                             'similaritymeasures>=0.4.4']},
+    entry_points={'console_scripts': ['mpit=mpit.cli:main',
+                                        'mpit-service=mpit.service:main']}
 )
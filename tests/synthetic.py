@@ -0,0 +1,50 @@
+import numpy as np
+
+T0 = 1600000000.0
+
+
+def recording(duration=30, people=3, fps=30, hz=50, offsets=None, drift=0.0, seed=1, tot_points=18):
+    """ Synthetic recording in the format of our dataset (Intel joint layout), in which the wrist of skeleton
+        str(100 + p) moves along x as a sum of sinusoids and bracelet "br<p>" measures its acceleration
+
+    :param duration: duration in seconds
+    :param people: number of people
+    :param fps: frame rate of the camera
+    :param hz: sampling rate of the bracelets
+    :param offsets: clock offset in seconds of each bracelet, default 0
+    :param drift: clock drift of the bracelets, in seconds per second
+    :param seed: seed of the random motions and noise
+    :param tot_points: number of joints of the skeletons
+    :return: skeletons frames, acceleration measurements
+    """
+    rng = np.random.default_rng(seed)
+    offsets = [0.0] * people if offsets is None else offsets
+    motions = [(2 * np.pi * rng.uniform(0.3, 2.0, 6), rng.uniform(0, 2 * np.pi, 6), rng.uniform(0.03, 0.12, 6))
+               for _ in range(people)]
+    t_frames = np.arange(int(duration * fps)) / fps
+    positions = [np.sum(a * np.sin(np.outer(t_frames, w) + phase), axis=1) for w, phase, a in motions]
+    frames = []
+    for k, t in enumerate(t_frames):
+        skeletons = {}
+        for p in range(people):
+            elbow = np.array([p * 1.0, 0.0, 2.0 + p * 0.3])
+            joints = [[0.0] * 3 for _ in range(tot_points)]
+            joints[6] = list(elbow + rng.normal(0, 0.002, 3))
+            joints[7] = list(elbow + np.array([0.3 + positions[p][k], 0.0, 0.01]) + rng.normal(0, 0.002, 3))
+            skeletons[str(100 + p)] = {'confidences': [0.9] * tot_points, 'joints': [], 'joints3D': joints}
+        frames.append({'timestamp': T0 + t, 'skeletons': skeletons})
+    t_samples = np.arange(int(duration * hz)) / hz
+    accelerations = []
+    for p, (w, phase, a) in enumerate(motions):
+        ax = np.sum(-a * w * w * np.sin(np.outer(t_samples, w) + phase), axis=1)
+        for k, t in enumerate(t_samples):
+            accelerations.append({'x': ax[k] + rng.normal(0, 0.05), 'y': rng.normal(0, 0.05) - 9.81,
+                                  'z': rng.normal(0, 0.05), 'timestamp': T0 + t + offsets[p] + drift * t,
+                                  'id': "br%d" % p})
+    accelerations.sort(key=lambda sample: sample['timestamp'])
+    return frames, accelerations
+
+
+def pairs(associations):
+    """ Set of (skeleton_id, bracelet_id) of the associations of one window """
+    return {(association['skeleton_id'], association['bracelet_id']) for association in associations}
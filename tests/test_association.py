@@ -0,0 +1,44 @@
+import numpy as np
+
+import mpit.core as core
+from mpit.comparison import similarity_matrix
+
+NAN = np.nan
+# Raw and derivative similarities: s2 was not compared with b1 (not overlapping), b3 has NaN similarities with s1
+# (e.g. error in its timestamps) and the derivative of s3 with b2 is missing
+NORMAL = {'s1': {'b1': 1.0, 'b2': 4.0, 'b3': NAN}, 's2': {'b2': 1.0, 'b3': 2.0}, 's3': {'b1': 3.0, 'b2': 2.5, 'b3': 1.0}}
+DER = {'s1': {'b1': 3.0, 'b2': 2.0, 'b3': NAN}, 's2': {'b2': 3.0, 'b3': 2.0}, 's3': {'b1': 1.0, 'b3': 1.0}}
+
+
+def test_similarity_matrix():
+    costs, present = similarity_matrix(NORMAL, ["s1", "s2", "s4"], ["b1", "b2", "b3"])
+    np.testing.assert_array_equal(costs, [[1.0, 4.0, NAN], [NAN, 1.0, 2.0], [NAN, NAN, NAN]])
+    np.testing.assert_array_equal(present, [[True, True, True], [False, True, True], [False, False, False]])
+    # Bracelets that are not columns are ignored
+    costs, present = similarity_matrix(DER, ["s3"], ["b3", "b1"])
+    np.testing.assert_array_equal(costs, [[1.0, 1.0]])
+    assert present.all()
+
+
+def test_association(monkeypatch):
+    monkeypatch.setattr(core, "compare_accel_fused", lambda *args, **kwargs: (NORMAL, DER))
+    bracelets = {"b1": {}, "b2": {}, "b3": {}}
+    costs, present, rows, columns = core.association_costs({}, bracelets, 0.5)
+    assert rows == ["s1", "s2", "s3"] and columns == ["b1", "b2", "b3"]
+    # Rows with a missing derivative use only the raw similarities
+    np.testing.assert_array_equal(costs, [[2.0, 3.0, NAN], [NAN, 2.0, 2.0], [3.0, 2.5, 1.0]])
+    np.testing.assert_array_equal(present, [[True, True, True], [False, True, True], [True, True, True]])
+    # b3 is discarded, s2 can not be associated to b1
+    assert core.solve_association(costs, present) == [(0, 0), (1, 1)]
+    # The associations span the valid accelerations of the skeletons, also for sparse tracks
+    rotated = {'t': np.arange(6.) + 100,
+               'skeletons': {'s1': {'au': np.array([NAN, 1, 1, 1, 1, NAN])}, 's2': {'au': np.array([1, 1, NAN])},
+                             's3': {'au': np.ones(6)}},
+               'starts': {'s1': 0, 's2': 2, 's3': 0}}
+    assert core.association_from_match(rotated, "s2", "b3") == \
+        {'ts_start': 102.0, 'ts_end': 103.0, 'skeleton_id': "s2", 'bracelet_id': "b3"}
+    intermediates = {}
+    associations = core.do_association(rotated, bracelets, 0.5, intermediates=intermediates, verbose=0)
+    assert associations == [{'ts_start': 101.0, 'ts_end': 104.0, 'skeleton_id': "s1", 'bracelet_id': "b1"},
+                            {'ts_start': 102.0, 'ts_end': 103.0, 'skeleton_id': "s2", 'bracelet_id': "b2"}]
+    np.testing.assert_array_equal(intermediates['costs']['costs'], costs)
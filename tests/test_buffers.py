@@ -0,0 +1,104 @@
+import numpy as np
+
+import mpit.utils.preprocessing as preproc
+from mpit.utils.buffers import RingBuffer, SkeletonHistory, BraceletHistory, last_seconds
+from tests.synthetic import recording
+
+
+def test_ring_buffer():
+    buffer = RingBuffer(5, shape=(2,))
+    assert len(buffer) == 0 and buffer.view().shape == (2, 0)
+    values = np.arange(26.).reshape(13, 2)
+    for k, value in enumerate(values):
+        buffer.append(value)
+        # Past the capacity the oldest values are evicted
+        assert len(buffer) == min(k + 1, 5)
+        np.testing.assert_array_equal(buffer.view(), values[max(0, k - 4):k + 1].T)
+        # The last n values are a contiguous view, also across the wrap point
+        for n in range(1, 7):
+            view = buffer.view(n)
+            assert view.base is buffer.data
+            np.testing.assert_array_equal(view, values[k + 1 - min(n, len(buffer)):k + 1].T)
+    buffer.clear()
+    assert len(buffer) == 0 and np.isnan(buffer.data).all()
+
+
+def test_last_seconds():
+    t = np.arange(10.)
+    assert last_seconds(t, None) == 10
+    assert last_seconds(t, 3) == 4
+    assert last_seconds(t, 2.5) == 3
+    assert last_seconds(t, 100) == 10
+    assert last_seconds(np.empty(0), 3) == 0
+
+
+def test_skeleton_history():
+    frames, _ = recording(duration=3, people=2)
+    # Skeleton 100 disappears after one second, 101 is missing in some frames
+    for k, frame in enumerate(frames):
+        if k >= 30:
+            del frame['skeletons']['100']
+        if k % 7 == 0:
+            del frame['skeletons']['101']
+    history = SkeletonHistory([6, 7], 18, capacity=40, max_idle=5.0)
+    history.extend(frames)
+    # Only the last capacity frames are kept, the one in the last second as the batch extraction of them
+    for duration, n in ((None, 40), (1.0, 31)):
+        wrist = history.get_positions_one_point(7, duration=duration)
+        expected = preproc.get_positions_one_point(frames[-n:], 7, 18, verbose=0)
+        np.testing.assert_array_equal(wrist['t'], expected['t'])
+        np.testing.assert_array_equal(wrist['skeletons']['101']['px'], expected['skeletons']['101']['px'])
+    assert np.isnan(wrist['skeletons']['100']['px']).all()
+    # Views are not copies
+    view = history.get_positions_one_point(6, copy=False)
+    assert view['skeletons']['101']['pz'].base is history.positions.data
+    # Skeleton 100 is evicted more than max_idle seconds after its last frame and its slot reused
+    history.append({'timestamp': frames[29]['timestamp'] + 5.5, 'skeletons': {'102': frames[-1]['skeletons']['101']}})
+    assert history.evicted == 1
+    assert history.slots == {'101': 1, '102': 0}
+
+
+def test_bracelet_history():
+    _, samples = recording(duration=3, people=2)
+    history = BraceletHistory(capacity=100, max_ids=2, max_idle=1.0)
+    history.extend(samples)
+    expected = preproc.get_accelerations(samples, verbose=0)
+    for duration, n in ((None, 100), (0.5, 26)):
+        accelerations = history.get_accelerations(duration=duration)
+        for id_br in ("br0", "br1"):
+            for key in ('t', 'ax', 'ay', 'az'):
+                np.testing.assert_array_equal(accelerations[id_br][key], expected[id_br][key][-n:])
+    # A new bracelet evicts the least recently seen one when max_ids are kept
+    last = samples[-1]
+    history.append(dict(last, id="br2", timestamp=last['timestamp'] + 0.01))
+    assert set(history.buffers) == {"br2", last['id']}
+    # Bracelets not seen for more than max_idle seconds are evicted
+    history.append(dict(last, id="br2", timestamp=last['timestamp'] + 1.005))
+    assert set(history.buffers) == {"br2"} and history.evicted == 2
+
+
+def test_skeleton_history_invalid_points():
+    frames, _ = recording(duration=3, people=4)
+    rng = np.random.default_rng(2)
+    for frame in frames:
+        for id_sk, sk in list(frame['skeletons'].items()):
+            # Ids missing, corrupted, with low confidence or with invalid points from one frame to the next
+            event = rng.integers(5)
+            if event == 0:
+                del frame['skeletons'][id_sk]
+            elif event == 1:
+                sk['joints3D'] = sk['joints3D'][:-1]
+            elif event == 2:
+                sk['confidences'] = [0.9] * 7 + [0.1] * 11
+            elif event == 3:
+                sk['joints3D'] = [list(joint) for joint in sk['joints3D']]
+                sk['joints3D'][7][2] = -1
+    history = SkeletonHistory([6, 7], 18, capacity=len(frames), min_confidence=0.5)
+    history.extend(frames)
+    for point in (6, 7):
+        positions = history.get_positions_one_point(point)
+        expected = preproc.get_positions_one_point(frames, point, 18, verbose=0, min_confidence=0.5)
+        assert sorted(positions['skeletons']) == sorted(expected['skeletons'])
+        for id_sk, values in expected['skeletons'].items():
+            for key in ('px', 'py', 'pz'):
+                np.testing.assert_array_equal(positions['skeletons'][id_sk][key], values[key])
@@ -0,0 +1,74 @@
+import json
+import pytest
+
+from mpit.algorithms import identify_and_track_windows
+from tests.synthetic import T0, recording
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(windows):
+    """ on_window callback killing the run after the given number of windows """
+    processed = []
+
+    def on_window(ts, associations, intermediates):
+        if len(processed) == windows:
+            raise Interrupted()
+        processed.append(ts)
+
+    return on_window
+
+
+def processed_windows():
+    """ on_window callback recording the start of the processed windows, and the list of them """
+    processed = []
+
+    def on_window(ts, associations, intermediates):
+        processed.append(ts)
+
+    return on_window, processed
+
+
+@pytest.mark.parametrize("clock_sync", [False, True])
+def test_resume(tmp_path, clock_sync):
+    skeleton_list, accel_list = recording(duration=40, offsets=[0.1, -0.2, 0.0], drift=1e-3)
+    params = dict(window=10, clock_sync=clock_sync, similarity_band=0.5 if clock_sync else None)
+    path = str(tmp_path / "checkpoint.json")
+    uninterrupted = identify_and_track_windows(skeleton_list, accel_list, **params)
+    assert len(uninterrupted) == 4
+    # Killed in the third window, with a checkpoint after every two windows
+    with pytest.raises(Interrupted):
+        identify_and_track_windows(skeleton_list, accel_list, checkpoint=path, checkpoint_interval=2,
+                                   on_window=interrupt_after(2), **params)
+    with open(path) as fs:
+        state = json.load(fs)
+    assert state['next_ts'] == T0 + 20 and state['associations_list'] == uninterrupted[:2]
+    assert (state['clock'] is not None) == clock_sync
+    # The resumed run processes the last two windows only and gives the same associations
+    on_window, processed = processed_windows()
+    resumed = identify_and_track_windows(skeleton_list, accel_list, checkpoint=path, checkpoint_interval=2,
+                                         on_window=on_window, **params)
+    assert processed == [T0 + 20, T0 + 30]
+    assert resumed == uninterrupted
+
+
+def test_changed_parameters(tmp_path):
+    skeleton_list, accel_list = recording(duration=30)
+    path = str(tmp_path / "checkpoint.json")
+    identify_and_track_windows(skeleton_list, accel_list, window=10, checkpoint=path)
+    # The checkpoint of the completed run is used as is
+    on_window, processed = processed_windows()
+    identify_and_track_windows(skeleton_list, accel_list, window=10, checkpoint=path, on_window=on_window)
+    assert processed == []
+    # With another parameter or other inputs it is ignored and the windows are computed again
+    on_window, processed = processed_windows()
+    associations_list = identify_and_track_windows(skeleton_list, accel_list, window=10, checkpoint=path,
+                                                   on_window=on_window, similarity_weight=0.5)
+    assert processed == [T0, T0 + 10, T0 + 20]
+    assert associations_list == identify_and_track_windows(skeleton_list, accel_list, window=10, similarity_weight=0.5)
+    on_window, processed = processed_windows()
+    identify_and_track_windows(skeleton_list[:-1], accel_list, window=10, checkpoint=path, on_window=on_window,
+                               similarity_weight=0.5)
+    assert processed == [T0, T0 + 10, T0 + 20]
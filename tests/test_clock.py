@@ -0,0 +1,58 @@
+import json
+import numpy as np
+
+import mpit.utils.preprocessing as preproc
+from mpit.clock import ClockEstimator
+from mpit.pipeline import Pipeline
+from tests.synthetic import T0, recording
+
+OFFSETS = [0.4, -0.3, 0.1]
+DRIFT = 2e-3
+
+
+def true_offset(p, t):
+    return OFFSETS[p] + DRIFT * (t - T0)
+
+
+def test_fit():
+    clock = ClockEstimator(min_drift_span=60.0)
+    assert clock.offset("br0", T0) == 0.0
+    for t in np.arange(T0, T0 + 50, 10):
+        clock.add("br0", t, true_offset(0, t))
+    # Before min_drift_span seconds of measurements only the mean offset is estimated
+    assert np.isclose(clock.offset("br0", T0 + 100), np.mean([true_offset(0, t) for t in np.arange(T0, T0 + 50, 10)]))
+    for t in np.arange(T0 + 50, T0 + 120, 10):
+        clock.add("br0", t, true_offset(0, t))
+    t = np.array([T0, T0 + 60, T0 + 500])
+    np.testing.assert_allclose(clock.offset("br0", t), true_offset(0, t), atol=1e-9)
+    np.testing.assert_array_equal(clock.offset("br1", t), 0.0)
+
+
+def test_convergence():
+    skeleton_list, accel_list = recording(duration=120, offsets=OFFSETS, drift=DRIFT)
+    clock = ClockEstimator()
+    pipeline = Pipeline(clock=clock, similarity_band=0.5)
+    skeletons_ts = np.array([frame['timestamp'] for frame in skeleton_list])
+    accelerations_ts = np.array([sample['timestamp'] for sample in accel_list])
+    for ts in range(int(T0), int(T0) + 120, 10):
+        pipeline.run(preproc.get_window(skeleton_list, skeletons_ts, ts, ts + 10),
+                     preproc.get_window(accel_list, accelerations_ts, ts, ts + 10))
+    # The estimates are within 10 ms of the true offsets, less than a third of a camera frame
+    t = np.array([T0 + 10, T0 + 60, T0 + 119])
+    for p in range(3):
+        np.testing.assert_allclose(clock.offset("br%d" % p, t), true_offset(p, t), atol=0.01)
+    # Corrected timestamps are in the camera clock, the values are not copied
+    accelerations = preproc.get_accelerations(accel_list, verbose=0)
+    accelerations["br3"] = dict(accelerations["br0"])
+    corrected = clock.correct(accelerations)
+    for p in range(3):
+        t_camera = corrected["br%d" % p]['t']
+        np.testing.assert_allclose(t_camera + true_offset(p, t_camera), accelerations["br%d" % p]['t'], atol=0.01)
+        assert corrected["br%d" % p]['ax'] is accelerations["br%d" % p]['ax']
+    # Bracelets without an estimate are not corrected
+    assert corrected["br3"]['t'] is accelerations["br3"]['t']
+    # The state survives a JSON round trip, as in the checkpoints
+    restored = ClockEstimator()
+    restored.load_state(json.loads(json.dumps(clock.state())))
+    for p in range(3):
+        np.testing.assert_array_equal(restored.offset("br%d" % p, t), clock.offset("br%d" % p, t))
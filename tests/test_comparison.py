@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from mpit.comparison import time_spans, overlapping_pairs
+
+
+def brute_force_pairs(skeleton_spans, bracelet_spans, min_overlap):
+    """ All-pairs overlap of the time spans """
+    pairs = {}
+    for id_sk, (sk_start, sk_end) in skeleton_spans.items():
+        pairs[id_sk] = {}
+        for id_br, (br_start, br_end) in bracelet_spans.items():
+            lo, hi = max(sk_start, br_start), min(sk_end, br_end)
+            if hi - lo >= min_overlap:
+                pairs[id_sk][id_br] = (lo, hi)
+    return pairs
+
+
+def random_spans(rng, prefix):
+    """ Spans on a grid of half seconds, so that many of them touch or overlap exactly min_overlap """
+    starts = rng.integers(0, 40, size=rng.integers(0, 8)) / 2
+    return {prefix + str(k): (start, start + rng.integers(0, 12) / 2) for k, start in enumerate(starts)}
+
+
+@pytest.mark.parametrize("min_overlap", [0, 0.5, 2, 3.5])
+def test_overlapping_pairs(min_overlap):
+    rng = np.random.default_rng(5)
+    for _ in range(200):
+        skeleton_spans, bracelet_spans = random_spans(rng, "s"), random_spans(rng, "b")
+        assert overlapping_pairs(skeleton_spans, bracelet_spans, min_overlap=min_overlap) == \
+            brute_force_pairs(skeleton_spans, bracelet_spans, min_overlap)
+    # Touching endpoints overlap only without min_overlap
+    assert overlapping_pairs({'s': (0., 5.)}, {'b': (5., 9.)}) == {'s': {'b': (5., 5.)}}
+    assert overlapping_pairs({'s': (0., 5.)}, {'b': (5., 9.)}, min_overlap=0.5) == {'s': {}}
+
+
+def test_time_spans():
+    t = np.arange(10.) + 100
+    skeletons = {'t': t, 'skeletons': {'a': {'au': np.array([np.nan, 1, 1, np.nan, 1, np.nan, np.nan])},
+                                       'b': {'au': np.full(3, np.nan)}},
+                 'starts': {'a': 2, 'b': 0}}
+    bracelets = {'b1': {'t': np.array([101., 99., 108.])}, 'b2': {'t': np.empty(0)}}
+    skeleton_spans, bracelet_spans = time_spans(skeletons, bracelets)
+    assert skeleton_spans == {'a': (103., 106.)}
+    assert bracelet_spans == {'b1': (99., 108.)}
+    assert overlapping_pairs(skeleton_spans, bracelet_spans, min_overlap=3) == {'a': {'b1': (103., 106.)}}
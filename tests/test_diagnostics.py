@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import mpit.utils.tracks as tracks
+from mpit.diagnostics import decimate, plot_data
+from mpit.pipeline import Pipeline
+from tests.synthetic import recording
+
+
+@pytest.fixture(scope="module")
+def intermediates():
+    frames, accels = recording(duration=10)
+    # Skeleton 102 appears after 2 s
+    for frame in frames[:60]:
+        del frame['skeletons']['102']
+    intermediates = {}
+    associations = Pipeline().run(frames, accels, intermediates=intermediates)
+    assert len(associations) == 3
+    return intermediates
+
+
+def test_intermediates(intermediates):
+    assert set(intermediates) == {'wrist', 'elbow', 'directions', 'rotated_accelerations', 'bracelets', 'costs'}
+    for stage in ('wrist', 'elbow', 'directions', 'rotated_accelerations'):
+        assert sorted(intermediates[stage]['skeletons']) == ["100", "101", "102"]
+        assert intermediates[stage]['starts']['102'] == 60
+    assert sorted(intermediates['bracelets']) == ["br0", "br1", "br2"]
+    costs = intermediates['costs']
+    assert costs['costs'].shape == costs['present'].shape == (len(costs['rows']), len(costs['columns'])) == (3, 3)
+
+
+@pytest.mark.parametrize("step", [1, 3, 7, 10, 1000])
+def test_decimate(intermediates, step):
+    for stage in ('wrist', 'directions', 'rotated_accelerations'):
+        frames = intermediates[stage]
+        length = len(frames['t'])
+        decimated = decimate(frames, step)
+        # The first and the last frame of the window are kept, with at most one frame every step in between
+        t = decimated['t']
+        assert t[0] == frames['t'][0] and t[-1] == frames['t'][-1]
+        assert len(t) <= length // step + 2
+        assert len(t) == len(np.unique(t))
+        indices = np.searchsorted(frames['t'], t)
+        expected = tracks.densify(frames)
+        for id_sk, skeleton in tracks.densify(decimated)['skeletons'].items():
+            values = skeleton if isinstance(skeleton, dict) else {None: skeleton}
+            expected_values = expected['skeletons'][id_sk]
+            expected_values = expected_values if isinstance(expected_values, dict) else {None: expected_values}
+            for key, value in values.items():
+                np.testing.assert_array_equal(value, expected_values[key][indices])
+                assert not np.shares_memory(value, frames['skeletons'][id_sk] if key is None
+                                            else frames['skeletons'][id_sk][key])
+    data = plot_data(intermediates, step=step)
+    for id_br, accel in data['bracelets'].items():
+        t = intermediates['bracelets'][id_br]['t']
+        assert accel['t'][0] == t[0] and accel['t'][-1] == t[-1] and len(accel['t']) <= len(t) // step + 2
+        assert set(accel) == {'t', 'ax', 'ay', 'az'}
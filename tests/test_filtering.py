@@ -0,0 +1,93 @@
+import os
+import sys
+import subprocess
+import numpy as np
+import pytest
+
+from scipy.signal import savgol_coeffs as scipy_savgol_coeffs, savgol_filter, wiener
+from mpit.utils.conversion import finite_difference
+from mpit.utils.filtering import DifferentiatorStream, SavgolFilter, WienerStream, savgol_coeffs, smooth_points, \
+    smoother
+
+
+def stream_chunks(stream, t, x, sizes):
+    """ Outputs of a stream fed with consecutive chunks of the given sizes """
+    outputs_t, outputs = [], []
+    start = 0
+    for size in sizes:
+        t_out, y = stream.process(t[start:start + size], x[start:start + size])
+        outputs_t.append(t_out)
+        outputs.append(y)
+        start += size
+    return np.concatenate(outputs_t), np.concatenate(outputs)
+
+
+def test_differentiator_stream():
+    rng = np.random.default_rng(1)
+    window = 5
+    t = np.cumsum(rng.uniform(0.03, 0.04, 120))
+    x = rng.normal(size=120)
+    # An all NaN chunk, skipped as the NaN samples of the batch conversion
+    x[40:50] = np.nan
+    stream = DifferentiatorStream(window=window, poly=1, lag=window // 2)
+    # Empty polls, also before the first samples
+    t_out, y = stream_chunks(stream, t, x, [0, 13, 0, 27, 10, 0, 33, 37, 0])
+    valid = ~np.isnan(x)
+    velocity = finite_difference(t[valid], x[valid])
+    smoothed = smooth_points(velocity.copy(), velocity.copy(), velocity.copy(), window=window, poly=1)[0]
+    # With lag = window // 2 every output is away from the edges of the batch filter
+    first = window // 2
+    np.testing.assert_array_equal(t_out, t[valid][:-1][first:first + len(y)])
+    np.testing.assert_allclose(y, smoothed[first:first + len(y)], rtol=1e-10, atol=1e-10)
+    assert len(y) == len(velocity) - window + 1
+
+
+def test_wiener():
+    rng = np.random.default_rng(2)
+    x = np.sin(np.linspace(0, 10, 300)) + rng.normal(0, 0.3, 300)
+    window = 7
+    # Both spellings smooth in batch
+    for name in ("weiner", "wiener"):
+        assert smoother(name) == "wiener"
+        px = smooth_points(x.copy(), x.copy(), x.copy(), smooth_filter=name, window=window)[0]
+        np.testing.assert_allclose(px, wiener(x, window))
+    # The stream with a given noise equals the batch filter away from the edges
+    noise = 0.09
+    t_out, y = stream_chunks(WienerStream(window=window, noise=noise, lag=window // 2), np.arange(300.), x,
+                             [50, 0, 100, 150])
+    np.testing.assert_allclose(y, wiener(x, window, noise=noise)[window // 2:window // 2 + len(y)], rtol=1e-10)
+
+
+def test_savgol_filter():
+    rng = np.random.default_rng(0)
+    for window, poly in ((7, 1), (5, 2), (35, 1), (6, 1), (8, 3)):
+        # Inputs as short as the window are only edges
+        for n in (window, window + 1, 2 * window, 200):
+            x = rng.normal(size=n)
+            np.testing.assert_allclose(SavgolFilter(window, poly)(x), savgol_filter(x, window, poly), rtol=1e-10,
+                                       atol=1e-10, err_msg=str((window, poly, n)))
+        # Shorter inputs are rejected as by scipy
+        x = rng.normal(size=window - 1)
+        with pytest.raises(ValueError):
+            savgol_filter(x, window, poly)
+        with pytest.raises(ValueError):
+            SavgolFilter(window, poly)(x)
+
+
+def test_savgol_coeffs():
+    for window in range(2, 40):
+        for poly in range(min(window, 5)):
+            for deriv in range(3):
+                for pos in (None, 0, window // 2, window - 1):
+                    np.testing.assert_allclose(savgol_coeffs(window, poly, deriv=deriv, delta=0.03, pos=pos),
+                                               scipy_savgol_coeffs(window, poly, deriv=deriv, delta=0.03, pos=pos,
+                                                                   use='dot'),
+                                               rtol=1e-12, atol=1e-12, err_msg=str((window, poly, deriv, pos)))
+
+
+def test_pipeline_imports():
+    # Building a pipeline must not import scipy.signal, which is slow to import (in a new interpreter, the tests import
+    # it in this one)
+    code = "import sys; from mpit.pipeline import Pipeline; Pipeline(); print('scipy.signal' in sys.modules)"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.check_output([sys.executable, "-c", code], cwd=root, text=True).strip() == "False"
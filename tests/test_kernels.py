@@ -0,0 +1,117 @@
+import numpy as np
+import similaritymeasures
+import mpit.utils.kernels as kernels
+
+from mpit.comparison import dtw_distance, dtw_distances
+from mpit.utils.conversion import finite_difference, valid_difference, rotation_axes, project
+
+
+def with_backends(function, *args):
+    """ Results of function with the NumPy and, if installed, the numba kernels """
+    results = {}
+    for backend in ("numpy", "numba"):
+        if backend == "numba" and not kernels.numba_available():
+            continue
+        kernels.set_backend(backend)
+        try:
+            results[backend] = function(*args)
+        finally:
+            kernels.set_backend("auto")
+    return results
+
+
+def random_series(rng, n, fps, dtype=np.float64):
+    t = np.sort(rng.uniform(0, n / fps, n))
+    return np.stack((t, rng.normal(size=n)), axis=-1).astype(dtype)
+
+
+def test_dtw():
+    rng = np.random.default_rng(0)
+    for n, m in ((1, 1), (1, 7), (9, 1), (60, 100), (300, 500)):
+        sk_data = random_series(rng, n, 30)
+        bracelet_data = random_series(rng, m, 50)
+        reference, d = similaritymeasures.dtw(sk_data, bracelet_data)
+        for backend, distance in with_backends(dtw_distance, sk_data, bracelet_data).items():
+            assert np.isclose(distance, reference, rtol=1e-12), (backend, n, m, distance, reference)
+        # Banded DTW is the same with both backends and never lower than the unconstrained one
+        banded = with_backends(dtw_distance, sk_data, bracelet_data, 0.2)
+        for backend, distance in banded.items():
+            assert np.isclose(distance, banded["numpy"], rtol=1e-12), (backend, n, m)
+            assert distance >= reference * (1 - 1e-12), (backend, n, m)
+
+
+def test_dtw_fused():
+    rng = np.random.default_rng(3)
+    for n, m in ((2, 2), (2, 9), (12, 2), (60, 100), (300, 500)):
+        sk_data = random_series(rng, n, 30)
+        bracelet_data = random_series(rng, m, 50)
+        # Derivatives at the times of the values without the last one, as in compare_accel_fused
+        sk_der = np.stack((sk_data[:-1, 0], rng.normal(size=n - 1)), axis=-1)
+        bracelet_der = np.stack((bracelet_data[:-1, 0], rng.normal(size=m - 1)), axis=-1)
+        for band in (None, 0.2):
+            separate = (dtw_distance(sk_data, bracelet_data, band), dtw_distance(sk_der, bracelet_der, band))
+            fused = with_backends(dtw_distances, sk_data, bracelet_data, sk_der, bracelet_der, band)
+            for backend, distances in fused.items():
+                np.testing.assert_allclose(distances, separate, rtol=1e-12, err_msg=backend)
+        # Joint DTW of both features reduces to the one of the values with all the weight on them
+        sk_joint = np.column_stack((sk_data[:-1], sk_der[:, 1]))
+        bracelet_joint = np.column_stack((bracelet_data[:-1], bracelet_der[:, 1]))
+        reference = dtw_distance(sk_data[:-1], bracelet_data[:-1])
+        for weights in ((1.0, 0.0), (0.7, 0.3)):
+            joint = with_backends(dtw_distance, sk_joint, bracelet_joint, None, np.array(weights))
+            for backend, distance in joint.items():
+                assert np.isclose(distance, joint["numpy"], rtol=1e-12), (backend, n, m, weights)
+                if weights[1] == 0:
+                    assert np.isclose(distance, reference, rtol=1e-12), (backend, n, m)
+
+
+def test_differences():
+    rng = np.random.default_rng(1)
+    t = np.cumsum(rng.uniform(0.01, 0.05, 200)) + 1.6e9
+    for dtype in (np.float64, np.float32):
+        values = rng.normal(size=200).astype(dtype)
+        values[[0, 5, 6, 7, 100, 199]] = np.nan
+        # Reference implementations
+        finite = np.divide(np.diff(values), np.diff(t)).astype(dtype)
+        valids = np.flatnonzero(~np.isnan(values))
+        valid = np.full(199, np.nan, dtype=dtype)
+        valid[valids[:-1]] = np.diff(values[valids]) / np.diff(t[valids])
+        for backend, result in with_backends(finite_difference, t, values).items():
+            assert result.dtype == dtype, backend
+            np.testing.assert_allclose(result, finite, rtol=1e-6, err_msg=backend)
+        for backend, result in with_backends(valid_difference, t, values).items():
+            assert result.dtype == dtype, backend
+            np.testing.assert_allclose(result, valid, rtol=1e-6, err_msg=backend)
+        for function in (finite_difference, valid_difference):
+            for result in with_backends(function, t[:1], values[:1]).values():
+                assert len(result) == 0
+
+
+def test_rotation():
+    rng = np.random.default_rng(2)
+    for dtype, rtol in ((np.float64, 1e-12), (np.float32, 1e-4)):
+        directions = rng.normal(size=(500, 3)).astype(dtype)
+        directions[10] = np.nan
+        directions[11] = (1, 0, 0)
+        accelerations = rng.normal(size=(500, 3)).astype(dtype)
+        axes = with_backends(rotation_axes, directions)
+        for backend, (u, v, w) in axes.items():
+            for axis, reference in zip((u, v, w), axes["numpy"]):
+                assert axis.dtype == dtype, backend
+                np.testing.assert_allclose(axis, reference, rtol=rtol, atol=rtol, err_msg=backend)
+            # Rotated axes are orthonormal
+            valid = ~np.isnan(u[:, 0])
+            np.testing.assert_allclose(np.cross(u[valid], v[valid]), w[valid], atol=10 * rtol, err_msg=backend)
+        projections = with_backends(project, accelerations, *axes["numpy"])
+        for backend, components in projections.items():
+            for component, reference in zip(components, projections["numpy"]):
+                assert component.dtype == dtype, backend
+                np.testing.assert_allclose(component, reference, rtol=rtol, atol=rtol, err_msg=backend)
+
+
+if __name__ == "__main__":
+    test_dtw()
+    test_dtw_fused()
+    test_differences()
+    test_rotation()
+    print("Kernels equivalent with the backends:", "numpy, numba" if kernels.numba_available() else "numpy")
@@ -0,0 +1,96 @@
+import numpy as np
+
+import mpit.core as core
+from mpit.algorithms import identify_and_track, identify_and_track_multi_camera
+from tests.synthetic import recording
+
+# Joint layout of the second camera, with the elbow and the wrist of the Intel layout at other indexes
+LAYOUT = {'elbow': 2, 'wrist': 3, 'tot_points': 5}
+
+
+def relabel(frames, people):
+    """ Frames of a second camera seeing some of the people, with its own skeleton ids and joint layout """
+    relabeled = []
+    for frame in frames:
+        skeletons = {}
+        for id_sk in people:
+            joints = [[0.0] * 3 for _ in range(LAYOUT['tot_points'])]
+            joints[LAYOUT['elbow']] = frame['skeletons'][id_sk]['joints3D'][6]
+            joints[LAYOUT['wrist']] = frame['skeletons'][id_sk]['joints3D'][7]
+            skeletons["b" + id_sk] = {'confidences': [0.9] * LAYOUT['tot_points'], 'joints': [], 'joints3D': joints}
+        relabeled.append({'timestamp': frame['timestamp'], 'skeletons': skeletons})
+    return relabeled
+
+
+def cameras_of(frames):
+    return {'a': {'frames': frames},
+            'b': {'frames': relabel(frames, ["100", "101"]), 'camera': LAYOUT, 'camera_angle': 10},
+            'empty': {'frames': []}}
+
+
+def pairs(associations):
+    return {(association.get('camera'), association['skeleton_id'], association['bracelet_id'])
+            for association in associations}
+
+
+def alone(cameras, accels):
+    """ Associations of each camera processed alone, with its own joint layout and angle """
+    associations = set()
+    for name, camera in cameras.items():
+        associations |= {(name, id_sk, id_br) for _, id_sk, id_br in
+                         pairs(identify_and_track(camera['frames'], accels, camera=camera.get('camera', "Intel"),
+                                                  camera_angle=camera.get('camera_angle', 0)))}
+    return associations
+
+
+def test_overlapping_views():
+    frames, accels = recording(duration=10)
+    cameras = cameras_of(frames)
+    # Each camera is assigned as if it was alone
+    expected = alone(cameras, accels)
+    assert {("a", "100", "br0"), ("a", "101", "br1"), ("a", "102", "br2")} <= expected
+    assert len(expected) == 5
+    associations = identify_and_track_multi_camera(cameras, accels, overlapping_views=True)
+    assert pairs(associations) == expected
+    # Without overlapping views each bracelet is associated once among all the cameras
+    associations = identify_and_track_multi_camera(cameras, accels, overlapping_views=False)
+    bracelets = [association['bracelet_id'] for association in associations]
+    assert sorted(bracelets) == ["br0", "br1", "br2"]
+    skeletons = [(association['camera'], association['skeleton_id']) for association in associations]
+    assert len(set(skeletons)) == 3 and "empty" not in {camera for camera, _ in skeletons}
+    assert identify_and_track_multi_camera({'empty': {'frames': []}}, accels) == []
+
+
+def test_invalid_bracelet(monkeypatch):
+    frames, accels = recording(duration=10)
+    cameras = cameras_of(frames)
+    # br1 is discarded in camera b only: its association is the one of camera b alone without br1
+    expected = alone({'a': cameras['a']}, accels) | \
+        alone({'b': cameras['b']}, [sample for sample in accels if sample['id'] != "br1"])
+    association_costs = core.association_costs
+
+    def invalid_in_b(rotated_accel, accel_bracelet, *args, **kwargs):
+        """ Costs of the skeletons of camera b with br1 are NaN, e.g. timestamps of br1 not valid for this camera """
+        costs, present, rows, columns = association_costs(rotated_accel, accel_bracelet, *args, **kwargs)
+        if len(rows) > 0 and all(id_sk.startswith("b") for id_sk in rows):
+            costs = costs.copy()
+            costs[:, columns.index("br1")] = np.nan
+        return costs, present, rows, columns
+
+    monkeypatch.setattr(core, "association_costs", invalid_in_b)
+    associations = identify_and_track_multi_camera(cameras, accels, overlapping_views=True)
+    assert ("a", "101", "br1") in pairs(associations)
+    assert pairs(associations) == expected
+    # With one assignment among all the cameras it is discarded for all of them
+    associations = identify_and_track_multi_camera(cameras, accels, overlapping_views=False)
+    assert "br1" not in {association['bracelet_id'] for association in associations}
+
+
+def test_solve_association_groups():
+    costs = np.array([[1.0, 2.0], [2.0, 1.0], [np.nan, 1.0], [3.0, 3.0]])
+    present = np.ones(costs.shape, dtype=bool)
+    present[3, 1] = False
+    groups = np.array([0, 0, 1, 1])
+    assert core.solve_association(costs, present, groups=groups) == [(0, 0), (1, 1), (2, 1)]
+    # Together, column 0 is discarded for all the rows
+    assert core.solve_association(costs, present) == [(1, 1)]
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from mpit.pipeline import Pipeline
+from tests.synthetic import recording
+
+
+def assert_same(result, expected):
+    """ Recursive comparison of the outputs of the stages, arrays must be equal (NaN at the same places) """
+    if isinstance(expected, dict):
+        assert list(result) == list(expected)
+        for key in expected:
+            assert_same(result[key], expected[key])
+    elif isinstance(expected, np.ndarray):
+        assert result.dtype == expected.dtype
+        np.testing.assert_array_equal(result, expected)
+    else:
+        assert result == expected
+
+
+@pytest.mark.parametrize("params", [{}, {'similarity_band': 0.5, 'similarity_min_overlap': 8.0},
+                                    {'similarity_joint': True, 'similarity_band': 0.5}])
+def test_executor(params):
+    skeleton_list, accel_list = recording(duration=12, people=5, seed=4)
+    # Skeleton 103 appears after 5 s, its track is shorter and with min_overlap its pairs are not compared
+    for frame in skeleton_list[:150]:
+        del frame['skeletons']['103']
+    serial = {}
+    associations = Pipeline(**params).run(skeleton_list, accel_list, intermediates=serial)
+    assert len(associations) >= 4
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for _ in range(3):
+            parallel = {}
+            assert Pipeline(executor=executor, **params).run(skeleton_list, accel_list,
+                                                             intermediates=parallel) == associations
+            for stage in ('wrist', 'elbow', 'directions', 'rotated_accelerations', 'costs'):
+                assert_same(parallel[stage], serial[stage])
@@ -0,0 +1,40 @@
+import numpy as np
+
+from mpit.pipeline import Pipeline
+from mpit.utils.precision import array_nbytes, memory_report
+from tests.synthetic import recording
+
+STAGES = ('bracelets', 'wrist', 'elbow', 'directions', 'rotated_accelerations')
+
+
+def arrays(structure, key=None):
+    """ (key, array) pairs of the numpy arrays of a pipeline structure """
+    if isinstance(structure, np.ndarray):
+        return [(key, structure)]
+    if isinstance(structure, dict):
+        return [pair for name, value in structure.items() for pair in arrays(value, name)]
+    return []
+
+
+def test_float32():
+    frames, accels = recording(duration=12)
+    results = {}
+    for dtype in ("float64", "float32"):
+        memory, intermediates = {}, {}
+        associations = Pipeline(dtype=dtype).run(frames, accels, memory=memory, intermediates=intermediates)
+        results[dtype] = associations, memory, intermediates
+        for stage in STAGES:
+            for key, values in arrays(intermediates[stage]):
+                # Absolute timestamps do not fit in float32
+                assert values.dtype == (np.float64 if key == 't' else np.dtype(dtype)), (stage, key)
+        # The memory of each stage is the size of its output, the report total is the sum of the stages
+        for stage in ('bracelets', 'directions', 'rotated_accelerations'):
+            assert memory[stage] == array_nbytes(intermediates[stage])
+        assert memory_report(memory).splitlines()[-1].split()[1] == "%.1f" % (sum(memory.values()) / 1024)
+    associations, memory, _ = results["float32"]
+    assert associations == results["float64"][0]
+    # Only the timestamps are not halved
+    for stage in ('bracelets', 'directions', 'rotated_accelerations'):
+        assert memory[stage] == sum(values.nbytes if key == 't' else values.nbytes // 2
+                                    for key, values in arrays(results["float64"][2][stage]))
+    assert memory['positions'] < results["float64"][1]['positions']
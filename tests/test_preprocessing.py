@@ -0,0 +1,114 @@
+import numpy as np
+
+import mpit.utils.preprocessing as preproc
+import mpit.utils.tracks as tracks
+from mpit.pipeline import Pipeline
+from tests.synthetic import recording
+
+
+def dense_extraction(monkeypatch):
+    """ Make the pipeline extract the positions on all the frames of the window, as before the sparse blocks """
+    get_positions_one_point = preproc.get_positions_one_point
+
+    def dense(*args, **kwargs):
+        return get_positions_one_point(*args, **dict(kwargs, sparse=False))
+
+    monkeypatch.setattr(preproc, "get_positions_one_point", dense)
+
+
+def test_sparse_positions(monkeypatch):
+    frames, accels = recording(duration=30, people=4, seed=2)
+    for k, frame in enumerate(frames):
+        # Skeleton 101 appears after 8 s, 102 is missing for 2 s, 103 is seen only between 20 and 27 s
+        if k < 240:
+            del frame['skeletons']['101']
+        if 300 <= k < 360:
+            del frame['skeletons']['102']
+        if not 600 <= k < 810:
+            del frame['skeletons']['103']
+    sparse, sparse_memory = {}, {}
+    associations = Pipeline().run(frames, accels, memory=sparse_memory, intermediates=sparse)
+    assert len(associations) == 4
+    dense_extraction(monkeypatch)
+    dense, dense_memory = {}, {}
+    assert Pipeline().run(frames, accels, memory=dense_memory, intermediates=dense) == associations
+    for stage in ('wrist', 'elbow', 'directions', 'rotated_accelerations'):
+        result = tracks.densify(sparse[stage])
+        np.testing.assert_array_equal(result['t'], dense[stage]['t'])
+        assert sorted(result['skeletons']) == sorted(dense[stage]['skeletons'])
+        for id_sk, expected in dense[stage]['skeletons'].items():
+            if stage == 'rotated_accelerations':
+                # The directions u, v, w are compared above, the blocks end with the last acceleration
+                expected = {key: expected[key] for key in ('au', 'av', 'aw')}
+            if isinstance(expected, dict):
+                for key, values in expected.items():
+                    np.testing.assert_array_equal(result['skeletons'][id_sk][key], values)
+            else:
+                np.testing.assert_array_equal(result['skeletons'][id_sk], expected)
+    # Only the frames of the tracks are extracted: 240 frames less for 101 and 690 for 103, of 3 float64 coordinates
+    # for the wrist and the elbow (the gap of 102 is inside its block)
+    assert dense_memory['positions'] - sparse_memory['positions'] == (240 + 690) * 3 * 8 * 2
+    assert sparse_memory['directions'] < dense_memory['directions']
+
+
+def frame(timestamp, **skeletons):
+    """ Frame with skeletons of 3 joints, joints3D[j] = [value, value, value + j] """
+    return {'timestamp': timestamp,
+            'skeletons': {id_sk: {'confidences': [0.9] * 3, 'joints': [],
+                                  'joints3D': [[value, value, value + j] for j in range(3)]}
+                          for id_sk, value in skeletons.items()}}
+
+
+def test_scan_select():
+    frames = [frame(k * 0.5, a=k) if not 3 <= k < 6 else frame(k * 0.5, a=k, b=10 + k) for k in range(8)]
+    frames[7]['skeletons']['c'] = frames[7]['skeletons']['a']
+    scan = preproc.scan_skeletons(frames)
+    np.testing.assert_array_equal(scan['t'], np.arange(8) * 0.5)
+    assert scan['skeletons'] == {'a': {'first': 0, 'last': 7, 'frames': 8},
+                                 'b': {'first': 3, 'last': 5, 'frames': 3},
+                                 'c': {'first': 7, 'last': 7, 'frames': 1}}
+    assert preproc.select_skeletons(scan) == ["a", "b", "c"]
+    # b lasts 1 s, a 3.5 s
+    assert preproc.select_skeletons(scan, min_duration=1.0) == ["a", "b"]
+    assert preproc.select_skeletons(scan, min_duration=1.5) == ["a"]
+    assert preproc.select_skeletons(scan, min_frames=2) == ["a", "b"]
+    # Only the selected ids are extracted, as blocks from their first to their last frame
+    positions = preproc.get_positions_one_point(frames, 1, 3, verbose=0, ids=["b"], scan=scan, sparse=True)
+    assert list(positions['skeletons']) == ["b"] and positions['starts'] == {'b': 3}
+    np.testing.assert_array_equal(positions['skeletons']['b']['pz'], [14, 15, 16])
+
+
+def test_short_skeleton():
+    frames, accels = recording(duration=12, people=3)
+    # Skeleton 102 is seen for 4 s only, less than skeleton_min_duration
+    for k, skeletons_frame in enumerate(frames):
+        if not 100 <= k < 220:
+            del skeletons_frame['skeletons']['102']
+    intermediates = {}
+    associations = Pipeline(skeleton_min_duration=5).run(frames, accels, intermediates=intermediates)
+    assert "102" not in intermediates['wrist']['skeletons']
+    assert sorted(intermediates['wrist']['skeletons']) == ["100", "101"]
+    assert {association['skeleton_id'] for association in associations} == {"100", "101"}
+    intermediates = {}
+    Pipeline(skeleton_min_duration=3).run(frames, accels, intermediates=intermediates)
+    assert "102" in intermediates['wrist']['skeletons']
+
+
+def test_invalid_points():
+    frames = [frame(k, a=k, b=10 + k) for k in range(6)]
+    # Low confidence of the joint 1 of a, missing confidences of b
+    frames[1]['skeletons']['a']['confidences'][1] = 0.2
+    frames[2]['skeletons']['a']['confidences'][2] = 0.2
+    frames[3]['skeletons']['b']['confidences'] = []
+    # Corrupted frame of a: the order of the joints is unknown
+    frames[4]['skeletons']['a']['joints3D'].pop()
+    # Invalid point of b
+    frames[5]['skeletons']['b']['joints3D'][1] = [0, 0, -1]
+    positions = preproc.get_positions_one_point(frames, 1, 3, verbose=0, min_confidence=0.5)
+    np.testing.assert_array_equal(positions['skeletons']['a']['px'], [0, np.nan, 2, 3, np.nan, 5])
+    np.testing.assert_array_equal(positions['skeletons']['b']['px'], [10, 11, 12, 13, 14, np.nan])
+    np.testing.assert_array_equal(positions['skeletons']['b']['pz'], [11, 12, 13, 14, 15, np.nan])
+    # Without min_confidence only the corrupted frame and the invalid point are discarded
+    positions = preproc.get_positions_one_point(frames, 1, 3, verbose=0)
+    np.testing.assert_array_equal(positions['skeletons']['a']['py'], [0, 1, 2, 3, np.nan, 5])
+    np.testing.assert_array_equal(positions['skeletons']['b']['py'], [10, 11, 12, 13, 14, np.nan])
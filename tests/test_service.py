@@ -0,0 +1,108 @@
+import json
+import asyncio
+import mpit.utils.kernels as kernels
+
+from mpit.cli import build_parser, pit_params, load_data
+from mpit.algorithms import identify_and_track_windows
+from mpit.service import PITService, SourceQueue, replay, listen
+from tests.synthetic import T0, recording
+
+
+async def run_service(skeleton_list, accel_list, window=10, lateness=1.0, verbose=0, **params):
+    # Service listening on a free local port
+    service = PITService(window=window, lateness=lateness, verbose=verbose, **params)
+    server = await service.start(host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    # One subscriber over the socket, as a downstream consumer would do
+    results = []
+
+    async def subscriber():
+        async for result in listen(port=port):
+            results.append(result)
+
+    listener = asyncio.create_task(subscriber())
+    # Wait for the subscription to be registered
+    while len(service.subscribers) == 0:
+        await asyncio.sleep(0.01)
+    # Stand-in gateways replaying the recorded data, the listener stops when the service is flushed
+    await replay(skeleton_list, accel_list, port=port)
+    await listener
+    await service.close()
+    return results, service.stats
+
+
+def batch_windows(skeleton_list, accel_list, window=10, **params):
+    """ Associations of each window of identify_and_track_windows by start timestamp """
+    windows = {}
+    identify_and_track_windows(skeleton_list, accel_list, window=window,
+                               on_window=lambda ts, associations, intermediates: windows.update({ts: associations}),
+                               **params)
+    return windows
+
+
+def test_replay():
+    skeleton_list, accel_list = recording(duration=30)
+    # No frames in the second window, the service skips it
+    skeleton_list = [frame for frame in skeleton_list if not T0 + 10 <= frame['timestamp'] < T0 + 20]
+    results, stats = asyncio.run(run_service(skeleton_list, accel_list))
+    assert stats['windows'] == 2 and stats['windows_skipped'] == 1
+    assert stats['dropped_full'] == stats['dropped_late'] == stats['invalid'] == 0
+    batch = batch_windows(skeleton_list, accel_list)
+    assert batch.pop(T0 + 10) == []
+    assert {result['ts_start']: result['associations'] for result in results} == batch
+
+
+def frame(timestamp):
+    return {'timestamp': timestamp, 'skeletons': {}}
+
+
+def test_source_queue():
+    queue = SourceQueue(max_size=6)
+    # In order, equal and late timestamps, the late ones are inserted after the items with the same timestamp
+    for timestamp, item in ((1, "a"), (3, "b"), (3, "c"), (2, "d"), (5, "e"), (3, "f")):
+        assert queue.put(timestamp, item)
+    assert not queue.put(6, "g")
+    assert len(queue) == 6 and queue.timestamps[0] == 1
+    assert queue.pop_until(1) == []
+    assert queue.pop_until(3) == ["a", "d"]
+    assert queue.pop_until(4) == ["b", "c", "f"]
+    assert queue.put(4, "h") and queue.put(6, "i")
+    assert queue.pop_until(10) == ["h", "e", "i"]
+    assert len(queue) == 0 and queue.pop_until(10) == []
+
+
+def test_closed_windows():
+    service = PITService(window=10, lateness=1.0, max_advance=60.0)
+    for t in range(25):
+        service.put(frame(T0 + t))
+    assert [window[0] for window in service.closed_windows()] == [T0, T0 + 10]
+    # A frame far ahead moves the watermark by max_advance only and closes the windows in one jump
+    service.put(frame(T0 + 1e6))
+    assert service.watermark == T0 + 24 + 60 and service.stats['watermark_bounded'] == 1
+    assert [window[0] for window in service.closed_windows()] == [T0 + 20]
+    assert service.window_start == T0 + 80 and service.stats['windows_skipped'] == 5
+    # Late items of the skipped windows are dropped
+    assert not service.put(frame(T0 + 70))
+    for t in range(85, 100):
+        service.put(frame(T0 + t))
+    assert [window[0] for window in service.closed_windows()] == [T0 + 80]
+    assert [window[0] for window in service.closed_windows(flush=True)] == [T0 + 90, T0 + 1e6]
+
+
+def test_dropped():
+    service = PITService(max_queue_size=2)
+    samples = [{'x': 0, 'y': 0, 'z': 0, 'timestamp': T0 + t, 'id': "br0"} for t in range(3)]
+    assert [service.put(sample) for sample in samples] == [True, True, False]
+    assert service.stats['dropped_full'] == 1 and service.dropped == {"br0": 1}
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    kernels.set_backend(args.kernels)
+    skeleton_list = load_data(args.skeleton_path)
+    accel_list = load_data(args.accelerometer_path)
+    results, stats = asyncio.run(run_service(skeleton_list, accel_list, window=args.window, verbose=args.verbose,
+                                             **pit_params(args)))
+    for result in results:
+        print(json.dumps(result))
+    print("Service statistics:", stats)
@@ -0,0 +1,116 @@
+import numpy as np
+
+from mpit.timeline import AssociationTimeline
+
+
+def association(ts_start, ts_end, skeleton_id, bracelet_id, camera=None):
+    association = {'ts_start': ts_start, 'ts_end': ts_end, 'skeleton_id': skeleton_id, 'bracelet_id': bracelet_id}
+    if camera is not None:
+        association['camera'] = camera
+    return association
+
+
+def overlapping(timeline, t_start, t_end, skeleton_id=None, bracelet_id=None):
+    """ Brute force query of the intervals of a timeline """
+    intervals = [timeline.interval(row) for row in range(len(timeline))]
+    return sorted((interval for interval in intervals
+                   if interval['ts_start'] <= t_end and interval['ts_end'] >= t_start
+                   and skeleton_id in (None, interval['skeleton_id'])
+                   and bracelet_id in (None, interval['bracelet_id'])),
+                  key=lambda interval: interval['ts_start'])
+
+
+def test_merge_on_append():
+    timeline = AssociationTimeline(max_gap=1.0)
+    timeline.extend([[association(0, 10, 1, "br0"), association(0, 10, 2, "br1")],
+                     [association(10, 20, 1, "br0"), association(10, 20, 2, "br0")],
+                     # 1 -> br0 again after a gap larger than max_gap
+                     [association(25, 30, 1, "br0")]])
+    assert len(timeline) == 4
+    assert timeline.skeleton_intervals(1, 0, 30) == [association(0.0, 20.0, "1", "br0"),
+                                                     association(25.0, 30.0, "1", "br0")]
+    assert timeline.bracelet_intervals("br0", 15, 15) == [association(0.0, 20.0, "1", "br0"),
+                                                          association(10.0, 20.0, "2", "br0")]
+    assert timeline.bracelet_at(1, 22) is None
+    assert timeline.bracelet_at(2, 5) == "br1"
+    assert timeline.bracelet_at(2, 15) == "br0"
+    assert [interval['skeleton_id'] for interval in timeline.skeletons_at("br0", 18)] == ["1", "2"]
+    assert timeline.skeletons_at("br2", 18) == []
+    assert timeline.skeleton_intervals(3, 0, 30) == []
+
+
+def test_cameras():
+    timeline = AssociationTimeline()
+    timeline.append([association(0, 10, 1, "br0", camera="cam0"), association(0, 10, 1, "br1", camera="cam1")])
+    assert timeline.bracelet_at(1, 5, camera="cam0") == "br0"
+    assert timeline.bracelet_at(1, 5, camera="cam1") == "br1"
+    assert timeline.bracelet_at(1, 5) is None
+    assert timeline.skeletons_at("br1", 5) == [association(0.0, 10.0, "1", "br1", camera="cam1")]
+
+
+def test_queries():
+    rng = np.random.default_rng(3)
+    timeline = AssociationTimeline(max_gap=2.0)
+    # Windows of different lengths, mostly in time order, with queries interleaved with the appends
+    t = 0.
+    added = 0
+    for window in range(300):
+        length = rng.uniform(1, 20)
+        ts_start = t if rng.uniform() < 0.9 else max(0., t - rng.uniform(0, 100))
+        t += length + rng.exponential(1)
+        associations = [association(ts_start, ts_start + length, skeleton_id, "br%d" % rng.integers(5))
+                        for skeleton_id in rng.choice(5, size=rng.integers(1, 4), replace=False)]
+        timeline.append(associations)
+        added += len(associations)
+        t_start = rng.uniform(0, t)
+        t_end = t_start + rng.exponential(10)
+        for skeleton_id in map(str, range(5)):
+            assert timeline.skeleton_intervals(skeleton_id, t_start, t_end) == \
+                   overlapping(timeline, t_start, t_end, skeleton_id=skeleton_id)
+        for bracelet_id in ["br%d" % i for i in range(5)]:
+            assert timeline.bracelet_intervals(bracelet_id, t_start, t_end) == \
+                   overlapping(timeline, t_start, t_end, bracelet_id=bracelet_id)
+    # Some of the windows were merged
+    assert len(timeline) < added
+
+
+def test_extended_ends():
+    # A long interval extended after shorter ones started, the later queries must see its new end
+    timeline = AssociationTimeline(max_gap=1.0)
+    timeline.append([association(0, 10, 1, "br0")])
+    timeline.append([association(5, 6, 1, "br1")])
+    assert timeline.bracelet_at(1, 50) is None
+    timeline.append([association(10, 100, 1, "br0")])
+    timeline.append([association(60, 70, 1, "br1")])
+    assert [interval['bracelet_id'] for interval in timeline.skeleton_intervals(1, 50, 50)] == ["br0"]
+    assert [interval['bracelet_id'] for interval in timeline.skeleton_intervals(1, 65, 65)] == ["br0", "br1"]
+
+
+def test_compact():
+    timeline = AssociationTimeline(max_gap=1.0)
+    # Windows appended out of time order can not be merged while appending
+    timeline.extend([[association(20, 30, 1, "br0")], [association(0, 10, 1, "br0")],
+                     [association(10, 20, 1, "br0")], [association(10, 20, 2, "br1")]])
+    assert len(timeline) == 4
+    assert timeline.bracelet_at(1, 25) == "br0"
+    timeline.compact()
+    assert len(timeline) == 2
+    assert timeline.skeleton_intervals(1, 0, 30) == [association(0.0, 30.0, "1", "br0")]
+    assert timeline.bracelet_at(2, 15) == "br1"
+
+
+def test_save_load(tmp_path):
+    timeline = AssociationTimeline(max_gap=0.5)
+    timeline.extend([[association(0, 10, 1, "br0", camera="cam0"), association(0, 10, "a", "br1")],
+                     [association(10, 20, 1, "br0", camera="cam0"), association(10.25, 20, "a", "br2")]])
+    path = tmp_path / "timeline.npz"
+    timeline.save(path)
+    loaded = AssociationTimeline.load(path)
+    assert loaded.max_gap == 0.5
+    assert len(loaded) == len(timeline) == 3
+    for skeleton_id, camera in ((1, "cam0"), ("a", None)):
+        assert loaded.skeleton_intervals(skeleton_id, 0, 20, camera=camera) == \
+               timeline.skeleton_intervals(skeleton_id, 0, 20, camera=camera)
+    # New associations are merged with the loaded intervals
+    loaded.append([association(20, 30, 1, "br0", camera="cam0")])
+    assert loaded.skeleton_intervals(1, 0, 30, camera="cam0") == [association(0.0, 30.0, "1", "br0", camera="cam0")]